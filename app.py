@@ -281,6 +281,7 @@ st.markdown("""
         <li>Organizza le domande in set nella pagina <strong>Gestione Set di Domande</strong></li>
         <li>Esegui valutazioni nella pagina <strong>Esecuzione Test</strong> o utilizza <strong>Valutazione BM25</strong> per un'analisi basata sui termini</li>
         <li>Visualizza e analizza i risultati nella pagina <strong>Visualizzazione Risultati</strong></li>
+        <li>Confronta velocità, latenze, errori e costi dei preset nella pagina <strong>Dashboard Prestazioni</strong></li>
     </ol>
     <p>Utilizza la barra laterale a sinistra per navigare tra queste funzionalità.</p>
 </div>
@@ -351,7 +352,8 @@ pages = {
     "Gestione Set di Domande": "pages/gestione_set.py",
     "Configurazione API": "pages/api_configurazione.py",
     "Esecuzione Test": "pages/esecuzione_test.py",
-    "Visualizzazione Risultati": "pages/visualizza_risultati.py"
+    "Visualizzazione Risultati": "pages/visualizza_risultati.py",
+    "Dashboard Prestazioni": "pages/dashboard_prestazioni.py"
 }
 
 # Home è gestita in questo file, le altre sono in file separati
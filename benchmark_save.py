@@ -0,0 +1,147 @@
+"""
+Benchmark del salvataggio delle domande (save_questions) e dei risultati (save_results): confronta la
+sincronizzazione riga per riga (una UPDATE o INSERT per riga, una DELETE per riga rimossa) con quella
+a blocchi (INSERT ... ON DUPLICATE KEY UPDATE con executemany e DELETE ... IN) e stampa le righe al secondo.
+
+Le tabelle vengono svuotate e riscritte: il benchmark va eseguito su un database di prova, con le stesse
+credenziali di db.config, indicato con --database (viene creato se non esiste).
+
+Esempio:
+    python benchmark_save.py --database llm_benchmark --rows 1000 10000 100000
+"""
+import argparse
+import configparser
+import json
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import pandas as pd
+    from sqlalchemy import create_engine, text
+    from utils import db_utils
+    from utils.data_utils import ROW_SNAPSHOTS_KEY, save_questions, save_results
+    from utils.runtime_utils import session_state
+    from utils.term_index_utils import index_questions, remove_questions
+except ModuleNotFoundError as exc:
+    print("Modulo mancante. Installa le dipendenze con 'pip install -r requirements.txt'")
+    raise exc
+
+
+def _benchmark_engine(database: str):
+    """Motore SQLAlchemy sul database di prova, creato se non esiste."""
+    config = configparser.ConfigParser()
+    config.read(Path(__file__).resolve().parent / 'db.config')
+    cfg = config['mysql']
+    if database == cfg['database']:
+        raise SystemExit("Il benchmark riscrive le tabelle: indica un database di prova diverso da quello di db.config.")
+    server_url = f"mysql+pymysql://{cfg['user']}:{cfg['password']}@{cfg['host']}:{cfg.get('port', 3306)}"
+    with create_engine(server_url).begin() as conn:
+        conn.execute(text(f"CREATE DATABASE IF NOT EXISTS `{database}`"))
+    return create_engine(f"{server_url}/{database}")
+
+
+def _legacy_sync(conn, table: str, columns: list, rows: list):
+    """Sincronizzazione riga per riga, come prima delle scritture a blocchi."""
+    existing_ids = [str(row[0]) for row in conn.execute(text(f"SELECT id FROM {table}")).fetchall()]
+    incoming_ids = [row['id'] for row in rows]
+    for row_id in set(existing_ids) - set(incoming_ids):
+        conn.execute(text(f"DELETE FROM {table} WHERE id = :id"), {'id': row_id})
+    existing = set(existing_ids)
+    update = text(f"UPDATE {table} SET {', '.join(f'{c}=:{c}' for c in columns if c != 'id')} WHERE id=:id")
+    insert = text(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})")
+    for row in rows:
+        conn.execute(update if row['id'] in existing else insert, row)
+
+
+def legacy_save_questions(questions_df):
+    columns = ['id', 'domanda', 'risposta_attesa', 'categoria']
+    rows = questions_df[columns].astype(str).to_dict('records')
+    with db_utils.get_engine().begin() as conn:
+        existing = {row[0]: (row[1], row[2]) for row in
+                    conn.execute(text("SELECT id, domanda, risposta_attesa FROM questions")).fetchall()}
+        remove_questions(conn, list(set(existing) - {row['id'] for row in rows}))
+        index_questions(conn, [row for row in rows
+                               if existing.get(row['id']) != (row['domanda'], row['risposta_attesa'])])
+        _legacy_sync(conn, 'questions', columns, rows)
+
+
+def legacy_save_results(results_df):
+    df = results_df.copy()
+    df['results'] = df['results'].apply(json.dumps)
+    with db_utils.get_engine().begin() as conn:
+        _legacy_sync(conn, 'test_results', ['id', 'set_id', 'timestamp', 'results'], df.to_dict('records'))
+
+
+def _questions(n: int, revision: int = 0):
+    ids = [str(uuid.UUID(int=i)) for i in range(n)]
+    return pd.DataFrame({
+        'id': ids,
+        'domanda': [f"Quanto fa {i} + {revision}?" for i in range(n)],
+        'risposta_attesa': [str(i + revision) for i in range(n)],
+        'categoria': [f"categoria {i % 10}" for i in range(n)]
+    })
+
+
+def _results(n: int, revision: int = 0):
+    return pd.DataFrame({
+        'id': [str(uuid.UUID(int=i)) for i in range(n)],
+        'set_id': ["benchmark"] * n,
+        'timestamp': [f"2024-01-01 00:00:{revision:02d}"] * n,
+        'results': [{'avg_score': float(i % 100), 'revision': revision, 'questions': {}} for i in range(n)]
+    })
+
+
+def _clear_tables():
+    # Senza istantanea il primo salvataggio rilegge la tabella vuota (vedi data_utils.ROW_SNAPSHOTS_KEY)
+    session_state().pop(ROW_SNAPSHOTS_KEY, None)
+    with db_utils.get_engine().begin() as conn:
+        for table in ("questions", "test_results", "term_index_postings", "term_index_terms",
+                      "term_index_documents", "term_index_corpus"):
+            conn.execute(text(f"DELETE FROM {table}"))
+
+
+def _timed(function, frame):
+    started = time.perf_counter()
+    function(frame)
+    return len(frame) / (time.perf_counter() - started)
+
+
+def run_benchmark(sizes: list):
+    scenarios = [
+        ("domande", _questions, legacy_save_questions, save_questions),
+        ("risultati", _results, legacy_save_results, save_results),
+    ]
+    print(f"{'tabella':<10} {'righe':>8} {'operazione':<12} {'riga per riga':>16} {'a blocchi':>16} {'rapporto':>9}")
+    for label, make_frame, legacy, bulk in scenarios:
+        for n in sizes:
+            rates = {}
+            for name, function in (("legacy", legacy), ("bulk", bulk)):
+                _clear_tables()
+                # Inserimento in tabella vuota, poi aggiornamento di tutte le righe e rimozione del 10%
+                insert_rate = _timed(function, make_frame(n))
+                updated = make_frame(n, revision=1)
+                update_rate = _timed(function, updated.iloc[: n - n // 10].reset_index(drop=True))
+                rates[name] = (insert_rate, update_rate)
+            for index, operation in enumerate(("inserimento", "aggiornamento")):
+                before, after = rates["legacy"][index], rates["bulk"][index]
+                print(f"{label:<10} {n:>8} {operation:<12} {before:>12,.0f} r/s {after:>12,.0f} r/s {after / before:>8.1f}x")
+    _clear_tables()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark delle scritture riga per riga e a blocchi.")
+    parser.add_argument("--database", required=True, help="Database MySQL di prova (le tabelle vengono svuotate).")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000], help="Numero di righe.")
+    args = parser.parse_args(argv)
+    db_utils._engine = _benchmark_engine(args.database)
+    db_utils.init_db()
+    run_benchmark(args.rows)
+
+
+if __name__ == '__main__':
+    main()
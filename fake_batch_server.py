@@ -0,0 +1,267 @@
+"""
+Server di prova che imita gli endpoint /files e /batches del Batch API di OpenAI, per provare le
+esecuzioni tramite Batch API (utils/batch_utils.py) senza chiave API e senza costi.
+
+Ogni batch risulta 'in_progress' alla prima interrogazione e poi 'completed', con una risposta fittizia
+per ogni richiesta (un JSON di valutazione per le richieste con response_format). I batch indicati con
+--expire (per numero di creazione, da 0) scadono dopo aver prodotto solo la prima risposta, come un batch
+scaduto a metà; quelli indicati con --fail falliscono senza output.
+
+Esempi:
+    python fake_batch_server.py --port 8765 --expire 1
+    python fake_batch_server.py --check
+
+Con --check il server viene avviato su una porta libera e vengono verificate la ripresa dei batch già
+creati e l'uso degli output parziali in _run_batch_stage; il codice di uscita è 1 se una verifica fallisce.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from utils import batch_utils
+    from utils.openai_utils import get_openai_client
+except ModuleNotFoundError as exc:
+    print("Modulo mancante. Installa le dipendenze con 'pip install -r requirements.txt'")
+    raise exc
+
+
+class FakeBatchAPI:
+    """Stato del server: file caricati e batch creati, condivisi dai thread delle richieste."""
+
+    def __init__(self, expire=(), fail=()):
+        self.lock = threading.Lock()
+        self.reset(expire, fail)
+
+    def reset(self, expire=(), fail=()):
+        with self.lock:
+            self.files = {}
+            self.batches = {}
+            self.expire = set(expire)
+            self.fail = set(fail)
+
+    def add_file(self, filename: str, content: bytes, purpose: str):
+        file_id = f"file-{uuid.uuid4().hex[:12]}"
+        with self.lock:
+            self.files[file_id] = {"filename": filename, "content": content, "purpose": purpose,
+                                   "created_at": int(time.time())}
+        return self.file_object(file_id)
+
+    def file_object(self, file_id: str):
+        entry = self.files[file_id]
+        return {"id": file_id, "object": "file", "bytes": len(entry["content"]), "created_at": entry["created_at"],
+                "filename": entry["filename"], "purpose": entry["purpose"], "status": "processed"}
+
+    def create_batch(self, params: dict):
+        with self.lock:
+            index = len(self.batches)
+            batch_id = f"batch-{uuid.uuid4().hex[:12]}"
+            status = "failed" if index in self.fail else "expired" if index in self.expire else "completed"
+            self.batches[batch_id] = {
+                "id": batch_id, "object": "batch", "endpoint": params.get("endpoint"),
+                "input_file_id": params.get("input_file_id"), "completion_window": params.get("completion_window"),
+                "metadata": params.get("metadata"), "created_at": int(time.time()), "status": "validating",
+                "output_file_id": None, "error_file_id": None, "final_status": status, "polls": 0
+            }
+        return self.batch_object(batch_id)
+
+    def batch_object(self, batch_id: str):
+        batch = self.batches[batch_id]
+        return {key: value for key, value in batch.items() if key not in ("final_status", "polls")}
+
+    def poll_batch(self, batch_id: str):
+        """Prima interrogazione: 'in_progress'; dalla seconda lo stato finale, con i file di output."""
+        with self.lock:
+            batch = self.batches[batch_id]
+            batch["polls"] += 1
+            if batch["polls"] == 1:
+                batch["status"] = "in_progress"
+            elif batch["status"] == "in_progress":
+                self._finish(batch)
+        return self.batch_object(batch_id)
+
+    def _finish(self, batch: dict):
+        batch["status"] = batch["final_status"]
+        if batch["status"] == "failed":
+            return
+        lines = [json.loads(line) for line in self.files[batch["input_file_id"]]["content"].splitlines() if line.strip()]
+        if batch["status"] == "expired":
+            lines = lines[:1]
+        output = "".join(json.dumps(_output_line(line)) + "\n" for line in lines).encode("utf-8")
+        file_id = f"file-{uuid.uuid4().hex[:12]}"
+        self.files[file_id] = {"filename": f"{batch['id']}_output.jsonl", "content": output,
+                               "purpose": "batch_output", "created_at": int(time.time())}
+        batch["output_file_id"] = file_id
+
+
+def _output_line(request_line: dict):
+    """Riga del file di output del Batch API con una risposta fittizia alla richiesta."""
+    body = request_line.get("body", {})
+    if body.get("response_format"):
+        content = json.dumps({"score": 100, "explanation": "Valutazione di prova.",
+                              "similarity": 100, "correctness": 100, "completeness": 100})
+    else:
+        content = f"Risposta di prova a {request_line['custom_id']}."
+    return {
+        "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+        "custom_id": request_line["custom_id"],
+        "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "object": "chat.completion",
+            "created": int(time.time()), "model": body.get("model", "fake-model"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}
+        }},
+        "error": None
+    }
+
+
+class FakeBatchHandler(BaseHTTPRequestHandler):
+    """Endpoint /files, /files/{id}/content, /batches e /batches/{id}, con o senza prefisso /v1."""
+
+    def _path(self):
+        path = self.path.split("?", 1)[0].rstrip("/")
+        return path[len("/v1"):] if path.startswith("/v1/") else path
+
+    def _send(self, status: int, payload=None, raw: bytes = None):
+        data = raw if raw is not None else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream" if raw is not None else "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _not_found(self):
+        self._send(404, {"error": {"message": f"Risorsa non trovata: {self.path}", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        api = self.server.api
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self._path()
+        if path == "/files":
+            message = BytesParser(policy=default_policy).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8") + body
+            )
+            fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+            upload = fields["file"]
+            self._send(200, api.add_file(upload.get_filename() or "upload.jsonl", upload.get_payload(decode=True),
+                                         fields["purpose"].get_content().strip() if "purpose" in fields else ""))
+        elif path == "/batches":
+            self._send(200, api.create_batch(json.loads(body or b"{}")))
+        else:
+            self._not_found()
+
+    def do_GET(self):
+        api = self.server.api
+        parts = self._path().strip("/").split("/")
+        if len(parts) == 3 and parts[0] == "files" and parts[2] == "content" and parts[1] in api.files:
+            self._send(200, raw=api.files[parts[1]]["content"])
+        elif len(parts) == 2 and parts[0] == "files" and parts[1] in api.files:
+            self._send(200, api.file_object(parts[1]))
+        elif len(parts) == 2 and parts[0] == "batches" and parts[1] in api.batches:
+            self._send(200, api.poll_batch(parts[1]))
+        else:
+            self._not_found()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port: int = 0, expire=(), fail=()):
+    """
+    Avvia il server in un thread.
+    Returns:
+        Una tupla (server, URL base da usare come endpoint del preset, es. http://127.0.0.1:8765/v1).
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeBatchHandler)
+    server.api = FakeBatchAPI(expire, fail)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def run_checks():
+    """Verifica ripresa e output parziali di _run_batch_stage sul server di prova. Returns: True se passano tutte."""
+    server, base_url = start_server()
+    client = get_openai_client(api_key="chiave-di-prova", base_url=base_url)
+    requests = {f"q{i}": {"model": "fake-model", "messages": [{"role": "user", "content": f"Domanda {i}"}]}
+                for i in range(5)}
+    saved_max_requests = batch_utils.BATCH_MAX_REQUESTS
+    # Due richieste per batch: 5 richieste diventano 3 batch
+    batch_utils.BATCH_MAX_REQUESTS = 2
+    outcomes = []
+
+    def check(description, passed):
+        outcomes.append(passed)
+        print(f"{'OK    ' if passed else 'ERRORE'} {description}")
+
+    try:
+        # Il secondo batch scade dopo aver prodotto solo la risposta a q2
+        server.api.reset(expire={1})
+        saved = []
+        outputs = batch_utils._run_batch_stage(client, requests, "generazione", 0, None,
+                                               batch_ids_callback=saved.append)
+        check("ID salvati dopo ogni batch creato", [len(ids) for ids in saved] == [1, 2, 3])
+        check("Risposte di tutti i batch completati",
+              all(outputs[q_id]["body"] for q_id in ("q0", "q1", "q4")))
+        check("Risposta prodotta dal batch scaduto usata", bool(outputs["q2"]["body"]))
+        check("Richiesta senza risposta del batch scaduto segnata come errore",
+              outputs["q3"]["body"] is None and "expired" in (outputs["q3"]["error"] or ""))
+
+        created = len(server.api.batches)
+        resumed = batch_utils._run_batch_stage(client, requests, "generazione", 0, None, batch_ids=saved[-1])
+        check("Ripresa con tutti gli ID salvati: nessun nuovo batch", len(server.api.batches) == created)
+        check("Ripresa con tutti gli ID salvati: stessi output", resumed == outputs)
+
+        resumed_ids = []
+        batch_utils._run_batch_stage(client, requests, "generazione", 0, None, batch_ids=saved[-1][:1],
+                                     batch_ids_callback=resumed_ids.append)
+        check("Ripresa dopo un riavvio durante l'invio: creati solo i batch mancanti",
+              len(server.api.batches) == created + 2 and resumed_ids[-1][:1] == saved[-1][:1])
+
+        server.api.reset(fail={0, 1, 2})
+        try:
+            batch_utils._run_batch_stage(client, requests, "valutazione", 0, None)
+            check("Batch tutti falliti senza output: errore", False)
+        except RuntimeError as e:
+            check("Batch tutti falliti senza output: errore", "failed" in str(e))
+    finally:
+        batch_utils.BATCH_MAX_REQUESTS = saved_max_requests
+        server.shutdown()
+    return all(outcomes)
+
+
+def _indices(value: str):
+    return {int(index) for index in value.split(",") if index.strip()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Server di prova per gli endpoint /files e /batches del Batch API.")
+    parser.add_argument("--port", type=int, default=8765, help="Porta su cui avviare il server.")
+    parser.add_argument("--expire", type=_indices, default=set(),
+                        help="Batch (numero di creazione da 0, separati da virgola) che scadono a metà.")
+    parser.add_argument("--fail", type=_indices, default=set(),
+                        help="Batch (numero di creazione da 0, separati da virgola) che falliscono senza output.")
+    parser.add_argument("--check", action="store_true",
+                        help="Verifica ripresa e output parziali di _run_batch_stage ed esce.")
+    args = parser.parse_args(argv)
+    if args.check:
+        sys.exit(0 if run_checks() else 1)
+    server, base_url = start_server(args.port, args.expire, args.fail)
+    print(f"Server di prova del Batch API in ascolto: usa {base_url} come endpoint del preset (Ctrl+C per uscire).")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
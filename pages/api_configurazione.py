@@ -7,7 +7,7 @@ import pandas as pd
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 from utils.openai_utils import (
-    test_api_connection, DEFAULT_MODEL, DEFAULT_ENDPOINT
+    test_api_connection, DEFAULT_MODEL, DEFAULT_ENDPOINT, DEFAULT_MAX_CONCURRENCY
 )
 from utils.ui_utils import add_page_header, add_section_title, create_card
 from utils.data_utils import load_api_presets, save_api_presets, initialize_data
@@ -40,7 +40,10 @@ def start_new_preset_edit():
         "api_key": "",
         "model": DEFAULT_MODEL,
         "temperature": 0.0,
-        "max_tokens": 1000
+        "max_tokens": 1000,
+        "max_concurrency": DEFAULT_MAX_CONCURRENCY,
+        "requests_per_minute": 0,
+        "tokens_per_minute": 0
     }
 
 def start_existing_preset_edit(preset_id):
@@ -51,6 +54,9 @@ def start_existing_preset_edit(preset_id):
     # Assicura che i campi numerici siano del tipo corretto per gli slider/number_input
     st.session_state.preset_form_data["temperature"] = float(st.session_state.preset_form_data.get("temperature", 0.0))
     st.session_state.preset_form_data["max_tokens"] = int(st.session_state.preset_form_data.get("max_tokens", 1000))
+    st.session_state.preset_form_data["max_concurrency"] = int(st.session_state.preset_form_data.get("max_concurrency", DEFAULT_MAX_CONCURRENCY))
+    st.session_state.preset_form_data["requests_per_minute"] = int(st.session_state.preset_form_data.get("requests_per_minute", 0))
+    st.session_state.preset_form_data["tokens_per_minute"] = int(st.session_state.preset_form_data.get("tokens_per_minute", 0))
     if "endpoint" not in st.session_state.preset_form_data:
         st.session_state.preset_form_data["endpoint"] = DEFAULT_ENDPOINT
 
@@ -89,7 +95,10 @@ def save_preset_from_form():
         "api_key": form_data.get("api_key"),
         "model": form_data.get("model"),
         "temperature": float(form_data.get("temperature", 0.0)),
-        "max_tokens": int(form_data.get("max_tokens", 1000))
+        "max_tokens": int(form_data.get("max_tokens", 1000)),
+        "max_concurrency": int(form_data.get("max_concurrency", DEFAULT_MAX_CONCURRENCY)),
+        "requests_per_minute": int(form_data.get("requests_per_minute", 0)),
+        "tokens_per_minute": int(form_data.get("tokens_per_minute", 0))
     }
 
     if current_id: # Modifica preset esistente
@@ -160,6 +169,27 @@ if st.session_state.editing_preset:
 
         form_data["temperature"] = st.slider("Temperatura", 0.0, 2.0, float(form_data.get("temperature", 0.0)), 0.1)
         form_data["max_tokens"] = st.number_input("Max Tokens", min_value=50, max_value=8000, value=int(form_data.get("max_tokens", 1000)), step=50)
+        form_data["max_concurrency"] = st.number_input(
+            "Richieste Concorrenti Max",
+            min_value=1, max_value=100,
+            value=int(form_data.get("max_concurrency", DEFAULT_MAX_CONCURRENCY)), step=1,
+            help="Numero massimo di chiamate API eseguite in parallelo con questo preset durante i test."
+        )
+        cols_rate_limits = st.columns(2)
+        with cols_rate_limits[0]:
+            form_data["requests_per_minute"] = st.number_input(
+                "Richieste al Minuto (RPM)",
+                min_value=0, max_value=1000000,
+                value=int(form_data.get("requests_per_minute", 0)), step=10,
+                help="Limite di richieste al minuto del provider per questo preset (0 = nessun limite)."
+            )
+        with cols_rate_limits[1]:
+            form_data["tokens_per_minute"] = st.number_input(
+                "Token al Minuto (TPM)",
+                min_value=0, max_value=100000000,
+                value=int(form_data.get("tokens_per_minute", 0)), step=1000,
+                help="Limite di token al minuto del provider per questo preset (0 = nessun limite)."
+            )
         
         # Campo Test Connessione e pulsanti di salvataggio/annullamento
         # Pulsante Test Connessione
@@ -205,6 +235,10 @@ else:
                 with cols_preset_details[0]:
                     st.caption(f"Modello: {preset.get('model', 'N/A')}")
                     st.caption(f"Endpoint: {preset.get('endpoint', 'N/A')}")
+                    st.caption(f"Richieste concorrenti max: {preset.get('max_concurrency', DEFAULT_MAX_CONCURRENCY)}")
+                    rpm = int(preset.get('requests_per_minute', 0) or 0)
+                    tpm = int(preset.get('tokens_per_minute', 0) or 0)
+                    st.caption(f"Limiti: {rpm or '∞'} RPM, {tpm or '∞'} TPM")
                 with cols_preset_details[1]:
                     if st.button("✏️ Modifica", key=f"edit_{preset['id']}", on_click=start_existing_preset_edit, args=(preset['id'],), use_container_width=True):
                         pass
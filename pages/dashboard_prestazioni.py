@@ -0,0 +1,125 @@
+import streamlit as st
+import pandas as pd
+import sys
+import os
+import plotly.express as px
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from utils.data_utils import load_run_telemetry
+from utils.telemetry_utils import telemetry_timeseries
+from utils.ui_utils import add_page_header, add_section_title, format_cost
+
+add_page_header(
+    "Dashboard Prestazioni e Costi",
+    icon="📉",
+    description="Confronta nel tempo velocità, latenze, errori e costi delle esecuzioni per preset o modello."
+)
+
+# La telemetria viene estratta in SQL ad ogni apertura della pagina: è leggera e sempre aggiornata
+runs = load_run_telemetry()
+if runs.empty:
+    st.info("Nessuna esecuzione con telemetria disponibile. Le metriche vengono registrate per i test "
+            "eseguiti dalla pagina 'Esecuzione Test' o dalla riga di comando.")
+    st.stop()
+
+# --- Filtri ---
+add_section_title("Filtri", icon="🔎")
+col_group, col_freq, col_range = st.columns(3)
+group_options = {
+    "generation_preset": "Preset di generazione",
+    "generation_model": "Modello di generazione",
+    "evaluation_preset": "Preset di valutazione",
+}
+with col_group:
+    group_by = st.selectbox("Raggruppa per", options=list(group_options), format_func=group_options.get,
+                            key="dashboard_group_by")
+freq_options = {"h": "Ora", "D": "Giorno", "W": "Settimana", "M": "Mese"}
+with col_freq:
+    freq = st.selectbox("Periodo", options=list(freq_options), index=1, format_func=freq_options.get,
+                        key="dashboard_freq")
+with col_range:
+    first_day, last_day = runs['timestamp'].min().date(), runs['timestamp'].max().date()
+    date_range = st.date_input("Intervallo di date", value=(first_day, last_day),
+                               min_value=first_day, max_value=last_day, key="dashboard_range")
+
+groups = sorted(runs[group_by].dropna().unique())
+selected_groups = st.multiselect(group_options[group_by], options=groups, default=groups, key="dashboard_groups")
+
+mask = runs[group_by].isin(selected_groups)
+if isinstance(date_range, (tuple, list)) and len(date_range) == 2:
+    mask &= runs['timestamp'].dt.date.between(date_range[0], date_range[1])
+filtered = runs[mask]
+if filtered.empty:
+    st.warning("Nessuna esecuzione corrisponde ai filtri selezionati.")
+    st.stop()
+
+series = telemetry_timeseries(filtered, group_by=group_by, freq=freq)
+group_label = group_options[group_by]
+
+# --- Riepilogo per gruppo ---
+add_section_title("Riepilogo", icon="📋")
+summary = telemetry_timeseries(filtered, group_by=group_by, freq=None)
+summary = summary.rename(columns={'group': group_label}).set_index(group_label)
+total_cost = filtered['cost'].sum(min_count=1)
+totals = st.columns(4)
+totals[0].metric("Esecuzioni", int(summary['runs'].sum()))
+totals[1].metric("Domande", int(summary['questions'].sum()))
+totals[2].metric("Costo Stimato Totale", format_cost(None if pd.isna(total_cost) else total_cost))
+totals[3].metric("Token Totali", f"{int(filtered['total_tokens'].sum()):,}".replace(",", "."))
+st.dataframe(
+    summary[['runs', 'questions', 'questions_per_minute', 'latency_p50', 'latency_p95', 'latency_p99',
+             'error_rate', 'retry_rate', 'cost_per_100_questions']].rename(columns={
+        'runs': "Esecuzioni", 'questions': "Domande", 'questions_per_minute': "Domande/min",
+        'latency_p50': "Latenza P50 (s)", 'latency_p95': "Latenza P95 (s)", 'latency_p99': "Latenza P99 (s)",
+        'error_rate': "Tasso di errore", 'retry_rate': "Tentativi ripetuti per chiamata",
+        'cost_per_100_questions': "Costo per 100 domande ($)"
+    }).style.format(precision=3, na_rep="n/d"),
+    use_container_width=True
+)
+st.caption("Le latenze riguardano le chiamate di generazione: per ogni gruppo è la media dei percentili "
+           "delle singole esecuzioni, pesata sul numero di domande.")
+
+# --- Andamento nel tempo ---
+add_section_title("Andamento nel Tempo", icon="📈")
+plot_df = series.rename(columns={'group': group_label, 'period': "Periodo"})
+
+
+def line_chart(column, title, y_label, **layout):
+    fig = px.line(plot_df.dropna(subset=[column]), x="Periodo", y=column, color=group_label,
+                  markers=True, title=title, labels={column: y_label})
+    fig.update_layout(**layout)
+    st.plotly_chart(fig, use_container_width=True)
+
+
+col_left, col_right = st.columns(2)
+with col_left:
+    line_chart('questions_per_minute', "Throughput", "Domande al minuto")
+with col_right:
+    line_chart('cost_per_100_questions', "Costo per 100 domande", "USD")
+
+latency_df = plot_df.melt(
+    id_vars=["Periodo", group_label], value_vars=['latency_p50', 'latency_p95', 'latency_p99'],
+    var_name="Percentile", value_name="Latenza (s)"
+).dropna(subset=["Latenza (s)"])
+latency_df["Percentile"] = latency_df["Percentile"].str.replace("latency_", "").str.upper()
+if not latency_df.empty:
+    fig_latency = px.line(latency_df, x="Periodo", y="Latenza (s)", color=group_label, line_dash="Percentile",
+                          markers=True, title="Percentili di latenza della generazione")
+    st.plotly_chart(fig_latency, use_container_width=True)
+
+col_left, col_right = st.columns(2)
+with col_left:
+    line_chart('error_rate', "Tasso di errore", "Domande con errore", yaxis_tickformat=".0%")
+with col_right:
+    line_chart('retry_rate', "Tentativi ripetuti", "Tentativi per chiamata")
+
+# --- Singole esecuzioni ---
+with st.expander("Esecuzioni singole"):
+    st.dataframe(
+        filtered[['timestamp', 'set_name', 'generation_preset', 'generation_model', 'evaluation_preset',
+                  'questions', 'questions_per_minute', 'latency_p50', 'latency_p95', 'latency_p99',
+                  'retries', 'generation_errors', 'evaluation_errors', 'total_tokens', 'cost']]
+        .sort_values('timestamp', ascending=False),
+        use_container_width=True, hide_index=True
+    )
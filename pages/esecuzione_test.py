@@ -3,17 +3,25 @@ import pandas as pd
 import sys
 import os
 import time
-from datetime import datetime
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 from utils.data_utils import (
-    load_questions, load_question_sets, add_test_result, load_api_presets
+    load_questions, load_question_sets, load_results, load_api_presets
 )
-from utils.openai_utils import (
-    evaluate_answer, generate_example_answer_with_llm  # Client viene creato internamente
+from utils.execution_utils import get_preset_concurrency, cache_hit_stats, generation_latency_stats
+from utils.run_utils import (
+    build_run_config, create_run, create_matrix_runs, load_run, load_runs, set_run_status,
+    ACTIVE_STATUSES, RUN_STATUS_COMPLETED, RUN_STATUS_DISCARDED, EXECUTION_MODE_BATCH, EXECUTION_MODE_REALTIME,
+    EVALUATION_METHOD_BM25, EVALUATION_METHOD_EMBEDDING
+)
+from utils.bm25_utils import BM25_DEFAULT_PARAMETERS
+from utils.embedding_utils import EMBEDDING_DEFAULT_PARAMETERS
+from utils.sampling_utils import SAMPLING_DEFAULT_PARAMETERS, SAMPLING_METHODS
+from utils.background_utils import submit_run, submit_matrix, is_run_active, RUN_POLL_INTERVAL_SECONDS
+from utils.ui_utils import (
+    add_page_header, add_section_title, create_card, format_call_metrics, show_run_telemetry, show_sampling_summary
 )
-from utils.ui_utils import add_page_header, add_section_title, create_card
 
 
 # === FUNZIONI DI CALLBACK ===
@@ -30,6 +38,33 @@ def run_llm_test_callback():
     st.session_state.run_llm_test = True
 
 
+def run_bm25_test_callback():
+    """Funzione di callback: esegue il test con valutazione BM25"""
+    st.session_state.run_bm25_test = True
+
+
+def run_embedding_test_callback():
+    """Funzione di callback: esegue il test con valutazione tramite embedding"""
+    st.session_state.run_embedding_test = True
+
+
+def resume_run_callback(run_id):
+    """Funzione di callback: riprende in background un'esecuzione interrotta"""
+    try:
+        submit_run(run_id)
+        st.session_state.watched_run_ids.append(run_id)
+    except Exception as e:
+        st.error(f"Impossibile riprendere l'esecuzione: {e}")
+
+
+def discard_run_callback(run_id):
+    """Funzione di callback: scarta un'esecuzione interrotta"""
+    try:
+        set_run_status(run_id, RUN_STATUS_DISCARDED)
+    except Exception as e:
+        st.error(f"Impossibile scartare l'esecuzione: {e}")
+
+
 # === Inizializzazione delle variabili di stato ===
 if 'test_mode' not in st.session_state:
     st.session_state.test_mode = "Valutazione Automatica con LLM"
@@ -39,6 +74,12 @@ if 'run_llm_test' not in st.session_state:
     st.session_state.run_llm_test = False
 if 'run_bm25_test' not in st.session_state:
     st.session_state.run_bm25_test = False
+if 'run_embedding_test' not in st.session_state:
+    st.session_state.run_embedding_test = False
+if 'watched_run_ids' not in st.session_state:
+    st.session_state.watched_run_ids = []
+if 'finished_run_ids' not in st.session_state:
+    st.session_state.finished_run_ids = []
 
 # Gestisce il cambio di modalità
 if st.session_state.mode_changed:
@@ -112,6 +153,18 @@ selected_set_id = st.selectbox(
 selected_set = st.session_state.question_sets[st.session_state.question_sets['id'] == selected_set_id].iloc[0]
 questions_in_set = selected_set['questions']
 
+# Metodo di valutazione: giudice LLM, confronto locale BM25 o similarità tra embedding
+st.radio(
+    "Metodo di Valutazione",
+    options=["Valutazione Automatica con LLM", "Valutazione BM25", "Valutazione con Embedding"],
+    horizontal=True,
+    key="test_mode",
+    help="'Valutazione BM25' genera le risposte con il preset scelto e le confronta con quelle attese "
+         "in locale, in un'unica passata e senza chiamate al LLM valutatore. 'Valutazione con Embedding' "
+         "confronta gli embedding delle due risposte (similarità coseno): i vettori delle risposte attese "
+         "restano in cache e a ogni test vengono calcolati solo quelli delle risposte generate."
+)
+
 
 # --- Opzioni API basate su Preset ---
 add_section_title("Opzioni API basate su Preset", icon="🛠️")
@@ -147,12 +200,353 @@ if st.session_state.test_mode == "Valutazione Automatica con LLM":
         help="Il preset API utilizzato dall'LLM per valutare la similarità e correttezza della risposta generata."
     )
     st.session_state.selected_evaluation_preset_name = evaluation_preset_name
+
+    # Matrice: lo stesso set eseguito contemporaneamente con più preset di generazione
+    matrix_mode = st.checkbox(
+        "Confronta Più Preset di Generazione (Matrice)",
+        value=False,
+        key="matrix_mode",
+        help="Esegue il set con tutti i preset di generazione scelti in un unico lavoro, in parallelo, "
+             "valutandoli con lo stesso preset di valutazione. Viene salvato un risultato per ogni preset."
+    )
+    matrix_generation_presets = []
+    if matrix_mode:
+        matrix_generation_presets = st.multiselect(
+            "Preset di Generazione da Confrontare",
+            options=preset_display_names,
+            default=[generation_preset_name] if generation_preset_name else [],
+            key="matrix_generation_presets"
+        )
+
+    # Concorrenza indipendente per i due stadi della pipeline (generazione → valutazione)
+    gen_preset_for_limits = get_preset_config_by_name(generation_preset_name) or {}
+    eval_preset_for_limits = get_preset_config_by_name(evaluation_preset_name) or {}
+    col_gen_conc, col_eval_conc = st.columns(2)
+    with col_gen_conc:
+        gen_concurrency = st.number_input(
+            "Worker di Generazione",
+            min_value=1, max_value=100,
+            value=get_preset_concurrency(gen_preset_for_limits),
+            key=f"gen_concurrency_{generation_preset_name}",
+            disabled=matrix_mode,
+            help="Chiamate di generazione eseguite in parallelo (default: limite del preset di generazione). "
+                 "Nella matrice ogni preset usa il proprio limite."
+        )
+    with col_eval_conc:
+        eval_concurrency = st.number_input(
+            "Worker di Valutazione",
+            min_value=1, max_value=100,
+            value=get_preset_concurrency(eval_preset_for_limits),
+            key=f"eval_concurrency_{evaluation_preset_name}",
+            help="Chiamate di valutazione eseguite in parallelo (default: limite del preset di valutazione)."
+        )
+    eval_batch_size = st.number_input(
+        "Risposte per Chiamata di Valutazione",
+        min_value=1, max_value=50, value=1,
+        key="eval_batch_size",
+        help="Numero di risposte valutate insieme in un'unica chiamata al LLM valutatore. "
+             "Con 1 ogni risposta viene valutata singolarmente; le risposte mancanti da una "
+             "valutazione a gruppi vengono rivalutate singolarmente."
+    )
 else:
-    # Per BM25, non c'è un preset di valutazione LLM
+    # Con BM25 ed embedding non c'è un LLM valutatore: le risposte vengono solo generate
     st.session_state.selected_evaluation_preset_name = None
+    matrix_mode = False
+    gen_preset_for_limits = get_preset_config_by_name(generation_preset_name) or {}
+    gen_concurrency = st.number_input(
+        "Worker di Generazione",
+        min_value=1, max_value=100,
+        value=get_preset_concurrency(gen_preset_for_limits),
+        key=f"bm25_gen_concurrency_{generation_preset_name}",
+        help="Chiamate di generazione eseguite in parallelo (default: limite del preset di generazione)."
+    )
+
+if st.session_state.test_mode == "Valutazione con Embedding":
+    # Il preset fornisce endpoint, chiave e limiti; il modello di embedding si sceglie a parte
+    embedding_preset_name = st.selectbox(
+        "Seleziona Preset per gli Embedding",
+        options=preset_display_names,
+        index=0 if preset_display_names else None,
+        key="embedding_preset_select",
+        help="Preset API con un endpoint compatibile OpenAI che espone /embeddings."
+    )
+    st.session_state.selected_evaluation_preset_name = embedding_preset_name
+    with st.expander("Parametri Embedding"):
+        col_model, col_batch = st.columns(2)
+        embedding_model = col_model.text_input(
+            "Modello di Embedding", value=EMBEDDING_DEFAULT_PARAMETERS['model'], key="embedding_model")
+        embedding_batch_size = col_batch.number_input(
+            "Testi per Richiesta", min_value=1, max_value=2048,
+            value=EMBEDDING_DEFAULT_PARAMETERS['batch_size'], key="embedding_batch_size",
+            help="Risposte convertite con una singola richiesta all'endpoint di embedding.")
+        col_high, col_medium = st.columns(2)
+        embedding_high_threshold = col_high.number_input(
+            "Soglia Alta (%)", min_value=0.0, max_value=100.0,
+            value=EMBEDDING_DEFAULT_PARAMETERS['high_threshold'], key="embedding_high_threshold")
+        embedding_medium_threshold = col_medium.number_input(
+            "Soglia Media (%)", min_value=0.0, max_value=100.0,
+            value=EMBEDDING_DEFAULT_PARAMETERS['medium_threshold'], key="embedding_medium_threshold")
+elif st.session_state.test_mode == "Valutazione BM25":
+    with st.expander("Parametri BM25"):
+        col_k1, col_b = st.columns(2)
+        bm25_k1 = col_k1.number_input("k1", min_value=0.0, max_value=5.0, step=0.1,
+                                      value=BM25_DEFAULT_PARAMETERS['k1'], key="bm25_k1",
+                                      help="Saturazione della frequenza dei termini.")
+        bm25_b = col_b.number_input("b", min_value=0.0, max_value=1.0, step=0.05,
+                                    value=BM25_DEFAULT_PARAMETERS['b'], key="bm25_b",
+                                    help="Peso della normalizzazione sulla lunghezza della risposta attesa.")
+        col_high, col_medium = st.columns(2)
+        bm25_high_threshold = col_high.number_input(
+            "Soglia Alta (%)", min_value=0.0, max_value=100.0,
+            value=BM25_DEFAULT_PARAMETERS['high_threshold'], key="bm25_high_threshold")
+        bm25_medium_threshold = col_medium.number_input(
+            "Soglia Media (%)", min_value=0.0, max_value=100.0,
+            value=BM25_DEFAULT_PARAMETERS['medium_threshold'], key="bm25_medium_threshold")
+        bm25_use_question_bank = st.checkbox(
+            "IDF dall'intera banca domande", value=BM25_DEFAULT_PARAMETERS['use_question_bank'],
+            key="bm25_use_question_bank",
+            help="Pesa i termini con le frequenze dell'indice di tutte le risposte attese invece che "
+                 "delle sole risposte del set: i punteggi non dipendono dalla composizione del set."
+        )
 
 show_api_details = st.checkbox("Mostra Dettagli Chiamate API nei Risultati", value=False)
 
+use_generation_cache = st.checkbox(
+    "Usa Cache delle Risposte Generate",
+    value=False,
+    help="Riusa le risposte già generate con lo stesso modello, endpoint, prompt, temperatura e max tokens. "
+         "Con temperatura 0 ripetere un test diventa quasi gratuito; con temperatura maggiore di 0 "
+         "vengono riproposte le risposte già campionate invece di generarne di nuove."
+)
+
+use_evaluation_cache = st.session_state.test_mode == "Valutazione Automatica con LLM" and st.checkbox(
+    "Usa Cache delle Valutazioni",
+    value=False,
+    help="Riusa il giudizio già espresso dallo stesso modello valutatore (stessi endpoint, temperatura e "
+         "max tokens) su una risposta identica alla stessa domanda, invece di rivalutarla."
+)
+
+use_fast_path = st.session_state.test_mode == "Valutazione Automatica con LLM" and st.checkbox(
+    "Valutazione Rapida delle Risposte Certe",
+    value=True,
+    help="Le risposte identiche a quelle attese (anche a meno di maiuscole, accenti, punteggiatura e "
+         "articoli), numericamente equivalenti (\"12\", \"12.0\", \"dodici\") o che contengono la risposta "
+         "attesa senza negazioni o alternative vengono valutate senza chiamare il giudice LLM."
+)
+
+sampling = None
+if st.session_state.test_mode == "Valutazione Automatica con LLM" and st.checkbox(
+    "Esecuzione a Campione (stima con intervallo di confidenza)",
+    value=False,
+    key="sampled_run",
+    help="Esegue le domande in ordine casuale, stratificato per categoria, e si ferma appena l'intervallo "
+         "di confidenza del punteggio medio è più stretto dell'ampiezza scelta o quando il budget di "
+         "domande è esaurito. Con il Batch API vale solo il budget."
+):
+    col_width, col_confidence, col_method = st.columns(3)
+    sampling_ci_width = col_width.number_input(
+        "Ampiezza Intervallo (punti %)", min_value=0.5, max_value=50.0, step=0.5,
+        value=SAMPLING_DEFAULT_PARAMETERS['ci_width'], key="sampling_ci_width",
+        help="Ampiezza totale dell'intervallo di confidenza: 4 equivale a una stima ±2%.")
+    sampling_confidence = col_confidence.selectbox(
+        "Livello di Confidenza", options=[0.90, 0.95, 0.99], index=1, key="sampling_confidence",
+        format_func=lambda value: f"{value:.0%}")
+    sampling_method = col_method.selectbox(
+        "Intervallo", options=list(SAMPLING_METHODS), key="sampling_method",
+        format_func=lambda value: {"wilson": "Wilson", "bootstrap": "Bootstrap"}[value],
+        help="Wilson è immediato e conservativo; il bootstrap stratificato è più stretto con punteggi "
+             "parziali ma viene ricalcolato ogni 10 domande.")
+    col_min, col_max = st.columns(2)
+    sampling_min_questions = col_min.number_input(
+        "Domande Minime", min_value=1, max_value=10000,
+        value=SAMPLING_DEFAULT_PARAMETERS['min_questions'], key="sampling_min_questions",
+        help="Domande eseguite comunque prima di controllare l'intervallo.")
+    sampling_max_questions = col_max.number_input(
+        "Budget di Domande (0 = nessun limite)", min_value=0, max_value=100000, value=0,
+        key="sampling_max_questions")
+    sampling = {
+        "ci_width": float(sampling_ci_width),
+        "confidence": float(sampling_confidence),
+        "method": sampling_method,
+        "min_questions": int(sampling_min_questions),
+        "max_questions": int(sampling_max_questions) or None
+    }
+
+stream_generation = st.checkbox(
+    "Generazione in Streaming (misura latenza)",
+    value=False,
+    help="Riceve le risposte generate in streaming e registra per ogni domanda il tempo al primo token, "
+         "la latenza totale e i token di output al secondo. Non disponibile con il Batch API."
+)
+
+execution_mode = st.radio(
+    "Modalità di Esecuzione",
+    options=["Tempo Reale", "Batch API (offline)"],
+    horizontal=True,
+    key="execution_mode",
+    help="'Batch API' invia tutte le richieste tramite il Batch API di OpenAI: i risultati possono "
+         "richiedere fino a 24 ore ma il costo è inferiore. Adatto a esecuzioni molto grandi."
+)
+
+def show_llm_results(results, run_metrics=None):
+    """Mostra il riepilogo (con la telemetria aggregata, se presente) e i risultati dettagliati di un test LLM."""
+    show_run_telemetry(run_metrics)
+    cache_stats = cache_hit_stats(results)
+    for label, (hits, total) in (("Risposte generate", cache_stats["generation"]),
+                                 ("Valutazioni", cache_stats["evaluation"])):
+        if total:
+            st.info(f"{label} riprese dalla cache: {hits}/{total} ({hits / total:.0%})")
+
+    latency_stats = generation_latency_stats(results)
+    if latency_stats:
+        col_ttft, col_latency, col_tps = st.columns(3)
+        if latency_stats['time_to_first_token'] is not None:
+            col_ttft.metric("Tempo al Primo Token (medio)", f"{latency_stats['time_to_first_token']:.2f} s")
+        col_latency.metric("Latenza Generazione (media)", f"{latency_stats['latency']:.2f} s")
+        if latency_stats['tokens_per_second'] is not None:
+            col_tps.metric("Token di Output al Secondo (medi)", f"{latency_stats['tokens_per_second']:.1f}")
+
+    # Visualizzazione risultati dettagliati
+    st.subheader("Risultati Dettagliati")
+    for q_id, result in results.items():
+        with st.expander(f"Domanda: {result['question'][:50]}..."):
+            col1, col2 = st.columns(2)
+            with col1:
+                st.write("**Domanda:**", result['question'])
+                st.write("**Risposta Attesa:**", result['expected_answer'])
+            with col2:
+                st.write("**Risposta Generata:**", result['actual_answer'])
+                st.write("**Punteggio:**", f"{result['evaluation']['score']:.1f}%")
+                st.write("**Valutazione:**", result['evaluation']['explanation'])
+                if result['evaluation'].get('fast_path'):
+                    st.caption(f"Valutazione rapida senza giudice LLM (regola: {result['evaluation']['fast_path']})")
+                metrics = result.get('generation_metrics')
+                if metrics:
+                    st.caption(f"Generazione — {format_call_metrics(metrics)}")
+                    if 'time_to_first_token' in metrics:
+                        ttft = metrics.get('time_to_first_token')
+                        tps = metrics.get('tokens_per_second')
+                        st.caption(
+                            f"Primo token: {f'{ttft:.2f} s' if ttft is not None else 'n/d'} · "
+                            f"Token/s: {f'{tps:.1f}' if tps is not None else 'n/d'}"
+                        )
+                eval_metrics = result['evaluation'].get('metrics')
+                if eval_metrics:
+                    st.caption(f"Valutazione — {format_call_metrics(eval_metrics)}")
+
+
+def show_similarity_results(results, run_metrics=None, method=EVALUATION_METHOD_BM25):
+    """Mostra il riepilogo e i risultati dettagliati di un test valutato con BM25 o con gli embedding."""
+    show_run_telemetry(run_metrics)
+    levels = pd.Series([r.get('match_level', 'basso') for r in results.values()]).value_counts()
+    col_high, col_medium, col_low = st.columns(3)
+    col_high.metric("Corrispondenza Alta", int(levels.get('alto', 0)))
+    col_medium.metric("Corrispondenza Media", int(levels.get('medio', 0)))
+    col_low.metric("Corrispondenza Bassa", int(levels.get('basso', 0)))
+
+    st.subheader("Risultati Dettagliati")
+    for q_id, result in results.items():
+        with st.expander(f"Domanda: {result['question'][:50]}..."):
+            col1, col2 = st.columns(2)
+            with col1:
+                st.write("**Domanda:**", result['question'])
+                st.write("**Risposta Attesa:**", result['expected_answer'])
+            with col2:
+                st.write("**Risposta Generata:**", result['actual_answer'])
+                st.write(f"**Similarità {method}:**", f"{result.get('similarity_score', 0):.1f}% "
+                                                     f"({result.get('match_level', 'n/d')})")
+                if result.get('missing_keywords'):
+                    st.write("**Termini Mancanti:**", ", ".join(result['missing_keywords']))
+                if result.get('suggestions'):
+                    st.write("**Suggerimenti:**", result['suggestions'])
+                metrics = result.get('generation_metrics')
+                if metrics:
+                    st.caption(f"Generazione — {format_call_metrics(metrics)}")
+
+
+def show_finished_run(run_id):
+    """Mostra l'esito di un'esecuzione avviata da questa sessione e appena terminata."""
+    run = load_run(run_id)
+    if not run:
+        return
+    if run['status'] != RUN_STATUS_COMPLETED:
+        st.error(f"Esecuzione del set '{run['config'].get('set_name', '')}' non completata "
+                 f"({run['status']}): {run.get('error') or 'potrà essere ripresa.'}")
+        return
+    result_row = st.session_state.results[st.session_state.results['id'] == str(run['result_id'])]
+    if result_row.empty:
+        return
+    result_data = result_row.iloc[0]['results']
+    method = result_data.get('method', 'LLM')
+    st.success(f"Test {method} sul set '{result_data.get('set_name', '')}' con il preset "
+               f"'{result_data.get('generation_preset', '')}' completato! "
+               f"Punteggio medio: {result_data.get('avg_score', 0):.2f}%")
+    if method in (EVALUATION_METHOD_BM25, EVALUATION_METHOD_EMBEDDING):
+        if method == EVALUATION_METHOD_EMBEDDING:
+            st.info(f"Risposte attese riprese dalla cache degli embedding: "
+                    f"{result_data.get('cached_references', 0)}/{len(result_data.get('questions', {}))}")
+        show_similarity_results(result_data.get('questions', {}), result_data.get('metrics'), method)
+    else:
+        show_sampling_summary(result_data)
+        show_llm_results(result_data.get('questions', {}), result_data.get('metrics'))
+
+
+@st.fragment(run_every=RUN_POLL_INTERVAL_SECONDS)
+def show_active_runs():
+    """Mostra l'avanzamento delle esecuzioni in background, leggendolo dal database."""
+    active_runs = [run for run in load_runs(statuses=ACTIVE_STATUSES) if is_run_active(run['id'])]
+    if active_runs:
+        add_section_title("Esecuzioni in Corso", icon="⏳")
+        for run in active_runs:
+            total = run['total'] or 0
+            completed = run['completed'] or 0
+            st.progress(
+                completed / total if total else 0.0,
+                text=f"{run['config'].get('set_name', '')} · {run['config'].get('generation_preset', '')} — "
+                     f"{completed}/{total} domande completate ({run['status']})"
+            )
+
+    # Le esecuzioni avviate da questa sessione e ora terminate vengono mostrate con un rerun completo
+    finished = [run_id for run_id in st.session_state.watched_run_ids if not is_run_active(run_id)]
+    if finished:
+        st.session_state.watched_run_ids = [
+            run_id for run_id in st.session_state.watched_run_ids if run_id not in finished
+        ]
+        st.session_state.finished_run_ids.extend(finished)
+        st.rerun(scope="app")
+
+
+# --- Esecuzioni in background ---
+show_active_runs()
+
+if st.session_state.finished_run_ids:
+    st.session_state.results = load_results()
+    for finished_run_id in st.session_state.finished_run_ids:
+        show_finished_run(finished_run_id)
+    st.session_state.finished_run_ids = []
+
+# --- Esecuzioni interrotte ---
+resumable_runs = [run for run in load_runs(selected_set_id) if not is_run_active(run['id'])]
+if resumable_runs:
+    add_section_title("Esecuzioni Interrotte", icon="⏸️")
+    for run in resumable_runs:
+        col_info, col_resume, col_discard = st.columns([4, 1, 1])
+        with col_info:
+            st.write(
+                f"**{run['created_at']}** — {run['completed'] or 0}/{run['total']} domande completate "
+                f"({run['status']})"
+            )
+            st.caption(
+                f"Generazione: {run['config'].get('generation_preset', '')} · "
+                f"Valutazione: {run['config'].get('evaluation_preset') or run['config'].get('evaluation_method', '')}"
+            )
+        with col_resume:
+            st.button("▶️ Riprendi", key=f"resume_run_{run['id']}",
+                      on_click=resume_run_callback, args=(run['id'],))
+        with col_discard:
+            st.button("🗑️ Scarta", key=f"discard_run_{run['id']}",
+                      on_click=discard_run_callback, args=(run['id'],))
+
 # --- Logica di Esecuzione Test ---
 test_mode_selected = st.session_state.test_mode
 
@@ -175,68 +569,137 @@ if test_mode_selected == "Valutazione Automatica con LLM":
 
         if not gen_preset_config or not eval_preset_config:
             st.error("Assicurati di aver selezionato preset validi per generazione e valutazione.")
+        elif matrix_mode:
+            matrix_presets = [get_preset_config_by_name(name) for name in matrix_generation_presets]
+            if not matrix_presets:
+                st.error("Seleziona almeno un preset di generazione da confrontare.")
+            else:
+                try:
+                    run_ids = create_matrix_runs(
+                        selected_set_id, selected_set['name'], matrix_presets, eval_preset_config,
+                        [q_id for q_id in questions_in_set if get_question_data(q_id)],
+                        execution_mode=(EXECUTION_MODE_BATCH if execution_mode == "Batch API (offline)"
+                                        else EXECUTION_MODE_REALTIME),
+                        show_api_details=show_api_details,
+                        eval_concurrency=int(eval_concurrency),
+                        eval_batch_size=int(eval_batch_size),
+                        use_generation_cache=use_generation_cache,
+                        use_evaluation_cache=use_evaluation_cache,
+                        use_fast_path=use_fast_path,
+                        stream_generation=stream_generation,
+                        sampling=sampling
+                    )
+                    submit_matrix(run_ids)
+                    st.session_state.watched_run_ids.extend(run_ids)
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Impossibile avviare la matrice di esecuzioni: {e}")
         else:
-            with st.spinner("Generazione risposte e valutazione LLM in corso..."):
-                results = {}
-                for q_id in questions_in_set:
-                    q_data = get_question_data(q_id)
-                    if q_data:
-                        # Genera risposta di esempio usando LLM
-                        generation_output = generate_example_answer_with_llm(q_data['question'],
-                                                                             client_config=gen_preset_config,
-                                                                             show_api_details=show_api_details)
-                        actual_answer = generation_output["answer"]
-                        generation_api_details = generation_output["api_details"]
-
-                        if actual_answer is None:
-                            # Gestione errore generazione
-                            results[q_id] = {
-                                'question': q_data['question'],
-                                'expected_answer': q_data['expected_answer'],
-                                'actual_answer': "Errore Generazione",
-                                'evaluation': {'score': 0, 'explanation': 'Generazione fallita'},
-                                'generation_api_details': generation_api_details
-                                # Salva anche se la generazione fallisce
-                            }
-                            continue
-
-                        evaluation = evaluate_answer(q_data['question'], q_data['expected_answer'], actual_answer,
-                                                     client_config=eval_preset_config,
-                                                     show_api_details=show_api_details)
-                        results[q_id] = {
-                            'question': q_data['question'],
-                            'expected_answer': q_data['expected_answer'],
-                            'actual_answer': actual_answer,
-                            'evaluation': evaluation,  # Questo conterrà i dettagli API della VALUTAZIONE
-                            'generation_api_details': generation_api_details  # Dettagli API della GENERAZIONE
-                        }
-
-                # Salva e visualizza risultati
-                if results:
-                    avg_score = sum(r['evaluation']['score'] for r in results.values()) / len(results) if results else 0
-                    result_data = {
-                        'set_name': selected_set['name'],
-                        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                        'avg_score': avg_score,
-                        'sample_type': 'Generata da LLM',
-                        'method': 'LLM',
-                        'generation_preset': gen_preset_config['name'],
-                        'evaluation_preset': eval_preset_config['name'],
-                        'questions': results
-                    }
-                    result_id = add_test_result(selected_set_id, result_data)
-                    st.success(f"Test LLM completato! Punteggio medio: {avg_score:.2f}%")
-
-                    # Visualizzazione risultati dettagliati
-                    st.subheader("Risultati Dettagliati")
-                    for q_id, result in results.items():
-                        with st.expander(f"Domanda: {result['question'][:50]}..."):
-                            col1, col2 = st.columns(2)
-                            with col1:
-                                st.write("**Domanda:**", result['question'])
-                                st.write("**Risposta Attesa:**", result['expected_answer'])
-                            with col2:
-                                st.write("**Risposta Generata:**", result['actual_answer'])
-                                st.write("**Punteggio:**", f"{result['evaluation']['score']:.1f}%")
-                                st.write("**Valutazione:**", result['evaluation']['explanation'])
+            # L'esecuzione viene registrata nel database e affidata a un processo in background:
+            # l'avanzamento resta visibile anche cambiando pagina e può essere ripresa se interrotta
+            run_config = build_run_config(
+                selected_set_id, selected_set['name'], gen_preset_config, eval_preset_config,
+                [q_id for q_id in questions_in_set if get_question_data(q_id)],
+                execution_mode=(EXECUTION_MODE_BATCH if execution_mode == "Batch API (offline)"
+                                else EXECUTION_MODE_REALTIME),
+                show_api_details=show_api_details,
+                gen_concurrency=int(gen_concurrency),
+                eval_concurrency=int(eval_concurrency),
+                eval_batch_size=int(eval_batch_size),
+                use_generation_cache=use_generation_cache,
+                use_evaluation_cache=use_evaluation_cache,
+                use_fast_path=use_fast_path,
+                stream_generation=stream_generation,
+                sampling=sampling
+            )
+            try:
+                run_id = create_run(selected_set_id, run_config, len(run_config['question_ids']))
+                submit_run(run_id)
+                st.session_state.watched_run_ids.append(run_id)
+                st.rerun()
+            except Exception as e:
+                st.error(f"Impossibile avviare l'esecuzione: {e}")
+
+elif test_mode_selected == "Valutazione BM25":
+    st.header("Esecuzione: Valutazione BM25")
+
+    st.button(
+        "🚀 Esegui Test con BM25",
+        key="run_bm25_test_btn",
+        on_click=run_bm25_test_callback
+    )
 
+    if st.session_state.run_bm25_test:
+        st.session_state.run_bm25_test = False  # Resetta lo stato
+
+        gen_preset_config = get_preset_config_by_name(st.session_state.selected_generation_preset_name)
+        if not gen_preset_config:
+            st.error("Assicurati di aver selezionato un preset valido per la generazione.")
+        else:
+            # Le risposte vengono generate in background come per il test LLM e valutate con BM25
+            # in un'unica passata al termine dell'esecuzione
+            run_config = build_run_config(
+                selected_set_id, selected_set['name'], gen_preset_config, None,
+                [q_id for q_id in questions_in_set if get_question_data(q_id)],
+                execution_mode=(EXECUTION_MODE_BATCH if execution_mode == "Batch API (offline)"
+                                else EXECUTION_MODE_REALTIME),
+                evaluation_method=EVALUATION_METHOD_BM25,
+                evaluation_parameters={
+                    'k1': float(bm25_k1), 'b': float(bm25_b),
+                    'high_threshold': float(bm25_high_threshold), 'medium_threshold': float(bm25_medium_threshold),
+                    'use_question_bank': bool(bm25_use_question_bank)
+                },
+                show_api_details=show_api_details,
+                gen_concurrency=int(gen_concurrency),
+                use_generation_cache=use_generation_cache,
+                stream_generation=stream_generation
+            )
+            try:
+                run_id = create_run(selected_set_id, run_config, len(run_config['question_ids']))
+                submit_run(run_id)
+                st.session_state.watched_run_ids.append(run_id)
+                st.rerun()
+            except Exception as e:
+                st.error(f"Impossibile avviare l'esecuzione: {e}")
+
+elif test_mode_selected == "Valutazione con Embedding":
+    st.header("Esecuzione: Valutazione con Embedding")
+
+    st.button(
+        "🚀 Esegui Test con Embedding",
+        key="run_embedding_test_btn",
+        on_click=run_embedding_test_callback
+    )
+
+    if st.session_state.run_embedding_test:
+        st.session_state.run_embedding_test = False  # Resetta lo stato
+
+        gen_preset_config = get_preset_config_by_name(st.session_state.selected_generation_preset_name)
+        embedding_preset_config = get_preset_config_by_name(st.session_state.selected_evaluation_preset_name)
+        if not gen_preset_config or not embedding_preset_config or not embedding_model.strip():
+            st.error("Assicurati di aver selezionato preset validi e un modello di embedding.")
+        else:
+            # Le risposte vengono generate in background e confrontate con gli embedding al termine
+            run_config = build_run_config(
+                selected_set_id, selected_set['name'], gen_preset_config, embedding_preset_config,
+                [q_id for q_id in questions_in_set if get_question_data(q_id)],
+                execution_mode=(EXECUTION_MODE_BATCH if execution_mode == "Batch API (offline)"
+                                else EXECUTION_MODE_REALTIME),
+                evaluation_method=EVALUATION_METHOD_EMBEDDING,
+                evaluation_parameters={
+                    'model': embedding_model.strip(), 'batch_size': int(embedding_batch_size),
+                    'high_threshold': float(embedding_high_threshold),
+                    'medium_threshold': float(embedding_medium_threshold)
+                },
+                show_api_details=show_api_details,
+                gen_concurrency=int(gen_concurrency),
+                use_generation_cache=use_generation_cache,
+                stream_generation=stream_generation
+            )
+            try:
+                run_id = create_run(selected_set_id, run_config, len(run_config['question_ids']))
+                submit_run(run_id)
+                st.session_state.watched_run_ids.append(run_id)
+                st.rerun()
+            except Exception as e:
+                st.error(f"Impossibile avviare l'esecuzione: {e}")
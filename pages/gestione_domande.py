@@ -41,7 +41,16 @@ def delete_question_callback(question_id):
 def import_questions_callback():
     """Funzione di callback: importa le domande"""
     if 'uploaded_file_content' in st.session_state and st.session_state.uploaded_file_content is not None:
-        success, message = import_questions_from_file(st.session_state.uploaded_file_content)
+        progress_bar = st.progress(0.0, text="Importazione in corso...")
+
+        def show_progress(rows_read, rows_per_second, fraction):
+            speed = f" · {rows_per_second:,.0f} righe/s".replace(",", ".") if rows_per_second else ""
+            progress_bar.progress(fraction if fraction is not None else 0.0,
+                                  text=f"{rows_read:,} righe lette{speed}".replace(",", "."))
+
+        success, message = import_questions_from_file(st.session_state.uploaded_file_content,
+                                                      progress_callback=show_progress)
+        progress_bar.empty()
 
         if success:
             st.session_state.import_success_message = message
@@ -231,13 +240,15 @@ with tabs[2]:
     st.header("Importa Domande da File")
 
     st.write("""
-    Carica un file CSV o JSON contenente domande, risposte attese e categorie (opzionale).
+    Carica un file CSV, JSON o JSON Lines contenente domande, risposte attese e categorie (opzionale).
+    I file vengono letti e importati a blocchi, quindi anche esportazioni molto grandi non vengono caricate per intero in memoria.
 
     ### Formato File:
     - **CSV**: Deve includere le colonne 'domanda' e 'risposta_attesa'. Può includere opzionalmente 'categoria'.
       (Se usi i vecchi nomi 'question' e 'expected_answer', verranno convertiti automaticamente).
     - **JSON**: Deve contenere un array di oggetti con i campi 'domanda' e 'risposta_attesa'. Può includere opzionalmente 'categoria'.
       (Se usi i vecchi nomi 'question' e 'expected_answer', verranno convertiti automaticamente).
+    - **JSON Lines** (.jsonl): Un oggetto JSON per riga, con gli stessi campi del formato JSON.
 
     ### Esempio CSV:
     ```csv
@@ -268,7 +279,7 @@ with tabs[2]:
     ```
     """)
 
-    uploaded_file = st.file_uploader("Scegli un file", type=["csv", "json"])
+    uploaded_file = st.file_uploader("Scegli un file", type=["csv", "json", "jsonl"])
 
     if uploaded_file is not None:
         # Salva il file in session_state per l'uso da parte della callback
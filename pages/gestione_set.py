@@ -15,7 +15,7 @@ sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from utils.data_utils import (
     load_questions, load_question_sets,
     create_question_set, update_question_set, delete_question_set,
-    import_questions_from_file, add_question_if_not_exists
+    import_questions_from_file, import_question_sets
 )
 from utils.ui_utils import add_page_header, add_section_title, create_card, create_metrics_container
 
@@ -24,6 +24,9 @@ from utils.ui_utils import add_page_header, add_section_title, create_card, crea
 import streamlit as st
 # import pandas as pd # Se necessario
 
+# Avvisi mostrati al più per un'importazione di set (file con migliaia di set)
+MAX_IMPORT_WARNINGS = 20
+
 # === CALLBACK FUNCTIONS ===
 
 def save_set_callback(set_id, edited_name, question_options_checkboxes, newly_selected_questions_ids):
@@ -67,7 +70,7 @@ def confirm_delete_set_dialog(set_id, set_name):
 
 def import_set_callback():
     """
-    Importa uno o più set di domande da un file JSON.
+    Importa uno o più set di domande da un file JSON (vedi import_question_sets).
     Formato JSON atteso:
     [
         {
@@ -97,104 +100,19 @@ def import_set_callback():
             string_data = uploaded_file.getvalue().decode("utf-8")
             data = json.loads(string_data)
 
-            # Carica i dati attuali
-            current_questions = load_questions()
-            current_sets = load_question_sets()
-
             if not isinstance(data, list):
                 st.session_state.import_set_error = True
                 st.session_state.import_set_error_message = "Formato JSON non valido. Il file deve contenere una lista (array) di set."
                 st.session_state.trigger_rerun = True
                 return
 
-            sets_imported_count = 0
-            new_questions_added_count = 0
-            existing_questions_found_count = 0
-
-            for set_idx, set_data in enumerate(data):
-                if not isinstance(set_data, dict):
-                    st.warning(f"Elemento #{set_idx+1} nella lista non è un set valido (saltato).")
-                    continue
+            sets_imported_count, new_questions_added_count, existing_questions_found_count, warnings = \
+                import_question_sets(data)
 
-                set_name = set_data.get("name")
-                questions_in_set_data = set_data.get("questions", [])
-
-                if not set_name or not isinstance(set_name, str) or not set_name.strip():
-                    st.warning(f"Set #{set_idx+1} con nome mancante o non valido (saltato).")
-                    continue
-                
-                if not isinstance(questions_in_set_data, list):
-                    st.warning(f"Dati delle domande mancanti o non validi per il set '{set_name}' (saltato).")
-                    continue
-
-                # Controlla se esiste già un set con lo stesso nome
-                if set_name in current_sets['name'].values:
-                    st.warning(f"Un set con nome '{set_name}' esiste già. Saltato per evitare duplicati.")
-                    continue
-
-                current_set_question_ids = []
-                
-                # Elabora ogni domanda nel set
-                for q_idx, q_data in enumerate(questions_in_set_data):
-                    if not isinstance(q_data, dict):
-                        st.warning(f"Dati domanda #{q_idx+1} nel set '{set_name}' non validi (saltati).")
-                        continue
-
-                    q_id = str(q_data.get("id", ""))
-                    q_text = q_data.get("domanda", "")
-                    q_answer = q_data.get("risposta_attesa", "")
-                    q_category = q_data.get("categoria", "")
-
-                    # Validazione dei campi obbligatori
-                    if not q_id or not q_text or not q_answer:
-                        st.warning(f"Domanda #{q_idx+1} nel set '{set_name}' ha campi mancanti (saltata). ID: {q_id}")
-                        continue
-
-                    # Controlla se la domanda esiste già nelle domande attuali
-                    if q_id in current_questions['id'].astype(str).values:
-                        existing_questions_found_count += 1
-                        current_set_question_ids.append(q_id)
-                        continue
-
-                    # Aggiungi la nuova domanda se non esiste
-                    try:
-                        was_added = add_question_if_not_exists(
-                            question_id=q_id,
-                            testo_domanda=q_text,
-                            risposta_prevista=q_answer,
-                            categoria=q_category
-                        )
-                        if was_added:
-                            new_questions_added_count += 1
-                            current_set_question_ids.append(q_id)
-                            # Aggiorna il DataFrame locale delle domande
-                            new_row = pd.DataFrame({
-                                'id': [q_id],
-                                'domanda': [q_text],
-                                'risposta_attesa': [q_answer],
-                                'categoria': [q_category]
-                            })
-                            current_questions = pd.concat([current_questions, new_row], ignore_index=True)
-                        else:
-                            existing_questions_found_count += 1
-                            current_set_question_ids.append(q_id)
-                    except Exception as e:
-                        st.error(f"Errore durante l'aggiunta della domanda ID {q_id} per il set '{set_name}': {e}")
-                        continue
-
-                # Crea il set se ha almeno un nome valido (può essere vuoto di domande)
-                if current_set_question_ids or len(questions_in_set_data) == 0:
-                    try:
-                        create_question_set(set_name, current_set_question_ids)
-                        sets_imported_count += 1
-                    except Exception as e:
-                        st.error(f"Errore durante la creazione del set '{set_name}': {e}")
-                else:
-                    st.warning(f"Il set '{set_name}' non è stato creato perché non conteneva domande valide.")
-
-            # Aggiorna lo stato della sessione
-            st.session_state.questions = load_questions()  # Ricarica per sincronizzare
-            st.session_state.question_sets = load_question_sets()  # Ricarica per sincronizzare
+            for warning in warnings[:MAX_IMPORT_WARNINGS]:
+                st.warning(warning)
+            if len(warnings) > MAX_IMPORT_WARNINGS:
+                st.warning(f"... e altri {len(warnings) - MAX_IMPORT_WARNINGS} avvisi.")
 
             # Componi il messaggio di successo
             if sets_imported_count > 0 or new_questions_added_count > 0:
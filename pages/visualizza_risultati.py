@@ -9,7 +9,10 @@ import plotly.graph_objects as go
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 from utils.data_utils import load_results, load_question_sets
-from utils.ui_utils import add_page_header, add_section_title, create_card, create_metrics_container
+from utils.ui_utils import (
+    add_page_header, add_section_title, create_card, create_metrics_container, format_call_metrics, show_run_telemetry,
+    show_sampling_summary
+)
 
 add_page_header(
     "Visualizzazione Risultati Test",
@@ -38,11 +41,12 @@ for _, row in st.session_state.results.iterrows():
     set_name = get_set_name(row['set_id'])
     avg_score = result_data.get('avg_score', 0)
     method = result_data.get('method', 'N/A')
-    method_icon = "🤖" if method == "LLM" else "🔍" if method == "BM25" else "📊"
+    method_icon = "🤖" if method == "LLM" else "🔍" if method == "BM25" else "🧭" if method == "Embedding" else "📊"
     
     processed_results_for_select.append({
         'id': row['id'],
         'display_name': f"{row['timestamp']} - {method_icon} {set_name} (Avg: {avg_score:.2f}%) - {method}"
+                        f"{' (campione)' if result_data.get('sampled') else ''}"
     })
 
 processed_results_for_select.sort(key=lambda x: x['display_name'].split(' - ')[0], reverse=True) # Ordina per timestamp
@@ -70,8 +74,9 @@ questions_results = result_data.get('questions', {})
 
 # Visualizza informazioni generali sul risultato
 evaluation_method = result_data.get('method', 'LLM')
-method_icon = "🤖" if evaluation_method == "LLM" else "🔍"
-method_desc = "Valutazione LLM" if evaluation_method == "LLM" else "Valutazione BM25"
+method_icon = {"LLM": "🤖", "BM25": "🔍", "Embedding": "🧭"}.get(evaluation_method, "📊")
+method_desc = {"LLM": "Valutazione LLM", "BM25": "Valutazione BM25",
+               "Embedding": "Valutazione con Embedding"}.get(evaluation_method, evaluation_method)
 
 add_section_title(f"Dettaglio Test: {set_name} [{method_icon} {evaluation_method}]", icon="📄")
 st.markdown(f"**ID Risultato:** `{selected_result_id}`")
@@ -92,6 +97,19 @@ if evaluation_method == "BM25" and 'parameters' in result_data:
         mt = params.get('medium_threshold', 'N/A')
         st.json({ "k1": k1, "b": b, "Soglia Alta": f"{ht}%", "Soglia Media": f"{mt}%" })
 
+if evaluation_method == "Embedding":
+    params = result_data.get('parameters', {})
+    if 'evaluation_preset' in result_data:
+        st.markdown(f"**Preset Embedding:** `{result_data['evaluation_preset']}`")
+    with st.expander("Parametri Embedding Utilizzati"):
+        st.json({
+            "Modello": params.get('model', 'N/A'),
+            "Testi per Richiesta": params.get('batch_size', 'N/A'),
+            "Soglia Alta": f"{params.get('high_threshold', 'N/A')}%",
+            "Soglia Media": f"{params.get('medium_threshold', 'N/A')}%",
+            "Risposte Attese dalla Cache": result_data.get('cached_references', 'N/A')
+        })
+
 # Metriche Generali del Test
 add_section_title("Metriche Generali del Test", icon="📈")
 
@@ -104,11 +122,17 @@ if questions_results:
         st.metric("Punteggio Medio Complessivo", f"{avg_score_overall:.2f}%")
     with cols_metrics[1]:
         st.metric("Numero di Domande Valutate", num_questions)
+    show_sampling_summary(result_data)
+
+    # Telemetria aggregata (token, costo, latenze) dei test eseguiti dopo la sua introduzione
+    if result_data.get('metrics'):
+        st.subheader("Token, Costi e Latenze")
+        show_run_telemetry(result_data['metrics'])
     
     # Grafico a barre dei punteggi per domanda (se applicabile)
     if evaluation_method == "LLM":
         scores_per_q = {q_data.get('question', f'Domanda {i}')[:50]+"...": q_data.get('evaluation',{}).get('score',0) for i, (q_id, q_data) in enumerate(questions_results.items())}
-    else: # BM25
+    else: # BM25 o Embedding
         scores_per_q = {q_data.get('question', f'Domanda {i}')[:50]+"...": q_data.get('similarity_score',0) for i, (q_id, q_data) in enumerate(questions_results.items())}
 
     if scores_per_q:
@@ -230,6 +254,10 @@ else:
             st.markdown(f"**Risposta Generata/Effettiva:** {actual_answer}")
             st.divider()
             
+            generation_metrics = q_data.get('generation_metrics')
+            if generation_metrics:
+                st.caption(f"Generazione — {format_call_metrics(generation_metrics)}")
+
             # Mostra Dettagli API di Generazione (se presenti e richiesti)
             generation_api_details = q_data.get('generation_api_details')
             if generation_api_details and isinstance(generation_api_details, dict):
@@ -270,6 +298,10 @@ else:
                 cols_eval_metrics[0].metric("Somiglianza", f"{similarity:.2f}%")
                 cols_eval_metrics[1].metric("Correttezza", f"{correctness:.2f}%")
                 cols_eval_metrics[2].metric("Completezza", f"{completeness:.2f}%")
+                if evaluation.get('metrics'):
+                    st.caption(f"Valutazione — {format_call_metrics(evaluation['metrics'])}")
+                if evaluation.get('fast_path'):
+                    st.caption(f"Valutazione rapida senza giudice LLM (regola: {evaluation['fast_path']})")
 
                 api_details = evaluation.get('api_details')
                 if api_details and isinstance(api_details, dict):
@@ -301,4 +333,9 @@ else:
                     st.markdown(f"**Termini Mancanti:** `{', '.join(missing_keywords)}`")
                 if extra_keywords:
                     st.markdown(f"**Termini in Eccesso:** `{', '.join(extra_keywords)}`")
+
+            elif evaluation_method == "Embedding":
+                st.markdown(f"##### Valutazione con Embedding")
+                st.markdown(f"**Similarità Coseno:** {q_data.get('similarity_score', 0):.2f}%")
+                st.markdown(f"**Livello di Match:** {q_data.get('match_level', 'N/A').capitalize()}")
             st.markdown("--- --- ---")
@@ -0,0 +1,123 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .rate_limit_utils import start_shared_rate_limits, use_shared_rate_limits
+from .run_utils import (
+    RUN_STATUS_COMPLETED, RUN_STATUS_FAILED, load_run, process_matrix, process_run, set_run_status
+)
+from .runtime_utils import logger
+
+# Processi che eseguono i test in background; ognuno esegue un test alla volta
+BACKGROUND_MAX_WORKERS = 4
+# Intervallo (secondi) con cui le pagine aggiornano l'avanzamento delle esecuzioni in corso
+RUN_POLL_INTERVAL_SECONDS = 3
+
+_executor = None
+_futures = {}
+_lock = threading.Lock()
+
+
+def _get_executor(reset: bool = False):
+    """Restituisce il pool di processi condiviso da tutte le sessioni del server."""
+    global _executor
+    with _lock:
+        if _executor is None or reset:
+            # I processi del pool condividono con il server un unico registro dei limiti dei preset:
+            # esecuzioni contemporanee sullo stesso preset non ne moltiplicano RPM e TPM
+            registry = start_shared_rate_limits()
+            # "spawn" evita di duplicare con fork i thread del server Streamlit
+            _executor = ProcessPoolExecutor(
+                max_workers=BACKGROUND_MAX_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                initializer=use_shared_rate_limits, initargs=(registry,)
+            )
+        return _executor
+
+
+def run_in_background_worker(run_id):
+    """
+    Esegue un'esecuzione registrata in un processo del pool (vedi process_run).
+    L'avanzamento è visibile nel database (test_runs.completed) mentre le domande vengono completate.
+    Returns:
+        L'ID del risultato salvato in test_results, o None se l'esecuzione non è stata completata.
+    """
+    record = process_run(run_id)
+    return record['id'] if record else None
+
+
+def run_matrix_in_background_worker(run_ids):
+    """
+    Esegue contemporaneamente in un processo del pool le esecuzioni di una matrice (vedi process_matrix).
+    Returns:
+        Un dizionario {run_id: ID del risultato salvato | None}.
+    """
+    return {run_id: record['id'] if record else None for run_id, record in process_matrix(run_ids).items()}
+
+
+def _on_run_done(run_id, future):
+    """Registra come fallite le esecuzioni il cui processo è terminato con un errore non gestito."""
+    with _lock:
+        _futures.pop(run_id, None)
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is None:
+        return
+    logger.error(f"Esecuzione in background {run_id} terminata con errore: {type(error).__name__} - {error}")
+    try:
+        run = load_run(run_id)
+        if run and run['status'] != RUN_STATUS_COMPLETED:
+            set_run_status(run_id, RUN_STATUS_FAILED, error=f"{type(error).__name__}: {error}")
+    except Exception as e:
+        logger.error(f"Aggiornamento dello stato dell'esecuzione {run_id} fallito: {e}")
+
+
+def submit_run(run_id):
+    """
+    Accoda un'esecuzione registrata nel pool di processi in background.
+    Se l'esecuzione è già in corso in questo server non viene accodata una seconda volta.
+    Returns:
+        Il Future dell'esecuzione.
+    """
+    run_id = str(run_id)
+    with _lock:
+        future = _futures.get(run_id)
+    if future is not None and not future.done():
+        return future
+    try:
+        future = _get_executor().submit(run_in_background_worker, run_id)
+    except BrokenProcessPool:
+        # Un processo del pool è terminato in modo anomalo: il pool va ricreato
+        future = _get_executor(reset=True).submit(run_in_background_worker, run_id)
+    with _lock:
+        _futures[run_id] = future
+    future.add_done_callback(lambda f: _on_run_done(run_id, f))
+    return future
+
+
+def submit_matrix(run_ids):
+    """
+    Accoda come un unico lavoro in background le esecuzioni di una matrice,
+    che vengono eseguite contemporaneamente nello stesso processo.
+    Returns:
+        Il Future del lavoro.
+    """
+    run_ids = [str(run_id) for run_id in run_ids]
+    try:
+        future = _get_executor().submit(run_matrix_in_background_worker, run_ids)
+    except BrokenProcessPool:
+        future = _get_executor(reset=True).submit(run_matrix_in_background_worker, run_ids)
+    with _lock:
+        for run_id in run_ids:
+            _futures[run_id] = future
+    for run_id in run_ids:
+        future.add_done_callback(lambda f, run_id=run_id: _on_run_done(run_id, f))
+    return future
+
+
+def is_run_active(run_id):
+    """True se l'esecuzione è accodata o in corso nel pool di questo server."""
+    with _lock:
+        future = _futures.get(str(run_id))
+    return future is not None and not future.done()
@@ -0,0 +1,304 @@
+import io
+import json
+import time
+
+from .openai_utils import (
+    SDK_MAX_RETRIES, get_openai_client, _build_generation_request, _build_evaluation_request, _parse_evaluation_content
+)
+from .telemetry_utils import BATCH_API_DISCOUNT, call_metrics
+from .fast_path_utils import fast_path_evaluation
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_POLL_INTERVAL_SECONDS = 30
+BATCH_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+# Limiti di un singolo file del Batch API (50.000 richieste, 200 MB): oltre, le richieste vengono divise in più batch
+BATCH_MAX_REQUESTS = 50000
+BATCH_MAX_FILE_BYTES = 190 * 1024 * 1024
+
+
+def build_batch_lines(requests: dict):
+    """
+    Converte un dizionario {custom_id: parametri chat completion} nelle righe JSONL del Batch API.
+    Returns:
+        Il contenuto del file JSONL come bytes.
+    """
+    lines = [
+        json.dumps({"custom_id": str(custom_id), "method": "POST", "url": BATCH_ENDPOINT, "body": body},
+                   ensure_ascii=False)
+        for custom_id, body in requests.items()
+    ]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def split_batch_requests(requests: dict, max_requests: int = None, max_bytes: int = None):
+    """
+    Divide le richieste in gruppi che rispettano i limiti di un file del Batch API, nell'ordine
+    del dizionario (lo stesso input produce sempre gli stessi gruppi, vedi _run_batch_stage).
+    Args:
+        max_requests: Richieste massime per gruppo (default: BATCH_MAX_REQUESTS).
+        max_bytes: Dimensione massima del file JSONL di un gruppo (default: BATCH_MAX_FILE_BYTES).
+    Returns:
+        Una lista di dizionari {custom_id: parametri chat completion}.
+    """
+    max_requests = max_requests or BATCH_MAX_REQUESTS
+    max_bytes = max_bytes or BATCH_MAX_FILE_BYTES
+    parts, current, current_bytes = [], {}, 0
+    for custom_id, body in requests.items():
+        line_bytes = len(build_batch_lines({custom_id: body}))
+        if current and (len(current) >= max_requests or current_bytes + line_bytes > max_bytes):
+            parts.append(current)
+            current, current_bytes = {}, 0
+        current[custom_id] = body
+        current_bytes += line_bytes
+    if current:
+        parts.append(current)
+    return parts
+
+
+def submit_batch(client, requests: dict, description: str = ""):
+    """
+    Carica il file JSONL delle richieste e crea il batch corrispondente.
+    Args:
+        client: Client OpenAI sincrono.
+        requests: Dizionario {custom_id: parametri chat completion}.
+        description: Descrizione salvata nei metadati del batch.
+    Returns:
+        L'oggetto batch restituito dall'API.
+    """
+    batch_file = client.files.create(
+        file=("batch_requests.jsonl", io.BytesIO(build_batch_lines(requests))),
+        purpose="batch"
+    )
+    batch_params = {
+        "input_file_id": batch_file.id,
+        "endpoint": BATCH_ENDPOINT,
+        "completion_window": BATCH_COMPLETION_WINDOW
+    }
+    if description:
+        batch_params["metadata"] = {"description": description}
+    return client.batches.create(**batch_params)
+
+
+def wait_for_batch(client, batch_id: str, poll_interval: float = BATCH_POLL_INTERVAL_SECONDS,
+                   status_callback=None):
+    """
+    Interroga periodicamente lo stato di un batch finché non raggiunge uno stato finale.
+    Args:
+        client: Client OpenAI sincrono.
+        batch_id: ID del batch da monitorare.
+        poll_interval: Secondi di attesa tra due interrogazioni.
+        status_callback: Funzione opzionale chiamata con l'oggetto batch a ogni interrogazione.
+    Returns:
+        L'oggetto batch nello stato finale.
+    """
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if status_callback:
+            status_callback(batch)
+        if batch.status in BATCH_TERMINAL_STATUSES:
+            return batch
+        time.sleep(poll_interval)
+
+
+def download_batch_results(client, batch):
+    """
+    Scarica i file di output e di errore di un batch terminato.
+    Returns:
+        Un dizionario {custom_id: {"body": corpo della risposta | None, "error": messaggio | None}}.
+    """
+    outputs = {}
+    for file_id in (getattr(batch, "output_file_id", None), getattr(batch, "error_file_id", None)):
+        if not file_id:
+            continue
+        content = client.files.content(file_id).text
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            response = entry.get("response") or {}
+            error = entry.get("error")
+            if response.get("status_code", 200) != 200 and not error:
+                error = response.get("body", {}).get("error", {}).get("message", f"HTTP {response.get('status_code')}")
+            outputs[entry["custom_id"]] = {
+                "body": response.get("body") if not error else None,
+                "error": str(error) if error else None
+            }
+    return outputs
+
+
+def _message_content(body):
+    """Estrae il contenuto del primo messaggio da un corpo di chat completion restituito dal batch."""
+    if not body or not body.get("choices"):
+        return None
+    return body["choices"][0].get("message", {}).get("content")
+
+
+def _batch_call_metrics(body, model: str):
+    """Telemetria di una risposta del Batch API: token e costo scontato, senza latenza per singola chiamata."""
+    return call_metrics(body.get("model") or model, body.get("usage"), discount=BATCH_API_DISCOUNT) if body else None
+
+
+def _run_batch_stage(client, requests: dict, description: str, poll_interval: float, status_callback,
+                     batch_ids: list = None, batch_ids_callback=None):
+    """
+    Invia un gruppo di richieste, diviso in più batch se supera i limiti di un file, attende che
+    tutti terminino e ne restituisce gli output.
+    Args:
+        batch_ids: ID dei batch già creati per questa fase (es. prima di un riavvio), nell'ordine dei
+            gruppi di split_batch_requests: vengono ripresi invece di crearne e pagarne di nuovi.
+        batch_ids_callback: Funzione opzionale chiamata con la lista degli ID dopo ogni nuovo batch,
+            per salvarli prima dell'attesa.
+    Returns:
+        Gli output come download_batch_results. Le richieste senza output di un batch scaduto,
+        annullato o fallito riportano come errore lo stato del batch; gli output già prodotti
+        vengono comunque usati.
+    Raises:
+        RuntimeError se nessun batch ha prodotto output.
+    """
+    if not requests:
+        return {}
+    parts = split_batch_requests(requests)
+    batch_ids = list(batch_ids or [])[:len(parts)]
+    for index in range(len(batch_ids), len(parts)):
+        part_description = description if len(parts) == 1 else f"{description} {index + 1}/{len(parts)}"
+        batch_ids.append(submit_batch(client, parts[index], description=part_description).id)
+        if batch_ids_callback:
+            batch_ids_callback(list(batch_ids))
+
+    outputs = {}
+    statuses = []
+    for part, batch_id in zip(parts, batch_ids):
+        batch = wait_for_batch(
+            client, batch_id, poll_interval=poll_interval,
+            status_callback=(lambda b: status_callback(description, b)) if status_callback else None
+        )
+        statuses.append(batch.status)
+        part_outputs = download_batch_results(client, batch)
+        if batch.status != "completed":
+            missing = {"body": None, "error": f"Batch '{description}' terminato con stato '{batch.status}'"}
+            part_outputs = {custom_id: part_outputs.get(custom_id, missing) for custom_id in part}
+        outputs.update(part_outputs)
+    if not any(output["body"] for output in outputs.values()) and any(status != "completed" for status in statuses):
+        raise RuntimeError(f"Batch '{description}' terminato con stato '{', '.join(sorted(set(statuses)))}'.")
+    return outputs
+
+
+def run_llm_test_batch(questions, gen_config: dict, eval_config: dict, show_api_details: bool = False,
+                       poll_interval: float = BATCH_POLL_INTERVAL_SECONDS, status_callback=None,
+                       use_fast_path: bool = False, batch_ids: dict = None, batch_ids_callback=None):
+    """
+    Esegue un test LLM tramite il Batch API: prima un batch con tutte le generazioni,
+    poi un batch con tutte le valutazioni. Più lento del tempo reale ma più economico.
+    Args:
+        questions: Lista di tuple (question_id, {'question': ..., 'expected_answer': ...}).
+        gen_config: Preset API usato per generare le risposte.
+        eval_config: Preset API usato per valutare le risposte; None per eseguire soltanto il batch
+            di generazione (vedi run_llm_test_async).
+        show_api_details: Se True, include i dettagli delle richieste nei risultati.
+        poll_interval: Secondi di attesa tra due interrogazioni dello stato dei batch.
+        status_callback: Funzione opzionale chiamata come status_callback(fase, batch) durante l'attesa.
+        use_fast_path: Se True, le risposte il cui esito è certo non entrano nel batch di valutazione
+            (vedi fast_path_evaluation).
+        batch_ids: Dizionario {fase: [ID dei batch]} dei batch già creati da questo test, ripresi dopo
+            un riavvio invece di inviarne di nuovi.
+        batch_ids_callback: Funzione opzionale chiamata come batch_ids_callback(batch_ids) con il
+            dizionario aggiornato ogni volta che viene creato un batch.
+    Returns:
+        Un dizionario {question_id: risultato} nello stesso formato salvato da add_test_result,
+        con token e costo stimato di ogni chiamata in 'generation_metrics' e 'evaluation.metrics'.
+    """
+    gen_client = get_openai_client(api_key=gen_config.get("api_key"), base_url=gen_config.get("endpoint"))
+    eval_client = None
+    if eval_config is not None:
+        eval_client = get_openai_client(api_key=eval_config.get("api_key"), base_url=eval_config.get("endpoint"))
+    if not gen_client or (eval_config is not None and not eval_client):
+        raise ValueError("Client API per generazione o valutazione non configurato.")
+    # Le poche chiamate di gestione dei batch usano i tentativi automatici dell'SDK
+    gen_client = gen_client.with_options(max_retries=SDK_MAX_RETRIES)
+
+    questions = [(str(q_id), q_data) for q_id, q_data in questions]
+    batch_ids = dict(batch_ids or {})
+
+    def stage_ids_callback(stage):
+        def save(ids):
+            batch_ids[stage] = ids
+            if batch_ids_callback:
+                batch_ids_callback(dict(batch_ids))
+        return save
+
+    gen_requests = {
+        q_id: _build_generation_request(q_data['question'], gen_config)
+        for q_id, q_data in questions
+        if isinstance(q_data['question'], str) and q_data['question'].strip()
+    }
+    gen_outputs = _run_batch_stage(gen_client, gen_requests, "generazione", poll_interval, status_callback,
+                                   batch_ids.get("generazione"), stage_ids_callback("generazione"))
+
+    results = {}
+    answers = {}
+    for q_id, q_data in questions:
+        output = gen_outputs.get(q_id, {"body": None, "error": "Risposta mancante nel batch"})
+        content = _message_content(output["body"])
+        generation_api_details = None
+        if show_api_details:
+            generation_api_details = {"request": gen_requests.get(q_id)}
+            if output["error"]:
+                generation_api_details["error"] = output["error"]
+            else:
+                generation_api_details["response_content"] = content
+        if not content or not content.strip():
+            results[q_id] = {
+                'question': q_data['question'],
+                'expected_answer': q_data['expected_answer'],
+                'actual_answer': "Errore Generazione",
+                'evaluation': {'score': 0, 'explanation': 'Generazione fallita'},
+                'generation_api_details': generation_api_details,
+                'generation_failed': True
+            }
+            continue
+        answers[q_id] = content.strip()
+        results[q_id] = {
+            'question': q_data['question'],
+            'expected_answer': q_data['expected_answer'],
+            'actual_answer': answers[q_id],
+            'generation_api_details': generation_api_details,
+            'generation_metrics': _batch_call_metrics(output["body"], gen_requests[q_id]["model"])
+        }
+
+    if eval_config is None:
+        return results
+    if use_fast_path:
+        questions_by_id = dict(questions)
+        for q_id in list(answers):
+            q_data = questions_by_id[q_id]
+            fast_evaluation = fast_path_evaluation(q_data['question'], q_data['expected_answer'], answers[q_id])
+            if fast_evaluation:
+                results[q_id]['evaluation'] = fast_evaluation
+                del answers[q_id]
+    eval_client = eval_client.with_options(max_retries=SDK_MAX_RETRIES)
+    eval_requests = {
+        q_id: _build_evaluation_request(q_data['question'], q_data['expected_answer'], answers[q_id], eval_config)
+        for q_id, q_data in questions if q_id in answers
+    }
+    eval_outputs = _run_batch_stage(eval_client, eval_requests, "valutazione", poll_interval, status_callback,
+                                    batch_ids.get("valutazione"), stage_ids_callback("valutazione"))
+
+    for q_id in answers:
+        output = eval_outputs.get(q_id, {"body": None, "error": "Risposta mancante nel batch"})
+        api_details_for_log = {"request": eval_requests[q_id]} if show_api_details else {}
+        if output["error"]:
+            api_details_for_log["error"] = output["error"]
+            results[q_id]['evaluation'] = {
+                "score": 0, "explanation": f"Errore API: {output['error']}",
+                "similarity": 0, "correctness": 0, "completeness": 0,
+                "api_details": api_details_for_log, "failed": True
+            }
+            continue
+        content = _message_content(output["body"]) or "{}"
+        if show_api_details:
+            api_details_for_log["response_content"] = content
+        results[q_id]['evaluation'] = _parse_evaluation_content(content, api_details_for_log)
+        results[q_id]['evaluation']['metrics'] = _batch_call_metrics(output["body"], eval_requests[q_id]["model"])
+
+    return results
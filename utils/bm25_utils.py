@@ -0,0 +1,204 @@
+import re
+import unicodedata
+
+import numpy as np
+from scipy import sparse
+
+# Parametri predefiniti della valutazione BM25 (le soglie sono percentuali di similarità)
+BM25_DEFAULT_PARAMETERS = {
+    "k1": 1.5,
+    "b": 0.75,
+    "high_threshold": 70.0,
+    "medium_threshold": 40.0,
+    # IDF e lunghezza media dall'indice dei termini dell'intera banca domande invece che dalla sola esecuzione
+    "use_question_bank": True
+}
+# Termini mancanti o in eccesso riportati per ogni risposta, dai più discriminanti
+MAX_KEYWORDS_REPORTED = 10
+
+# Parole funzionali italiane escluse dal confronto: non distinguono una risposta dall'altra
+ITALIAN_STOPWORDS = frozenset("""
+a ad al allo ai agli all alla alle c che chi ci col con contro cui da dal dallo dai dagli dall dalla dalle
+degli dei del dell della delle dello di e ed è era erano essere fa gli ha hanno ho i il in l la le lo loro
+ma mi ne negli nei nel nell nella nelle nello no non o per più po può quale quali quando quanto quella
+quelle quelli quello questa queste questi questo se si sia sono su sua sue sugli sui sul sull sulla sulle
+sullo suo suoi tra tu un una uno va vi
+""".split())
+
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+_COMBINING_MARKS = re.compile(r"[\u0300-\u036f]")
+
+
+def tokenize(text: str):
+    """
+    Divide un testo in termini confrontabili: minuscolo, senza accenti e senza parole funzionali.
+    Returns:
+        La lista dei termini nell'ordine del testo.
+    """
+    if not isinstance(text, str) or not text:
+        return []
+    normalized = text.lower()
+    if not normalized.isascii():
+        normalized = _COMBINING_MARKS.sub("", unicodedata.normalize("NFKD", normalized))
+    return [token for token in _TOKEN_PATTERN.findall(normalized) if token not in ITALIAN_STOPWORDS]
+
+
+def _term_entries(token_lists: list, vocabulary: dict):
+    """
+    Coordinate (riga, colonna, valore) delle occorrenze dei termini, da cui costruire la matrice
+    sparsa documenti x termini; i termini nuovi vengono aggiunti al vocabolario.
+    """
+    rows, cols = [], []
+    for row, tokens in enumerate(token_lists):
+        for token in tokens:
+            rows.append(row)
+            cols.append(vocabulary.setdefault(token, len(vocabulary)))
+    data = np.ones(len(rows), dtype=np.float64)
+    return rows, cols, data
+
+
+def bm25_weights(counts: sparse.csr_matrix, idf: np.ndarray, k1: float, b: float, avgdl: float = None):
+    """
+    Pesi BM25 di ogni termine in ogni documento, calcolati sui soli valori non nulli della matrice.
+    Args:
+        counts: Matrice CSR (documenti x termini) delle occorrenze.
+        idf: Vettore IDF dei termini.
+        k1: Saturazione della frequenza dei termini.
+        b: Normalizzazione sulla lunghezza del documento.
+        avgdl: Lunghezza media dei documenti del corpus (default: quella di counts).
+    """
+    lengths = np.asarray(counts.sum(axis=1)).ravel()
+    if avgdl is None:
+        avgdl = lengths.mean() if lengths.size else 0.0
+    avgdl = avgdl or 1.0
+    weights = counts.copy().astype(np.float64)
+    # Lunghezza del documento di appartenenza di ogni valore non nullo
+    row_lengths = np.repeat(lengths, np.diff(weights.indptr))
+    tf = weights.data
+    weights.data = idf[weights.indices] * tf * (k1 + 1) / (tf + k1 * (1 - b + b * row_lengths / avgdl))
+    return weights
+
+
+def bm25_idf(document_frequencies: np.ndarray, documents: int):
+    """IDF di Okapi BM25 con il +1 che lo mantiene positivo anche per i termini molto frequenti."""
+    return np.log(1.0 + (documents - document_frequencies + 0.5) / (document_frequencies + 0.5))
+
+
+def _top_terms(matrix: sparse.csr_matrix, idf: np.ndarray, terms: np.ndarray, row: int):
+    """Termini presenti nella riga row, ordinati per IDF decrescente."""
+    start, end = matrix.indptr[row], matrix.indptr[row + 1]
+    indices = matrix.indices[start:end]
+    order = np.argsort(-idf[indices], kind="stable")[:MAX_KEYWORDS_REPORTED]
+    return terms[indices[order]].tolist()
+
+
+def score_answers(answers: list, references: list, k1: float = BM25_DEFAULT_PARAMETERS["k1"],
+                  b: float = BM25_DEFAULT_PARAMETERS["b"], corpus: dict = None):
+    """
+    Confronta in un'unica passata vettoriale ogni risposta con la propria risposta attesa.
+
+    Le risposte attese formano il corpus da cui si ricavano IDF e lunghezza media, se non viene
+    passato un corpus più ampio; la risposta generata è la query e il punteggio BM25 ottenuto sulla
+    propria risposta attesa viene normalizzato su quello della risposta attesa confrontata con se stessa
+    (100% = tutti i termini attesi presenti).
+    Args:
+        answers: Risposte da valutare.
+        references: Risposte attese, nello stesso ordine.
+        k1: Saturazione della frequenza dei termini.
+        b: Normalizzazione sulla lunghezza del documento.
+        corpus: Statistiche opzionali di un corpus esterno, con 'documents', 'avgdl' e
+            'document_frequencies' (vedi term_index_utils.load_corpus_statistics).
+    Returns:
+        Una tupla (punteggi in percentuale come array numpy, termini mancanti, termini in eccesso),
+        con una lista di termini per risposta.
+    """
+    if len(answers) != len(references):
+        raise ValueError("Il numero di risposte e di risposte attese deve coincidere.")
+    if not answers:
+        return np.zeros(0), [], []
+
+    vocabulary = {}
+    ref_rows, ref_cols, ref_data = _term_entries([tokenize(text) for text in references], vocabulary)
+    ans_rows, ans_cols, ans_data = _term_entries([tokenize(text) for text in answers], vocabulary)
+    shape = (len(answers), max(len(vocabulary), 1))
+    # Le occorrenze ripetute dello stesso termine vengono sommate nella conversione in CSR
+    reference_counts = sparse.csr_matrix((ref_data, (ref_rows, ref_cols)), shape=shape)
+    answer_counts = sparse.csr_matrix((ans_data, (ans_rows, ans_cols)), shape=shape)
+
+    reference_terms = (reference_counts > 0).astype(np.float64)
+    answer_terms = (answer_counts > 0).astype(np.float64)
+    document_frequencies = np.asarray(reference_terms.sum(axis=0)).ravel()
+    documents, avgdl = len(references), None
+    if corpus:
+        corpus_frequencies = np.zeros_like(document_frequencies)
+        for token, index in vocabulary.items():
+            corpus_frequencies[index] = corpus['document_frequencies'].get(token, 0)
+        # Il massimo copre le risposte attese modificate dopo l'ultimo aggiornamento dell'indice
+        document_frequencies = np.maximum(document_frequencies, corpus_frequencies)
+        documents, avgdl = max(corpus['documents'], documents), corpus['avgdl']
+    idf = bm25_idf(document_frequencies, documents)
+
+    weights = bm25_weights(reference_counts, idf, k1, b, avgdl)
+    raw_scores = np.asarray(answer_terms.multiply(weights).sum(axis=1)).ravel()
+    max_scores = np.asarray(weights.sum(axis=1)).ravel()
+    scores = np.divide(100.0 * raw_scores, max_scores, out=np.zeros_like(raw_scores), where=max_scores > 0)
+
+    terms = np.empty(len(vocabulary), dtype=object)
+    for token, index in vocabulary.items():
+        terms[index] = token
+    missing = (reference_terms - answer_terms).maximum(0).tocsr()
+    extra = (answer_terms - reference_terms).maximum(0).tocsr()
+    missing.eliminate_zeros()
+    extra.eliminate_zeros()
+    missing_keywords = [_top_terms(missing, idf, terms, row) for row in range(len(answers))]
+    extra_keywords = [_top_terms(extra, idf, terms, row) for row in range(len(answers))]
+    return np.clip(scores, 0.0, 100.0), missing_keywords, extra_keywords
+
+
+def match_level(score: float, high_threshold: float, medium_threshold: float):
+    """Livello di corrispondenza ("alto", "medio", "basso") di un punteggio rispetto alle soglie."""
+    if score >= high_threshold:
+        return "alto"
+    if score >= medium_threshold:
+        return "medio"
+    return "basso"
+
+
+def _suggestions(level: str, missing_keywords: list):
+    if level == "alto":
+        return "La risposta copre i termini chiave della risposta attesa."
+    if not missing_keywords:
+        return "La risposta usa termini diversi da quelli attesi: verificarne il contenuto."
+    return f"Integrare nella risposta i concetti: {', '.join(missing_keywords[:5])}."
+
+
+def evaluate_results_bm25(results: dict, parameters: dict = None, corpus: dict = None):
+    """
+    Aggiunge la valutazione BM25 ai risultati di un'esecuzione, con un'unica passata su tutte le risposte.
+    Le domande la cui generazione è fallita ottengono punteggio 0.
+    Args:
+        results: Dizionario {question_id: risultato} con 'expected_answer' e 'actual_answer'.
+        parameters: k1, b, high_threshold e medium_threshold (default: BM25_DEFAULT_PARAMETERS).
+        corpus: Statistiche opzionali del corpus da cui ricavare IDF e lunghezza media (vedi score_answers).
+    Returns:
+        Lo stesso dizionario, in cui ogni risultato riporta similarity_score, match_level,
+        missing_keywords, extra_keywords e suggestions.
+    """
+    parameters = dict(BM25_DEFAULT_PARAMETERS, **(parameters or {}))
+    q_ids = list(results)
+    answers = ["" if results[q_id].get('generation_failed') else results[q_id].get('actual_answer', "")
+               for q_id in q_ids]
+    references = [results[q_id].get('expected_answer', "") for q_id in q_ids]
+    scores, missing, extra = score_answers(answers, references, k1=parameters["k1"], b=parameters["b"],
+                                           corpus=corpus)
+
+    for q_id, score, missing_keywords, extra_keywords in zip(q_ids, scores, missing, extra):
+        level = match_level(score, parameters["high_threshold"], parameters["medium_threshold"])
+        results[q_id].update({
+            'similarity_score': round(float(score), 2),
+            'match_level': level,
+            'missing_keywords': missing_keywords,
+            'extra_keywords': extra_keywords,
+            'suggestions': _suggestions(level, missing_keywords)
+        })
+    return results
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import text
+
+from .db_utils import get_engine
+from .runtime_utils import logger
+
+
+def make_cache_key(payload: dict):
+    """Hash SHA-256 stabile di un dizionario serializzabile in JSON."""
+    serialized = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class PersistentCache:
+    """
+    Cache a due livelli: un LRU in memoria nel processo davanti a una tabella MySQL.
+    Le voci scadono dopo ttl_seconds; la tabella viene mantenuta entro max_entries
+    eliminando le voci usate meno di recente.
+    """
+
+    # Ogni quante scritture viene eseguita la pulizia della tabella
+    EVICTION_INTERVAL = 200
+
+    def __init__(self, table: str, ttl_seconds: float, max_entries: int, memory_entries: int):
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def configure(self, ttl_seconds: float = None, max_entries: int = None, memory_entries: int = None):
+        """Aggiorna TTL e dimensioni massime della cache."""
+        with self._lock:
+            if ttl_seconds is not None:
+                self.ttl_seconds = ttl_seconds
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if memory_entries is not None:
+                self.memory_entries = memory_entries
+                while len(self._memory) > self.memory_entries:
+                    self._memory.popitem(last=False)
+
+    def _memory_get(self, key: str, now: float):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            value, created_at = entry
+            if now - created_at > self.ttl_seconds:
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return value
+
+    def _memory_put(self, key: str, value: str, created_at: float):
+        with self._lock:
+            self._memory[key] = (value, created_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str):
+        """Restituisce il valore memorizzato per key, o None se assente o scaduto."""
+        now = time.time()
+        value = self._memory_get(key, now)
+        if value is not None:
+            return value
+        try:
+            with get_engine().begin() as conn:
+                row = conn.execute(
+                    text(f"SELECT value, created_at FROM {self.table} WHERE cache_key = :key AND created_at >= :cutoff"),
+                    {"key": key, "cutoff": now - self.ttl_seconds}
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute(
+                    text(f"UPDATE {self.table} SET last_access = :now, hits = hits + 1 WHERE cache_key = :key"),
+                    {"key": key, "now": now}
+                )
+        except Exception as e:
+            logger.warning(f"Lettura dalla cache {self.table} fallita: {e}")
+            return None
+        self._memory_put(key, row[0], row[1])
+        return row[0]
+
+    def put(self, key: str, value: str, model: str = ""):
+        """Memorizza value per key in memoria e nel database."""
+        now = time.time()
+        self._memory_put(key, value, now)
+        try:
+            with get_engine().begin() as conn:
+                conn.execute(
+                    text(f"""INSERT INTO {self.table} (cache_key, model, value, created_at, last_access, hits)
+                             VALUES (:key, :model, :value, :now, :now, 0)
+                             ON DUPLICATE KEY UPDATE value = VALUES(value), model = VALUES(model),
+                                 created_at = VALUES(created_at), last_access = VALUES(last_access)"""),
+                    {"key": key, "model": model, "value": value, "now": now}
+                )
+                with self._lock:
+                    self._writes += 1
+                    evict = self._writes % self.EVICTION_INTERVAL == 0
+                if evict:
+                    self._evict(conn, now)
+        except Exception as e:
+            logger.warning(f"Scrittura nella cache {self.table} fallita: {e}")
+
+    def _evict(self, conn, now: float):
+        """Elimina le voci scadute e quelle meno usate di recente oltre max_entries."""
+        conn.execute(text(f"DELETE FROM {self.table} WHERE created_at < :cutoff"), {"cutoff": now - self.ttl_seconds})
+        threshold = conn.execute(
+            text(f"SELECT last_access FROM {self.table} ORDER BY last_access DESC LIMIT 1 OFFSET :offset"),
+            {"offset": int(self.max_entries)}
+        ).scalar()
+        if threshold is not None:
+            conn.execute(text(f"DELETE FROM {self.table} WHERE last_access <= :threshold"), {"threshold": threshold})
+
+    def clear(self):
+        """Svuota la cache in memoria e la tabella corrispondente."""
+        with self._lock:
+            self._memory.clear()
+        with get_engine().begin() as conn:
+            conn.execute(text(f"DELETE FROM {self.table}"))
+
+
+# Cache delle risposte generate: chiave = hash di (modello, endpoint, prompt, temperatura, max_tokens)
+generation_cache = PersistentCache("generation_cache", ttl_seconds=7 * 24 * 3600, max_entries=100000, memory_entries=5000)
+
+
+def generation_cache_key(request: dict, endpoint: str):
+    """Chiave della cache per una richiesta di generazione verso un endpoint."""
+    return make_cache_key({
+        "model": request.get("model"),
+        "endpoint": endpoint,
+        "messages": request.get("messages"),
+        "temperature": request.get("temperature"),
+        "max_tokens": request.get("max_tokens")
+    })
+
+
+# Cache dei giudizi del valutatore: chiave = hash di (domanda, risposta attesa, risposta effettiva,
+# modello, endpoint, prompt, temperatura, max_tokens)
+evaluation_cache = PersistentCache("evaluation_cache", ttl_seconds=30 * 24 * 3600, max_entries=200000, memory_entries=10000)
+
+
+def evaluation_cache_key(question: str, expected_answer: str, actual_answer: str, request: dict, endpoint: str):
+    """Chiave della cache per il giudizio su una terna (domanda, risposta attesa, risposta effettiva)."""
+    return make_cache_key({
+        "question": question,
+        "expected_answer": expected_answer,
+        "actual_answer": actual_answer,
+        "model": request.get("model"),
+        "endpoint": endpoint,
+        "messages": request.get("messages"),
+        "temperature": request.get("temperature"),
+        "max_tokens": request.get("max_tokens")
+    })
@@ -0,0 +1,257 @@
+"""
+Esecuzione dei test da riga di comando, senza Streamlit (es. regressioni notturne da cron o CI).
+
+Esempi:
+    python -m utils.cli run --set "Matematica di base" --gen-preset gpt-4o --eval-preset gpt-4o --concurrency 8
+    python -m utils.cli run --set "Matematica di base" --gen-preset gpt-4o gpt-4o-mini claude --eval-preset gpt-4o
+    python -m utils.cli run --set "Matematica di base" --gen-preset gpt-4o --method bm25
+    python -m utils.cli run --set "Matematica di base" --gen-preset gpt-4o --method embedding --eval-preset openai
+    python -m utils.cli run --set "Matematica di base" --gen-preset gpt-4o --sample-ci-width 4 --sample-max 300
+    python -m utils.cli resume --run-id <id esecuzione>
+    python -m utils.cli list-sets
+"""
+import argparse
+import logging
+import sys
+
+from .data_utils import initialize_data, load_question_sets
+from .bm25_utils import BM25_DEFAULT_PARAMETERS
+from .embedding_utils import EMBEDDING_DEFAULT_PARAMETERS
+from .sampling_utils import SAMPLING_DEFAULT_PARAMETERS, SAMPLING_METHODS
+from .run_utils import (
+    EVALUATION_METHOD_BM25, EVALUATION_METHOD_EMBEDDING, EVALUATION_METHOD_LLM, EXECUTION_MODE_BATCH, EXECUTION_MODE_REALTIME, RUN_STATUS_RUNNING,
+    build_run_config, create_matrix_runs, create_run, load_preset_config, load_run, load_run_questions,
+    process_matrix, process_run
+)
+
+
+def _find_question_set(set_ref: str):
+    """Cerca un set di domande per ID o, in alternativa, per nome."""
+    sets_df = load_question_sets()
+    match = sets_df[sets_df['id'] == str(set_ref)]
+    if match.empty:
+        match = sets_df[sets_df['name'] == set_ref]
+    return match.iloc[0].to_dict() if not match.empty else None
+
+
+def _print_progress(completed: int, total: int):
+    print(f"\r{completed}/{total} domande completate", end="", file=sys.stderr, flush=True)
+
+
+def _print_matrix_progress(run_names: dict):
+    """Stampa l'avanzamento di tutte le esecuzioni di una matrice su una riga."""
+    progress = {run_id: (0, 0) for run_id in run_names}
+
+    def callback(run_id, completed, total):
+        progress[run_id] = (completed, total)
+        line = " | ".join(f"{run_names[r]}: {c}/{t}" for r, (c, t) in progress.items())
+        print(f"\r{line}", end="", file=sys.stderr, flush=True)
+    return callback
+
+
+def _report(run_id, record, newline: bool = True):
+    """Stampa l'esito di un'esecuzione e restituisce il codice di uscita."""
+    if newline:
+        print(file=sys.stderr)
+    if not record:
+        run = load_run(run_id)
+        status = run['status'] if run else "non trovata"
+        error = run.get('error') if run else None
+        print(f"Esecuzione {run_id} non completata ({status}){': ' + error if error else ''}", file=sys.stderr)
+        return 1
+    result_data = record['results']
+    print(f"Esecuzione {run_id} completata: risultato {record['id']}, "
+          f"punteggio medio {result_data['avg_score']:.2f}% su {len(result_data['questions'])} domande")
+    metrics = result_data.get('metrics')
+    if metrics:
+        cost = f"${metrics['cost']:.4f}" if metrics.get('cost') is not None else "n/d"
+        p95 = metrics['latency']['generation']['p95']
+        qpm = metrics.get('questions_per_minute')
+        print(f"  token {metrics['total_tokens']} (in cache {metrics['cached_tokens']}), costo stimato {cost}, "
+              f"latenza generazione p95 {f'{p95:.2f}s' if p95 is not None else 'n/d'}, "
+              f"{f'{qpm:.1f}' if qpm is not None else 'n/d'} domande/min")
+        if metrics.get('judge_calls_saved'):
+            print(f"  chiamate al giudice risparmiate dalla valutazione rapida: {metrics['judge_calls_saved']}")
+    if result_data.get('sampled'):
+        sampling, interval = result_data['sampling'], result_data['confidence_interval']
+        print(f"  esecuzione a campione: {sampling['questions_evaluated']}/{sampling['questions_total']} domande "
+              f"({sampling['stop_reason']}), intervallo di confidenza al {interval['confidence']:.0%} "
+              f"{interval['low']:.2f}% - {interval['high']:.2f}%")
+    return 0
+
+
+# Metodi di valutazione accettati da --method
+EVALUATION_METHODS = {
+    "llm": EVALUATION_METHOD_LLM,
+    "bm25": EVALUATION_METHOD_BM25,
+    "embedding": EVALUATION_METHOD_EMBEDDING,
+}
+
+
+def _evaluation_parameters(args):
+    """Parametri dei metodi di valutazione senza giudice LLM."""
+    if args.method == "bm25":
+        return dict(BM25_DEFAULT_PARAMETERS, k1=args.k1, b=args.b, use_question_bank=not args.bm25_set_idf)
+    if args.method == "embedding":
+        return dict(EMBEDDING_DEFAULT_PARAMETERS, model=args.embedding_model)
+    return None
+
+
+def _sampling_parameters(args):
+    """Parametri dell'esecuzione a campione, o None se non richiesta (né ampiezza né budget)."""
+    if args.sample_ci_width is None and args.sample_max is None:
+        return None
+    return dict(
+        SAMPLING_DEFAULT_PARAMETERS,
+        ci_width=args.sample_ci_width if args.sample_ci_width is not None else SAMPLING_DEFAULT_PARAMETERS["ci_width"],
+        confidence=args.sample_confidence,
+        method=args.sample_method,
+        min_questions=args.sample_min,
+        max_questions=args.sample_max,
+        seed=args.sample_seed
+    )
+
+
+def command_run(args):
+    question_set = _find_question_set(args.set)
+    if not question_set:
+        print(f"Set di domande '{args.set}' non trovato.", file=sys.stderr)
+        return 2
+    use_bm25 = args.method == "bm25"
+    gen_presets = [load_preset_config(None, name) for name in args.gen_preset]
+    eval_preset = None if use_bm25 else load_preset_config(None, args.eval_preset or args.gen_preset[0])
+    if not all(gen_presets) or (not use_bm25 and not eval_preset):
+        print("Preset di generazione o di valutazione non trovato.", file=sys.stderr)
+        return 2
+
+    # Le domande vuote o non più presenti vengono escluse già dalla configurazione dell'esecuzione
+    question_ids = [q_id for q_id, _ in load_run_questions(question_set['questions'])]
+    if not question_ids:
+        print(f"Il set '{question_set['name']}' non contiene domande valide.", file=sys.stderr)
+        return 2
+
+    run_options = dict(
+        show_api_details=args.api_details,
+        eval_concurrency=args.eval_concurrency or args.concurrency,
+        eval_batch_size=args.eval_batch_size,
+        use_generation_cache=args.generation_cache,
+        use_evaluation_cache=args.evaluation_cache,
+        stream_generation=args.stream,
+        use_fast_path=not args.no_fast_path,
+        evaluation_method=EVALUATION_METHODS[args.method],
+        evaluation_parameters=_evaluation_parameters(args),
+        sampling=_sampling_parameters(args)
+    )
+    execution_mode = EXECUTION_MODE_BATCH if args.batch_api else EXECUTION_MODE_REALTIME
+
+    if len(gen_presets) > 1:
+        # Matrice: tutti i preset di generazione vengono eseguiti contemporaneamente
+        run_ids = create_matrix_runs(
+            question_set['id'], question_set['name'], gen_presets, eval_preset, question_ids,
+            execution_mode=execution_mode, status=RUN_STATUS_RUNNING,
+            gen_concurrency=args.gen_concurrency, **run_options
+        )
+        run_names = dict(zip(run_ids, args.gen_preset))
+        print(f"Matrice di {len(run_ids)} esecuzioni avviata sul set '{question_set['name']}' "
+              f"({len(question_ids)} domande)", file=sys.stderr)
+        records = process_matrix(run_ids, progress_callback=_print_matrix_progress(run_names))
+        print(file=sys.stderr)
+        exit_codes = [_report(run_id, records[run_id], newline=False) for run_id in run_ids]
+        return max(exit_codes)
+
+    run_config = build_run_config(
+        question_set['id'], question_set['name'], gen_presets[0], eval_preset, question_ids,
+        execution_mode=execution_mode, gen_concurrency=args.gen_concurrency or args.concurrency, **run_options
+    )
+    run_id = create_run(question_set['id'], run_config, len(question_ids), status=RUN_STATUS_RUNNING)
+    print(f"Esecuzione {run_id} avviata sul set '{question_set['name']}' ({len(question_ids)} domande)",
+          file=sys.stderr)
+    return _report(run_id, process_run(run_id, progress_callback=_print_progress))
+
+
+def command_resume(args):
+    run = load_run(args.run_id)
+    if not run:
+        print(f"Esecuzione {args.run_id} non trovata.", file=sys.stderr)
+        return 2
+    return _report(args.run_id, process_run(args.run_id, progress_callback=_print_progress))
+
+
+def command_list_sets(args):
+    for _, row in load_question_sets().iterrows():
+        print(f"{row['id']}\t{row['name']}\t{len(row['questions'])} domande")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m utils.cli", description="Esecuzione dei test LLM senza interfaccia.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Esegue un set di domande e ne salva il risultato.")
+    run_parser.add_argument("--set", required=True, help="ID o nome del set di domande.")
+    run_parser.add_argument("--gen-preset", required=True, nargs="+",
+                            help="Nome del preset API di generazione; con più nomi esegue una matrice.")
+    run_parser.add_argument("--eval-preset",
+                            help="Nome del preset API di valutazione (default: il primo di generazione).")
+    run_parser.add_argument("--method", choices=list(EVALUATION_METHODS), default="llm",
+                            help="Valutazione con il LLM giudice, con BM25 in locale (senza preset di valutazione) "
+                                 "o con la similarità degli embedding (il preset di valutazione fornisce l'endpoint).")
+    run_parser.add_argument("--k1", type=float, default=BM25_DEFAULT_PARAMETERS["k1"], help="Parametro k1 di BM25.")
+    run_parser.add_argument("--b", type=float, default=BM25_DEFAULT_PARAMETERS["b"], help="Parametro b di BM25.")
+    run_parser.add_argument("--bm25-set-idf", action="store_true",
+                            help="Calcola l'IDF di BM25 sulle sole risposte del set invece che sull'intera banca domande.")
+    run_parser.add_argument("--embedding-model", default=EMBEDDING_DEFAULT_PARAMETERS["model"],
+                            help="Modello di embedding per --method embedding.")
+    run_parser.add_argument("--concurrency", type=int, default=None,
+                            help="Worker di generazione e di valutazione (default: limite dei preset; "
+                                 "nella matrice vale solo per la valutazione).")
+    run_parser.add_argument("--gen-concurrency", type=int, default=None, help="Worker di generazione.")
+    run_parser.add_argument("--eval-concurrency", type=int, default=None, help="Worker di valutazione.")
+    run_parser.add_argument("--eval-batch-size", type=int, default=1,
+                            help="Risposte valutate con una singola chiamata al valutatore.")
+    run_parser.add_argument("--generation-cache", action="store_true", help="Usa la cache delle risposte generate.")
+    run_parser.add_argument("--evaluation-cache", action="store_true", help="Usa la cache delle valutazioni.")
+    run_parser.add_argument("--no-fast-path", action="store_true",
+                            help="Invia al giudice LLM anche le risposte uguali o numericamente equivalenti a quelle attese.")
+    run_parser.add_argument("--sample-ci-width", type=float, default=None,
+                            help="Esecuzione a campione (solo --method llm): domande in ordine casuale stratificato per "
+                                 "categoria, fino a un intervallo di confidenza del punteggio medio di questa ampiezza "
+                                 f"in punti percentuali (default con --sample-max: {SAMPLING_DEFAULT_PARAMETERS['ci_width']}).")
+    run_parser.add_argument("--sample-max", type=int, default=None,
+                            help="Budget di domande dell'esecuzione a campione.")
+    run_parser.add_argument("--sample-min", type=int, default=SAMPLING_DEFAULT_PARAMETERS["min_questions"],
+                            help="Domande eseguite prima di controllare l'intervallo di confidenza.")
+    run_parser.add_argument("--sample-confidence", type=float, default=SAMPLING_DEFAULT_PARAMETERS["confidence"],
+                            help="Livello di confidenza dell'intervallo (es. 0.95).")
+    run_parser.add_argument("--sample-method", choices=list(SAMPLING_METHODS),
+                            default=SAMPLING_DEFAULT_PARAMETERS["method"], help="Intervallo di Wilson o bootstrap.")
+    run_parser.add_argument("--sample-seed", type=int, default=None,
+                            help="Seme dell'ordine casuale, per ripetere lo stesso campione.")
+    run_parser.add_argument("--stream", action="store_true",
+                            help="Genera in streaming e misura tempo al primo token e token/s.")
+    run_parser.add_argument("--batch-api", action="store_true", help="Esegue le richieste tramite il Batch API.")
+    run_parser.add_argument("--api-details", action="store_true", help="Salva i dettagli delle chiamate API.")
+    run_parser.set_defaults(func=command_run)
+
+    resume_parser = subparsers.add_parser("resume", help="Riprende un'esecuzione interrotta.")
+    resume_parser.add_argument("--run-id", required=True, help="ID dell'esecuzione da riprendere.")
+    resume_parser.set_defaults(func=command_resume)
+
+    list_parser = subparsers.add_parser("list-sets", help="Elenca i set di domande disponibili.")
+    list_parser.set_defaults(func=command_list_sets)
+    return parser
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    args = build_parser().parse_args(argv)
+    try:
+        initialize_data()
+    except Exception as e:
+        print(f"Impossibile connettersi al database: {e}", file=sys.stderr)
+        return 1
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
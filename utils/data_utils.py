@@ -1,15 +1,155 @@
 import os
 import pandas as pd
-import streamlit as st
 import uuid
 import json
-from sqlalchemy import text
+import hashlib
+import time
+from sqlalchemy import bindparam, text
+
+try:
+    import ijson
+except ImportError:  # Senza ijson i file JSON vengono letti per intero
+    ijson = None
 
 from .db_utils import get_engine, init_db
+from .runtime_utils import logger, notify_error, session_state
+from .term_index_utils import ensure_term_index, index_questions, remove_questions
+
+# Righe per ogni executemany di INSERT ... ON DUPLICATE KEY UPDATE e valori per ogni clausola IN
+WRITE_CHUNK_SIZE = 1000
+
+def _chunks(values, size=WRITE_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def _delete_ids(conn, table, ids, column='id'):
+    """Elimina le righe con gli ID indicati con una DELETE ... IN per ogni blocco di WRITE_CHUNK_SIZE ID."""
+    ids = [str(i) for i in ids]
+    for chunk in _chunks(ids):
+        conn.execute(
+            text(f"DELETE FROM {table} WHERE {column} IN :ids").bindparams(bindparam('ids', expanding=True)),
+            {'ids': chunk}
+        )
+
+def _upsert_rows(conn, table, columns, rows, key_columns=('id',)):
+    """
+    Inserisce o aggiorna le righe con INSERT ... ON DUPLICATE KEY UPDATE, in blocchi di WRITE_CHUNK_SIZE.
+    Ogni blocco è un unico executemany, che il driver (PyMySQL) riscrive in un INSERT multi-riga.
+    Args:
+        conn: Connessione con la transazione in corso.
+        table: Tabella di destinazione.
+        columns: Colonne scritte, nell'ordine dell'INSERT.
+        rows: Lista di dizionari {colonna: valore}.
+        key_columns: Colonne della chiave primaria, non aggiornate.
+    """
+    if not rows:
+        return
+    updates = ", ".join(f"{col} = VALUES({col})" for col in columns if col not in key_columns)
+    statement = text(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(':' + col for col in columns)})"
+        f" ON DUPLICATE KEY UPDATE {updates}"
+    )
+    for chunk in _chunks(rows):
+        conn.execute(statement, chunk)
+
+# Chiave di session_state con le impronte delle righe come sono nel database ({tabella: {id: impronta}}),
+# aggiornate a ogni lettura e scrittura: i salvataggi scrivono solo le righe nuove, modificate o rimosse
+ROW_SNAPSHOTS_KEY = 'row_snapshots'
+# Chiave di session_state che indica che l'indice dei termini è già stato allineato in questa sessione
+TERM_INDEX_SYNCED_KEY = 'term_index_synced'
+# Chiave di session_state con la versione dei risultati modificati in questa sessione ({id: versione}):
+# i blob JSON dei risultati non vengono riserializzati per capire se sono cambiati (vedi mark_results_changed)
+RESULT_VERSIONS_KEY = 'result_versions'
+
+def _row_hash(*values):
+    """Impronta del contenuto di una riga."""
+    return hashlib.sha1(json.dumps(values, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+def _question_fingerprints(questions_df):
+    return {
+        str(q_id): _row_hash(str(domanda), str(risposta), str(categoria))
+        for q_id, domanda, risposta, categoria
+        in questions_df[['id', 'domanda', 'risposta_attesa', 'categoria']].itertuples(index=False)
+    }
+
+def _set_fingerprints(sets_df):
+    fingerprints = {}
+    for set_id, name, questions in sets_df[['id', 'name', 'questions']].itertuples(index=False):
+        members = sorted({str(q) for q in questions}) if isinstance(questions, list) else None
+        fingerprints[str(set_id)] = _row_hash(str(name), members)
+    return fingerprints
+
+def _result_fingerprints(results_df):
+    # Set, timestamp e versione del risultato: il costo non dipende dalla dimensione dei blob JSON
+    versions = session_state().get(RESULT_VERSIONS_KEY, {})
+    return {
+        str(r_id): (str(set_id), str(timestamp), versions.get(str(r_id), 0))
+        for r_id, set_id, timestamp in results_df[['id', 'set_id', 'timestamp']].itertuples(index=False)
+    }
+
+def mark_results_changed(result_ids):
+    """
+    Segnala che il dizionario dei risultati di queste righe è stato modificato o sostituito,
+    così il prossimo save_results le riscrive (le altre righe non vengono riserializzate).
+    """
+    state = session_state()
+    if RESULT_VERSIONS_KEY not in state:
+        state[RESULT_VERSIONS_KEY] = {}
+    versions = state[RESULT_VERSIONS_KEY]
+    for result_id in result_ids:
+        versions[str(result_id)] = versions.get(str(result_id), 0) + 1
+
+def _row_snapshot(table):
+    """Impronte note delle righe di una tabella, o None se la tabella non è ancora stata letta."""
+    return session_state().get(ROW_SNAPSHOTS_KEY, {}).get(table)
+
+def _remember_rows(table, fingerprints, replace=False):
+    """
+    Registra le impronte delle righe scritte o lette. Senza replace le righe vengono aggiunte
+    all'istantanea esistente, se la tabella è già stata letta.
+    """
+    state = session_state()
+    if ROW_SNAPSHOTS_KEY not in state:
+        state[ROW_SNAPSHOTS_KEY] = {}
+    snapshots = state[ROW_SNAPSHOTS_KEY]
+    if replace:
+        snapshots[table] = dict(fingerprints)
+    elif table in snapshots:
+        snapshots[table].update(fingerprints)
+
+def _forget_rows(table, ids):
+    snapshot = _row_snapshot(table)
+    if snapshot is not None:
+        for row_id in ids:
+            snapshot.pop(str(row_id), None)
+
+def _dirty_rows(table, fingerprints, load_fingerprints):
+    """
+    Confronta le righe da salvare con l'istantanea della tabella.
+    Args:
+        table: Nome della tabella.
+        fingerprints: Impronte delle righe da salvare ({id: impronta}).
+        load_fingerprints: Funzione che legge le impronte dal database, usata se la tabella
+            non è ancora stata letta in questa sessione.
+    Returns:
+        Una tupla (ID nuovi o modificati, ID rimossi).
+    """
+    snapshot = _row_snapshot(table)
+    if snapshot is None:
+        snapshot = load_fingerprints()
+    changed = [row_id for row_id, fingerprint in fingerprints.items() if snapshot.get(row_id) != fingerprint]
+    deleted = [row_id for row_id in snapshot if row_id not in fingerprints]
+    return changed, deleted
 
 def initialize_data():
-    """Inizializza il database creando le tabelle."""
+    """
+    Inizializza il database creando le tabelle e allinea l'indice dei termini una sola volta per
+    sessione (le pagine che chiamano questa funzione a ogni rerun non ripetono l'allineamento).
+    """
     init_db()
+    if not session_state().get(TERM_INDEX_SYNCED_KEY):
+        ensure_term_index()
+        session_state()[TERM_INDEX_SYNCED_KEY] = True
 
 
 def load_api_presets():
@@ -24,9 +164,16 @@ def load_api_presets():
         df['model'] = df['model'].astype(str).fillna("")
         df['temperature'] = pd.to_numeric(df['temperature'], errors='coerce').fillna(0.0)
         df['max_tokens'] = pd.to_numeric(df['max_tokens'], errors='coerce').fillna(1000).astype(int)
+        if 'max_concurrency' not in df.columns:
+            df['max_concurrency'] = 5
+        df['max_concurrency'] = pd.to_numeric(df['max_concurrency'], errors='coerce').fillna(5).astype(int)
+        for col in ['requests_per_minute', 'tokens_per_minute']:
+            if col not in df.columns:
+                df[col] = 0
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
         return df
     except Exception as e:
-        st.error(f"Errore durante la lettura della tabella api_presets: {e}")
+        notify_error(f"Errore durante la lettura della tabella api_presets: {e}")
 
     return pd.DataFrame({
         'id': pd.Series(dtype='str'),
@@ -36,12 +183,16 @@ def load_api_presets():
         'api_key': pd.Series(dtype='str'),
         'model': pd.Series(dtype='str'),
         'temperature': pd.Series(dtype='float'),
-        'max_tokens': pd.Series(dtype='int')
+        'max_tokens': pd.Series(dtype='int'),
+        'max_concurrency': pd.Series(dtype='int'),
+        'requests_per_minute': pd.Series(dtype='int'),
+        'tokens_per_minute': pd.Series(dtype='int')
     })
 
 def save_api_presets(presets_df):
     """Salva i preset API nel database."""
-    expected_columns = ['id', 'name', 'provider_name', 'endpoint', 'api_key', 'model', 'temperature', 'max_tokens']
+    expected_columns = ['id', 'name', 'provider_name', 'endpoint', 'api_key', 'model', 'temperature', 'max_tokens',
+                        'max_concurrency', 'requests_per_minute', 'tokens_per_minute']
     df_to_save = pd.DataFrame(columns=expected_columns)
 
     for col in expected_columns:
@@ -56,7 +207,7 @@ def save_api_presets(presets_df):
             # Assegna un tipo di default se la colonna manca (non dovrebbe accadere)
             if col in ['temperature']:
                 df_to_save[col] = pd.Series(dtype='float')
-            elif col in ['max_tokens']:
+            elif col in ['max_tokens', 'max_concurrency', 'requests_per_minute', 'tokens_per_minute']:
                 df_to_save[col] = pd.Series(dtype='int')
             else:
                 df_to_save[col] = pd.Series(dtype='str')
@@ -66,36 +217,19 @@ def save_api_presets(presets_df):
         incoming_ids = df_to_save['id'].astype(str).tolist()
 
         # Elimina i preset rimossi
-        ids_to_delete = set(existing_ids) - set(incoming_ids)
-        for del_id in ids_to_delete:
-            conn.execute(text('DELETE FROM api_presets WHERE id = :id'), {'id': del_id})
+        _delete_ids(conn, 'api_presets', set(existing_ids) - set(incoming_ids))
 
         # Inserisci o aggiorna i preset forniti
-        for _, row in df_to_save.iterrows():
-            params = row.to_dict()
-            if row['id'] in existing_ids:
-                conn.execute(
-                    text('''UPDATE api_presets SET name=:name, provider_name=:provider_name,
-                         endpoint=:endpoint, api_key=:api_key, model=:model,
-                         temperature=:temperature, max_tokens=:max_tokens WHERE id=:id'''),
-                    params
-                )
-            else:
-                conn.execute(
-                    text('''INSERT INTO api_presets
-                         (id, name, provider_name, endpoint, api_key, model, temperature, max_tokens)
-                         VALUES (:id, :name, :provider_name, :endpoint, :api_key, :model, :temperature, :max_tokens)'''),
-                    params
-                )
-    if 'api_presets' in st.session_state:
-        st.session_state.api_presets = df_to_save.copy()
+        _upsert_rows(conn, 'api_presets', expected_columns, df_to_save.to_dict('records'))
+    if 'api_presets' in session_state():
+        session_state().api_presets = df_to_save.copy()
 
 # --- Funzioni esistenti (accorciate per brevità, nessuna modifica qui) --- 
 
 def load_questions():
     """Carica le domande dal database."""
     try:
-        df = pd.read_sql("SELECT * FROM questions", get_engine())
+        df = pd.read_sql("SELECT * FROM questions", get_engine()).drop(columns=['updated_at'], errors='ignore')
         if 'question' in df.columns and 'domanda' not in df.columns:
             df.rename(columns={'question': 'domanda'}, inplace=True)
         if 'expected_answer' in df.columns and 'risposta_attesa' not in df.columns:
@@ -106,13 +240,17 @@ def load_questions():
         df['domanda'] = df['domanda'].astype(str).fillna("")
         df['risposta_attesa'] = df['risposta_attesa'].astype(str).fillna("")
         df['categoria'] = df['categoria'].astype(str).fillna("")
+        _remember_rows('questions', _question_fingerprints(df), replace=True)
         return df
     except Exception as e:
-        st.error(f"Errore durante la lettura della tabella questions: {e}")
+        notify_error(f"Errore durante la lettura della tabella questions: {e}")
     return pd.DataFrame({'id': pd.Series(dtype='str'), 'domanda': pd.Series(dtype='str'), 'risposta_attesa': pd.Series(dtype='str'), 'categoria': pd.Series(dtype='str')})
 
 def save_questions(questions_df):
-    """Sincronizza le domande con il database usando INSERT/UPDATE/DELETE."""
+    """
+    Sincronizza le domande con il database: scrive solo le domande nuove o modificate ed elimina
+    quelle rimosse rispetto all'ultima lettura o scrittura (vedi ROW_SNAPSHOTS_KEY).
+    """
     expected_columns = ['id', 'domanda', 'risposta_attesa', 'categoria']
     df_to_save = pd.DataFrame(columns=expected_columns)
     for col in expected_columns:
@@ -120,31 +258,35 @@ def save_questions(questions_df):
             df_to_save[col] = questions_df[col].astype(str)
         else:
             df_to_save[col] = pd.Series(dtype='str')
+    fingerprints = _question_fingerprints(df_to_save)
+    changed_ids, ids_to_delete = _dirty_rows('questions', fingerprints,
+                                             lambda: _question_fingerprints(load_questions()))
+    changed_rows = df_to_save[df_to_save['id'].isin(changed_ids)].to_dict('records')
     engine = get_engine()
     with engine.begin() as conn:
-        existing = pd.read_sql('SELECT id FROM questions', conn)
-        existing_ids = existing['id'].astype(str).tolist()
-        incoming_ids = df_to_save['id'].astype(str).tolist()
-
-        ids_to_delete = set(existing_ids) - set(incoming_ids)
-        for qid in ids_to_delete:
-            conn.execute(text('DELETE FROM questions WHERE id = :id'), {'id': qid})
-
-        for _, row in df_to_save.iterrows():
-            params = row.to_dict()
-            if row['id'] in existing_ids:
-                conn.execute(
-                    text('''UPDATE questions SET domanda=:domanda, risposta_attesa=:risposta_attesa,
-                         categoria=:categoria WHERE id=:id'''),
-                    params
-                )
-            else:
-                conn.execute(
-                    text('''INSERT INTO questions (id, domanda, risposta_attesa, categoria)
-                         VALUES (:id, :domanda, :risposta_attesa, :categoria)'''),
-                    params
-                )
-    st.session_state.questions = df_to_save.copy()
+        _delete_ids(conn, 'questions', ids_to_delete)
+        remove_questions(conn, ids_to_delete)
+
+        # Solo i testi effettivamente cambiati vengono reindicizzati
+        existing_texts = {}
+        for ids in _chunks(changed_ids):
+            rows = conn.execute(
+                text("SELECT id, domanda, risposta_attesa FROM questions WHERE id IN :ids")
+                .bindparams(bindparam('ids', expanding=True)),
+                {'ids': ids}
+            ).fetchall()
+            existing_texts.update({str(row[0]): {'domanda': row[1], 'risposta_attesa': row[2]} for row in rows})
+        to_index = []
+        for row in changed_rows:
+            old = existing_texts.get(row['id'], {})
+            changed = {field: row[field] for field in ('domanda', 'risposta_attesa') if old.get(field) != row[field]}
+            if changed:
+                to_index.append(dict(changed, id=row['id']))
+        index_questions(conn, to_index)
+
+        _upsert_rows(conn, 'questions', expected_columns, changed_rows)
+    _remember_rows('questions', fingerprints, replace=True)
+    session_state().questions = df_to_save.copy()
 def load_question_sets():
     """Carica i set di domande dal database insieme alle associazioni."""
     try:
@@ -161,45 +303,55 @@ def load_question_sets():
         rel_df['question_id'] = rel_df['question_id'].astype(str)
 
         sets_df['questions'] = sets_df['id'].apply(lambda sid: rel_df[rel_df['set_id'] == sid]['question_id'].tolist())
+        _remember_rows('question_sets', _set_fingerprints(sets_df), replace=True)
         return sets_df
     except Exception as e:
-        st.error(f"Errore durante la lettura della tabella question_sets: {e}")
+        notify_error(f"Errore durante la lettura della tabella question_sets: {e}")
     return pd.DataFrame({'id': pd.Series(dtype='str'), 'name': pd.Series(dtype='str'), 'questions': pd.Series(dtype='object')})
 
 def save_question_sets(sets_df):
-    """Sincronizza i set di domande con il database e le relative associazioni."""
+    """
+    Sincronizza i set di domande e le relative associazioni con il database, scrivendo solo i set
+    nuovi, modificati o rimossi rispetto all'ultima lettura o scrittura (vedi ROW_SNAPSHOTS_KEY).
+    """
     sets_df_to_save = sets_df.copy()
+    if 'questions' not in sets_df_to_save.columns:
+        sets_df_to_save['questions'] = None
+    sets_df_to_save['id'] = sets_df_to_save['id'].astype(str)
+    fingerprints = _set_fingerprints(sets_df_to_save)
+    changed_ids, ids_to_delete = _dirty_rows('question_sets', fingerprints,
+                                             lambda: _set_fingerprints(load_question_sets()))
+    changed_sets = sets_df_to_save[sets_df_to_save['id'].isin(changed_ids)]
     engine = get_engine()
     with engine.begin() as conn:
-        existing = pd.read_sql('SELECT id FROM question_sets', conn)
-        existing_ids = existing['id'].astype(str).tolist()
-        incoming_ids = sets_df_to_save['id'].astype(str).tolist()
-
-        ids_to_delete = set(existing_ids) - set(incoming_ids)
-        for sid in ids_to_delete:
-            conn.execute(text('DELETE FROM question_set_questions WHERE set_id = :id'), {'id': sid})
-            conn.execute(text('DELETE FROM question_sets WHERE id = :id'), {'id': sid})
-
-        for _, row in sets_df_to_save.iterrows():
-            set_id = str(row['id'])
-            name = str(row.get('name', ''))
-            questions = row.get('questions', [])
-            if set_id in existing_ids:
-                conn.execute(text('UPDATE question_sets SET name=:name WHERE id=:id'), {'id': set_id, 'name': name})
-            else:
-                conn.execute(text('INSERT INTO question_sets (id, name) VALUES (:id, :name)'), {'id': set_id, 'name': name})
-
-            if questions is not None:
-                existing_q = conn.execute(text('SELECT question_id FROM question_set_questions WHERE set_id=:sid'), {'sid': set_id}).fetchall()
-                existing_q_ids = [r[0] for r in existing_q]
-                new_q_ids = [str(q) for q in questions]
-
-                for qid in set(existing_q_ids) - set(new_q_ids):
-                    conn.execute(text('DELETE FROM question_set_questions WHERE set_id=:sid AND question_id=:qid'), {'sid': set_id, 'qid': qid})
-                for qid in set(new_q_ids) - set(existing_q_ids):
-                    conn.execute(text('INSERT INTO question_set_questions (set_id, question_id) VALUES (:sid, :qid)'), {'sid': set_id, 'qid': qid})
-
-    st.session_state.question_sets = sets_df.copy()
+        _delete_ids(conn, 'question_set_questions', ids_to_delete, column='set_id')
+        _delete_ids(conn, 'question_sets', ids_to_delete)
+
+        _upsert_rows(conn, 'question_sets', ['id', 'name'],
+                     [{'id': set_id, 'name': str(name)} for set_id, name in changed_sets[['id', 'name']].itertuples(index=False)])
+
+        # Associazioni dei soli set modificati, lette con una query per blocco di set
+        new_members = {set_id: {str(q) for q in questions}
+                       for set_id, questions in changed_sets[['id', 'questions']].itertuples(index=False)
+                       if isinstance(questions, list)}
+        old_members = {set_id: set() for set_id in new_members}
+        for ids in _chunks(list(new_members)):
+            rows = conn.execute(
+                text("SELECT set_id, question_id FROM question_set_questions WHERE set_id IN :ids")
+                .bindparams(bindparam('ids', expanding=True)),
+                {'ids': ids}
+            ).fetchall()
+            for set_id, question_id in rows:
+                old_members[str(set_id)].add(str(question_id))
+        removed = [{'sid': sid, 'qid': qid} for sid, members in new_members.items() for qid in old_members[sid] - members]
+        added = [{'sid': sid, 'qid': qid} for sid, members in new_members.items() for qid in members - old_members[sid]]
+        for chunk in _chunks(removed):
+            conn.execute(text('DELETE FROM question_set_questions WHERE set_id=:sid AND question_id=:qid'), chunk)
+        for chunk in _chunks(added):
+            conn.execute(text('INSERT INTO question_set_questions (set_id, question_id) VALUES (:sid, :qid)'), chunk)
+
+    _remember_rows('question_sets', fingerprints, replace=True)
+    session_state().question_sets = sets_df.copy()
 
 def load_results():
     """Carica i risultati dei test dal database."""
@@ -213,44 +365,99 @@ def load_results():
         results_df['set_id'] = results_df['set_id'].astype(str).fillna("")
         results_df['timestamp'] = results_df['timestamp'].astype(str).fillna("")
         results_df['results'] = results_df['results'].apply(lambda x: x if isinstance(x, dict) else {})
+        _remember_rows('test_results', _result_fingerprints(results_df), replace=True)
         return results_df
     except Exception as e:
-        st.error(f"Errore durante la lettura della tabella test_results: {e}")
+        notify_error(f"Errore durante la lettura della tabella test_results: {e}")
     return pd.DataFrame({'id': pd.Series(dtype='str'), 'set_id': pd.Series(dtype='str'), 'timestamp': pd.Series(dtype='str'), 'results': pd.Series(dtype='object')})
 
+# Campi di 'metrics' (vedi telemetry_utils.aggregate_run_metrics) estratti per la dashboard delle prestazioni
+RUN_TELEMETRY_FIELDS = {
+    'questions': '$.metrics.questions',
+    'total_tokens': '$.metrics.total_tokens',
+    'cached_tokens': '$.metrics.cached_tokens',
+    'cost': '$.metrics.cost',
+    'calls': '$.metrics.calls',
+    'retries': '$.metrics.retries',
+    'generation_errors': '$.metrics.generation_errors',
+    'evaluation_errors': '$.metrics.evaluation_errors',
+    'latency_p50': '$.metrics.latency.generation.p50',
+    'latency_p95': '$.metrics.latency.generation.p95',
+    'latency_p99': '$.metrics.latency.generation.p99',
+    'evaluation_latency_p95': '$.metrics.latency.evaluation.p95',
+    'elapsed_seconds': '$.metrics.elapsed_seconds',
+    'questions_per_minute': '$.metrics.questions_per_minute',
+}
+
+def load_run_telemetry():
+    """
+    Carica la telemetria aggregata di tutti i test che la riportano, una riga per test.
+    I campi vengono estratti dal JSON direttamente in SQL, senza caricare le risposte delle domande.
+    """
+    numeric_columns = ", ".join(f"results->>'{path}' AS {name}" for name, path in RUN_TELEMETRY_FIELDS.items())
+    query = f"""
+        SELECT id, set_id, timestamp,
+               results->>'$.set_name' AS set_name,
+               results->>'$.generation_preset' AS generation_preset,
+               results->>'$.evaluation_preset' AS evaluation_preset,
+               results->>'$.metrics.generation_model' AS generation_model,
+               results->>'$.metrics.evaluation_model' AS evaluation_model,
+               {numeric_columns}
+        FROM test_results
+        WHERE JSON_CONTAINS_PATH(results, 'one', '$.metrics')
+    """
+    try:
+        df = pd.read_sql(text(query), get_engine())
+    except Exception as e:
+        notify_error(f"Errore durante la lettura della telemetria dei test: {e}")
+        df = pd.DataFrame(columns=['id', 'set_id', 'timestamp', 'set_name', 'generation_preset', 'evaluation_preset',
+                                   'generation_model', 'evaluation_model', *RUN_TELEMETRY_FIELDS])
+    df['id'] = df['id'].astype(str)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+    # I valori JSON null arrivano come stringa 'null' e diventano NaN
+    for col in RUN_TELEMETRY_FIELDS:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    for col in ['generation_model', 'evaluation_model']:
+        df[col] = df[col].where(df[col] != 'null')
+    return df.dropna(subset=['timestamp']).sort_values('timestamp')
+
+def _stored_result_fingerprints():
+    """Impronte dei risultati nel database, senza leggerne il JSON (versione 0: contenuto salvato)."""
+    with get_engine().begin() as conn:
+        rows = conn.execute(text("SELECT id, set_id, timestamp FROM test_results")).fetchall()
+    return {str(row[0]): (str(row[1]), str(row[2]), 0) for row in rows}
+
 def save_results(results_df):
-    """Sincronizza i risultati dei test con il database."""
+    """
+    Sincronizza i risultati dei test con il database: serializza e scrive solo i risultati nuovi,
+    con set o timestamp diversi o segnalati con mark_results_changed, ed elimina quelli rimossi
+    rispetto all'ultima lettura o scrittura (vedi ROW_SNAPSHOTS_KEY).
+    """
     results_df_to_save = results_df.copy()
-    if not results_df_to_save.empty and 'results' in results_df_to_save.columns:
-        results_df_to_save['results'] = results_df_to_save['results'].apply(lambda x: json.dumps(x) if isinstance(x, dict) else "{}")
+    results_df_to_save['id'] = results_df_to_save['id'].astype(str)
+    fingerprints = _result_fingerprints(results_df_to_save)
+    changed_ids, ids_to_delete = _dirty_rows('test_results', fingerprints, _stored_result_fingerprints)
+    changed_rows = [
+        {'id': r_id, 'set_id': set_id, 'timestamp': timestamp,
+         'results': json.dumps(results) if isinstance(results, dict) else "{}"}
+        for r_id, set_id, timestamp, results
+        in results_df_to_save[results_df_to_save['id'].isin(changed_ids)][['id', 'set_id', 'timestamp', 'results']].itertuples(index=False)
+    ]
     engine = get_engine()
     with engine.begin() as conn:
-        existing = pd.read_sql('SELECT id FROM test_results', conn)
-        existing_ids = existing['id'].astype(str).tolist()
-        incoming_ids = results_df_to_save['id'].astype(str).tolist()
-
-        ids_to_delete = set(existing_ids) - set(incoming_ids)
-        for rid in ids_to_delete:
-            conn.execute(text('DELETE FROM test_results WHERE id = :id'), {'id': rid})
-
-        for _, row in results_df_to_save.iterrows():
-            params = row.to_dict()
-            if row['id'] in existing_ids:
-                conn.execute(
-                    text('''UPDATE test_results SET set_id=:set_id, timestamp=:timestamp, results=:results WHERE id=:id'''),
-                    params
-                )
-            else:
-                conn.execute(
-                    text('''INSERT INTO test_results (id, set_id, timestamp, results) VALUES (:id, :set_id, :timestamp, :results)'''),
-                    params
-                )
-    st.session_state.results = results_df.copy()
+        _delete_ids(conn, 'test_results', ids_to_delete)
+        _upsert_rows(conn, 'test_results', ['id', 'set_id', 'timestamp', 'results'], changed_rows)
+    # Il contenuto salvato torna alla versione 0, come quello letto dal database
+    versions = session_state().get(RESULT_VERSIONS_KEY, {})
+    for r_id in set(changed_ids) | set(ids_to_delete):
+        versions.pop(r_id, None)
+    _remember_rows('test_results', _result_fingerprints(results_df_to_save), replace=True)
+    session_state().results = results_df.copy()
 
 def add_question(testo_domanda, risposta_prevista, categoria="", question_id=None):
     """Inserisce una nuova domanda nel database."""
-    if 'questions' not in st.session_state:
-        st.session_state.questions = load_questions()
+    if 'questions' not in session_state():
+        session_state().questions = load_questions()
 
     new_id = question_id or str(uuid.uuid4())
     new_question_data = {
@@ -267,17 +474,19 @@ def add_question(testo_domanda, risposta_prevista, categoria="", question_id=Non
                  VALUES (:id, :domanda, :risposta_attesa, :categoria)'''),
             new_question_data
         )
+        index_questions(conn, [new_question_data])
 
     new_df = pd.DataFrame([new_question_data])
-    st.session_state.questions = pd.concat([st.session_state.questions, new_df], ignore_index=True)
+    _remember_rows('questions', _question_fingerprints(new_df))
+    session_state().questions = pd.concat([session_state().questions, new_df], ignore_index=True)
     return new_id
 
 def update_question(question_id, testo_domanda=None, risposta_prevista=None, categoria=None):
     """Aggiorna i campi di una domanda nel database."""
-    if 'questions' not in st.session_state:
-        st.session_state.questions = load_questions()
+    if 'questions' not in session_state():
+        session_state().questions = load_questions()
 
-    questions_df = st.session_state.questions.copy()
+    questions_df = session_state().questions.copy()
     idx = questions_df.index[questions_df['id'] == str(question_id)].tolist()
     if not idx:
         return False
@@ -304,34 +513,38 @@ def update_question(question_id, testo_domanda=None, risposta_prevista=None, cat
                 text(f"UPDATE questions SET {', '.join(updates)} WHERE id = :id"),
                 params
             )
-        st.session_state.questions = questions_df
+            index_questions(conn, [params])
+        _remember_rows('questions', _question_fingerprints(questions_df.loc[idx]))
+        session_state().questions = questions_df
     return True
 
 def delete_question(question_id):
     """Elimina una domanda dal database usando il suo ID."""
-    if 'questions' not in st.session_state:
-        st.session_state.questions = load_questions()
+    if 'questions' not in session_state():
+        session_state().questions = load_questions()
 
-    questions_df = st.session_state.questions.copy()
+    questions_df = session_state().questions.copy()
     questions_df = questions_df[questions_df['id'] != str(question_id)]
 
     engine = get_engine()
     with engine.begin() as conn:
         conn.execute(text('DELETE FROM questions WHERE id = :id'), {'id': str(question_id)})
+        remove_questions(conn, [str(question_id)])
 
-    st.session_state.questions = questions_df
+    _forget_rows('questions', [question_id])
+    session_state().questions = questions_df
     update_sets_after_question_deletion(str(question_id))
 
 def update_sets_after_question_deletion(question_id):
     engine = get_engine()
     with engine.begin() as conn:
         conn.execute(text('DELETE FROM question_set_questions WHERE question_id = :qid'), {'qid': str(question_id)})
-    st.session_state.question_sets = load_question_sets()
+    session_state().question_sets = load_question_sets()
 
 def create_question_set(name, question_ids=None):
     """Crea un nuovo set di domande inserendolo nel database."""
-    if 'question_sets' not in st.session_state:
-        st.session_state.question_sets = load_question_sets()
+    if 'question_sets' not in session_state():
+        session_state().question_sets = load_question_sets()
 
     new_set_id = str(uuid.uuid4())
     new_set_data = {
@@ -353,15 +566,16 @@ def create_question_set(name, question_ids=None):
             )
 
     new_df = pd.DataFrame([new_set_data])
-    st.session_state.question_sets = pd.concat([st.session_state.question_sets, new_df], ignore_index=True)
+    _remember_rows('question_sets', _set_fingerprints(new_df))
+    session_state().question_sets = pd.concat([session_state().question_sets, new_df], ignore_index=True)
     return new_set_id
 
 def update_question_set(set_id, name=None, question_ids=None):
     """Aggiorna un set di domande nel database."""
-    if 'question_sets' not in st.session_state:
-        st.session_state.question_sets = load_question_sets()
+    if 'question_sets' not in session_state():
+        session_state().question_sets = load_question_sets()
 
-    sets_df = st.session_state.question_sets.copy()
+    sets_df = session_state().question_sets.copy()
     idx = sets_df.index[sets_df['id'] == str(set_id)].tolist()
     if not idx:
         return False
@@ -382,7 +596,12 @@ def update_question_set(set_id, name=None, question_ids=None):
             for qid in set(new_ids) - set(existing_q_ids):
                 conn.execute(text('INSERT INTO question_set_questions (set_id, question_id) VALUES (:sid, :qid)'), {'sid': str(set_id), 'qid': qid})
 
-    st.session_state.question_sets = sets_df
+    if question_ids is not None:
+        _remember_rows('question_sets', _set_fingerprints(sets_df.loc[idx]))
+    else:
+        # Associazioni non rilette: impronta sconosciuta, il set verrà riscritto al prossimo salvataggio
+        _remember_rows('question_sets', {str(set_id): None})
+    session_state().question_sets = sets_df
     return True
 
 
@@ -403,10 +622,10 @@ def add_question_set(name, question_ids=None):
 
 def delete_question_set(set_id):
     """Elimina un set di domande dal database."""
-    if 'question_sets' not in st.session_state:
-        st.session_state.question_sets = load_question_sets()
+    if 'question_sets' not in session_state():
+        session_state().question_sets = load_question_sets()
 
-    sets_df = st.session_state.question_sets.copy()
+    sets_df = session_state().question_sets.copy()
     sets_df = sets_df[sets_df['id'] != str(set_id)]
 
     engine = get_engine()
@@ -414,16 +633,18 @@ def delete_question_set(set_id):
         conn.execute(text('DELETE FROM question_set_questions WHERE set_id = :id'), {'id': str(set_id)})
         conn.execute(text('DELETE FROM question_sets WHERE id = :id'), {'id': str(set_id)})
 
-    st.session_state.question_sets = sets_df
-
-def add_test_result(set_id, results_data):
-    """Aggiunge un risultato di test nel database."""
-    if 'results' not in st.session_state:
-        st.session_state.results = load_results()
+    _forget_rows('question_sets', [set_id])
+    session_state().question_sets = sets_df
 
-    new_id = str(uuid.uuid4())
+def insert_test_result(set_id, results_data):
+    """
+    Scrive un risultato di test nel database senza toccare lo stato della sessione Streamlit
+    (usato anche dai processi di esecuzione in background).
+    Returns:
+        Il record inserito come dizionario {id, set_id, timestamp, results}.
+    """
     new_result_data = {
-        'id': new_id,
+        'id': str(uuid.uuid4()),
         'set_id': str(set_id),
         'timestamp': pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S'),
         'results': results_data if isinstance(results_data, dict) else {}
@@ -433,54 +654,328 @@ def add_test_result(set_id, results_data):
     with engine.begin() as conn:
         conn.execute(
             text('''INSERT INTO test_results (id, set_id, timestamp, results) VALUES (:id, :set_id, :timestamp, :results)'''),
-            {'id': new_id, 'set_id': new_result_data['set_id'], 'timestamp': new_result_data['timestamp'], 'results': json.dumps(new_result_data['results'])}
+            {'id': new_result_data['id'], 'set_id': new_result_data['set_id'], 'timestamp': new_result_data['timestamp'], 'results': json.dumps(new_result_data['results'])}
         )
+    return new_result_data
+
+def add_test_result(set_id, results_data):
+    """Aggiunge un risultato di test nel database."""
+    if 'results' not in session_state():
+        session_state().results = load_results()
+
+    new_result_data = insert_test_result(set_id, results_data)
 
     new_df = pd.DataFrame([new_result_data])
-    st.session_state.results = pd.concat([st.session_state.results, new_df], ignore_index=True)
-    return new_id
+    _remember_rows('test_results', _result_fingerprints(new_df))
+    session_state().results = pd.concat([session_state().results, new_df], ignore_index=True)
+    return new_result_data['id']
+
+# Righe lette, validate e inserite per volta durante l'importazione di un file di domande
+IMPORT_CHUNK_ROWS = 5000
+# Colonne accettate come alias nei file importati
+IMPORT_COLUMN_ALIASES = {'question': 'domanda', 'expected_answer': 'risposta_attesa', 'category': 'categoria'}
+
+def prepare_imported_questions(imported_df):
+    """
+    Normalizza e valida in modo vettoriale le domande di un file importato: rinomina le colonne
+    alternative, assegna un ID alle righe che non lo hanno e scarta le righe con domanda o risposta
+    vuota e gli ID ripetuti nel file.
+    Args:
+        imported_df: DataFrame letto dal file, con almeno le colonne domanda e risposta_attesa (o gli alias).
+    Returns:
+        Una tupla (DataFrame con id, domanda, risposta_attesa e categoria, numero di righe scartate).
+    Raises:
+        ValueError se mancano le colonne obbligatorie.
+    """
+    imported_df = imported_df.rename(columns={alias: name for alias, name in IMPORT_COLUMN_ALIASES.items()
+                                              if alias in imported_df.columns and name not in imported_df.columns})
+    required_columns = ['domanda', 'risposta_attesa']
+    if not all(col in imported_df.columns for col in required_columns):
+        raise ValueError(f"Il file importato deve contenere le colonne '{required_columns[0]}' e '{required_columns[1]}'.")
+    df = pd.DataFrame({
+        col: imported_df[col].fillna("").astype(str).str.strip() if col in imported_df.columns
+        else pd.Series("", index=imported_df.index, dtype='str')
+        for col in ['id', 'domanda', 'risposta_attesa', 'categoria']
+    })
+    missing_ids = df['id'] == ""
+    if missing_ids.any():
+        df.loc[missing_ids, 'id'] = [str(uuid.uuid4()) for _ in range(int(missing_ids.sum()))]
+    valid = (df['domanda'] != "") & (df['risposta_attesa'] != "") & ~df['id'].duplicated()
+    return df[valid].reset_index(drop=True), int((~valid).sum())
 
-def import_questions_from_file(file):
+def insert_new_questions(conn, questions_df):
+    """
+    Inserisce nella transazione di conn le domande il cui ID non è ancora presente nel database,
+    con INSERT multi-riga a blocchi, e le aggiunge all'indice dei termini.
+    Non aggiorna lo stato della sessione (vedi register_imported_questions).
+    Args:
+        conn: Connessione con la transazione in corso.
+        questions_df: DataFrame preparato con prepare_imported_questions.
+    Returns:
+        Il DataFrame delle domande effettivamente inserite.
+    """
+    existing_ids = set()
+    for ids in _chunks(questions_df['id'].tolist()):
+        rows = conn.execute(
+            text("SELECT id FROM questions WHERE id IN :ids").bindparams(bindparam('ids', expanding=True)),
+            {'ids': ids}
+        ).fetchall()
+        existing_ids.update(str(row[0]) for row in rows)
+    new_df = questions_df[~questions_df['id'].isin(existing_ids)].reset_index(drop=True)
+    rows = new_df.to_dict('records')
+    for chunk in _chunks(rows):
+        conn.execute(
+            text('''INSERT INTO questions (id, domanda, risposta_attesa, categoria)
+                 VALUES (:id, :domanda, :risposta_attesa, :categoria)'''),
+            chunk
+        )
+    index_questions(conn, rows)
+    return new_df
+
+def register_imported_questions(new_questions_df):
+    """Aggiunge allo stato della sessione, in un'unica operazione, le domande inserite da un'importazione."""
+    if new_questions_df.empty:
+        return
+    if 'questions' in session_state() and isinstance(session_state().questions, pd.DataFrame):
+        _remember_rows('questions', _question_fingerprints(new_questions_df))
+        session_state().questions = pd.concat([session_state().questions, new_questions_df], ignore_index=True)
+    else:
+        session_state().questions = load_questions()
+
+JSON_FORMAT_ERROR = ("Il file JSON deve essere una lista di domande o un oggetto con una chiave 'questions' "
+                     "contenente una lista.")
+
+def _json_items_prefix(file):
+    """
+    Prefisso ijson degli elementi: 'item' per una lista, 'questions.item' per un oggetto con chiave 'questions'.
+    Raises:
+        ValueError se il file non inizia con una lista o un oggetto.
+    """
+    head = file.read(64)
+    file.seek(0)
+    head = head.decode('utf-8', errors='ignore') if isinstance(head, bytes) else head
+    head = head.lstrip('\ufeff \t\r\n')
+    if head.startswith('['):
+        return 'item'
+    if head.startswith('{'):
+        return 'questions.item'
+    raise ValueError(JSON_FORMAT_ERROR)
+
+def _json_records(file):
+    """
+    Domande di un file JSON lette con ijson. Se un oggetto non produce domande, il file viene
+    riletto per distinguere una lista 'questions' vuota da una chiave mancante o non di tipo lista.
+    """
+    prefix = _json_items_prefix(file)
+    found = False
+    for record in ijson.items(file, prefix):
+        found = True
+        yield record
+    if found or prefix == 'item':
+        return
+    file.seek(0)
+    if not any(path == 'questions' and event == 'start_array' for path, event, _ in ijson.parse(file)):
+        raise ValueError(JSON_FORMAT_ERROR)
+
+def _loaded_json_records(file):
+    """Domande di un file JSON letto per intero (senza ijson)."""
+    data = json.load(file)
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict) and isinstance(data.get('questions'), list):
+        return data['questions']
+    raise ValueError(JSON_FORMAT_ERROR)
+
+def _record_chunks(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield pd.DataFrame(chunk)
+            chunk = []
+    if chunk:
+        yield pd.DataFrame(chunk)
+
+def _jsonl_records(file):
+    for line in file:
+        line = line.decode('utf-8-sig') if isinstance(line, bytes) else line
+        if line.strip():
+            yield json.loads(line)
+
+def iter_import_chunks(file, file_extension, chunk_rows=IMPORT_CHUNK_ROWS):
+    """
+    Legge un file di domande a blocchi di al più chunk_rows righe, senza caricarlo per intero:
+    CSV con pandas a blocchi, JSON con il parser a eventi ijson, JSON Lines una riga alla volta.
+    Args:
+        file: File aperto (es. UploadedFile di Streamlit).
+        file_extension: '.csv', '.json' o '.jsonl'.
+        chunk_rows: Righe per blocco.
+    Returns:
+        Un generatore di DataFrame.
+    Raises:
+        ValueError per un formato non supportato o un file JSON che non contiene una lista di domande
+        (per i file JSON letti con ijson, durante l'iterazione).
+    """
+    if file_extension == '.csv':
+        # Tutto come testo: gli ID numerici non diventano float e le celle vuote restano stringhe vuote
+        return pd.read_csv(file, chunksize=chunk_rows, dtype=str, keep_default_na=False)
+    if file_extension == '.jsonl':
+        return _record_chunks(_jsonl_records(file), chunk_rows)
+    if file_extension == '.json':
+        if ijson is None:
+            logger.warning("ijson non installato: il file JSON viene letto per intero in memoria "
+                           "(installa le dipendenze di requirements.txt per l'importazione a blocchi).")
+            return _record_chunks(iter(_loaded_json_records(file)), chunk_rows)
+        return _record_chunks(_json_records(file), chunk_rows)
+    raise ValueError("Formato file non supportato. Caricare un file CSV, JSON o JSON Lines.")
+
+def import_questions_from_file(file, progress_callback=None):
+    """
+    Importa le domande di un file CSV, JSON o JSON Lines in un'unica transazione, leggendolo a blocchi
+    (vedi iter_import_chunks): in memoria resta un blocco alla volta, le domande inserite vengono solo
+    contate. Ogni blocco viene validato in modo vettoriale e inserito con INSERT multi-riga appena letto;
+    gli ID già presenti, compresi quelli dei blocchi precedenti, vengono saltati. Se l'inserimento
+    fallisce non viene importata nessuna domanda. Al termine le domande della sessione, se caricate,
+    vengono rilette una sola volta dal database.
+    Args:
+        file: File caricato, con l'attributo name.
+        progress_callback: Funzione opzionale chiamata dopo ogni blocco come
+            progress_callback(righe lette, righe al secondo, frazione del file letta o None).
+    Returns:
+        Una tupla (successo, messaggio).
+    """
     try:
         file_extension = os.path.splitext(file.name)[1].lower()
-        imported_df = None
-        if file_extension == '.csv': imported_df = pd.read_csv(file)
-        elif file_extension == '.json':
-            data = json.load(file)
-            if isinstance(data, list): imported_df = pd.DataFrame(data)
-            elif isinstance(data, dict) and 'questions' in data and isinstance(data['questions'], list): imported_df = pd.DataFrame(data['questions'])
-            else: return False, "Il file JSON deve essere una lista di domande o un oggetto con una chiave 'questions' contenente una lista."
-        else: return False, "Formato file non supportato. Caricare un file CSV o JSON."
-        if imported_df is None or imported_df.empty: return False, "Il file importato è vuoto o non contiene dati validi."
-        if 'question' in imported_df.columns and 'domanda' not in imported_df.columns: imported_df.rename(columns={'question': 'domanda'}, inplace=True)
-        if 'expected_answer' in imported_df.columns and 'risposta_attesa' not in imported_df.columns: imported_df.rename(columns={'expected_answer': 'risposta_attesa'}, inplace=True)
-        required_columns = ['domanda', 'risposta_attesa']
-        if not all(col in imported_df.columns for col in required_columns): return False, f"Il file importato deve contenere le colonne '{required_columns[0]}' e '{required_columns[1]}'."
-        if 'id' not in imported_df.columns: imported_df['id'] = [str(uuid.uuid4()) for _ in range(len(imported_df))]
-        else: imported_df['id'] = imported_df['id'].astype(str)
-        if 'categoria' not in imported_df.columns: imported_df['categoria'] = ""
-        else: imported_df['categoria'] = imported_df['categoria'].astype(str).fillna("")
-        imported_df['domanda'] = imported_df['domanda'].astype(str).fillna("")
-        imported_df['risposta_attesa'] = imported_df['risposta_attesa'].astype(str).fillna("")
-        final_imported_df = imported_df[['id', 'domanda', 'risposta_attesa', 'categoria']]
-        added_count = 0
-        for _, row in final_imported_df.iterrows():
-            add_question(row['domanda'], row['risposta_attesa'], row['categoria'], question_id=row['id'])
-            added_count += 1
-        return True, f"Importate con successo {added_count} domande."
+        size = getattr(file, 'size', None)
+        started = time.perf_counter()
+        rows_read = invalid_count = existing_count = added_count = 0
+        with get_engine().begin() as conn:
+            for chunk in iter_import_chunks(file, file_extension):
+                rows_read += len(chunk)
+                questions_df, invalid = prepare_imported_questions(chunk)
+                new_df = insert_new_questions(conn, questions_df)
+                invalid_count += invalid
+                existing_count += len(questions_df) - len(new_df)
+                added_count += len(new_df)
+                if progress_callback:
+                    elapsed = time.perf_counter() - started
+                    progress_callback(rows_read, rows_read / elapsed if elapsed > 0 else None,
+                                      min(1.0, file.tell() / size) if size else None)
+        if not rows_read:
+            return False, "Il file importato è vuoto o non contiene dati validi."
+        if added_count and 'questions' in session_state():
+            session_state().questions = load_questions()
+        return True, import_summary(added_count, existing_count, invalid_count)
+    except ValueError as e:
+        return False, str(e)
     except Exception as e:
         return False, f"Errore durante l'importazione delle domande: {str(e)}"
 
+def import_summary(added_count, existing_count, invalid_count):
+    """Messaggio di esito di un'importazione di domande."""
+    details = [f"{existing_count} già presenti"] if existing_count else []
+    if invalid_count:
+        details.append(f"{invalid_count} scartate perché vuote o con ID ripetuto")
+    return f"Importate con successo {added_count} domande" + (f" ({', '.join(details)})." if details else ".")
+
+def import_question_sets(sets_data):
+    """
+    Importa una lista di set di domande (formato di esportazione della pagina dei set) in un'unica
+    transazione: i nomi dei set e gli ID delle domande referenziate vengono risolti con una query
+    per blocco, le domande nuove, i set e le associazioni inseriti con INSERT multi-riga a blocchi.
+    I set con nome vuoto, già presente o ripetuto nel file e le domande con campi mancanti vengono saltati.
+    Se l'inserimento fallisce non viene importato nulla.
+    Args:
+        sets_data: Lista di dizionari {'name': ..., 'questions': [{'id', 'domanda', 'risposta_attesa', 'categoria'}, ...]}.
+    Returns:
+        Una tupla (set importati, domande aggiunte, domande già presenti referenziate, lista di avvisi).
+    """
+    warnings = []
+    sets_to_create = []
+    questions = {}
+    for set_idx, set_data in enumerate(sets_data):
+        if not isinstance(set_data, dict):
+            warnings.append(f"Elemento #{set_idx+1} nella lista non è un set valido (saltato).")
+            continue
+        set_name = set_data.get("name")
+        questions_in_set_data = set_data.get("questions", [])
+        if not set_name or not isinstance(set_name, str) or not set_name.strip():
+            warnings.append(f"Set #{set_idx+1} con nome mancante o non valido (saltato).")
+            continue
+        if not isinstance(questions_in_set_data, list):
+            warnings.append(f"Dati delle domande mancanti o non validi per il set '{set_name}' (saltato).")
+            continue
+
+        question_ids = []
+        for q_idx, q_data in enumerate(questions_in_set_data):
+            if not isinstance(q_data, dict):
+                warnings.append(f"Dati domanda #{q_idx+1} nel set '{set_name}' non validi (saltati).")
+                continue
+            q_id = str(q_data.get("id", "")).strip()
+            q_text = str(q_data.get("domanda") or "").strip()
+            q_answer = str(q_data.get("risposta_attesa") or "").strip()
+            if not q_id or not q_text or not q_answer:
+                warnings.append(f"Domanda #{q_idx+1} nel set '{set_name}' ha campi mancanti (saltata). ID: {q_id}")
+                continue
+            # La prima occorrenza di un ID nel file ne definisce il contenuto
+            questions.setdefault(q_id, {'id': q_id, 'domanda': q_text, 'risposta_attesa': q_answer,
+                                        'categoria': str(q_data.get("categoria") or "").strip()})
+            question_ids.append(q_id)
+
+        if question_ids or len(questions_in_set_data) == 0:
+            sets_to_create.append({'id': str(uuid.uuid4()), 'name': set_name,
+                                   'questions': list(dict.fromkeys(question_ids))})
+        else:
+            warnings.append(f"Il set '{set_name}' non è stato creato perché non conteneva domande valide.")
+
+    engine = get_engine()
+    with engine.begin() as conn:
+        existing_names = set()
+        for names in _chunks(list({s['name'] for s in sets_to_create})):
+            rows = conn.execute(
+                text("SELECT name FROM question_sets WHERE name IN :names").bindparams(bindparam('names', expanding=True)),
+                {'names': names}
+            ).fetchall()
+            existing_names.update(str(row[0]) for row in rows)
+        new_sets = []
+        for set_data in sets_to_create:
+            if set_data['name'] in existing_names:
+                warnings.append(f"Un set con nome '{set_data['name']}' esiste già. Saltato per evitare duplicati.")
+                continue
+            existing_names.add(set_data['name'])
+            new_sets.append(set_data)
+
+        # Solo le domande referenziate dai set effettivamente importati
+        referenced_ids = list(dict.fromkeys(q_id for s in new_sets for q_id in s['questions']))
+        questions_df = pd.DataFrame([questions[q_id] for q_id in referenced_ids],
+                                    columns=['id', 'domanda', 'risposta_attesa', 'categoria'])
+        new_questions_df = insert_new_questions(conn, questions_df)
+
+        for chunk in _chunks([{'id': s['id'], 'name': s['name']} for s in new_sets]):
+            conn.execute(text('INSERT INTO question_sets (id, name) VALUES (:id, :name)'), chunk)
+        for chunk in _chunks([{'sid': s['id'], 'qid': q_id} for s in new_sets for q_id in s['questions']]):
+            conn.execute(text('INSERT INTO question_set_questions (set_id, question_id) VALUES (:sid, :qid)'), chunk)
+
+    register_imported_questions(new_questions_df)
+    if new_sets:
+        new_sets_df = pd.DataFrame(new_sets, columns=['id', 'name', 'questions'])
+        if 'question_sets' in session_state() and isinstance(session_state().question_sets, pd.DataFrame):
+            _remember_rows('question_sets', _set_fingerprints(new_sets_df))
+            session_state().question_sets = pd.concat([session_state().question_sets, new_sets_df], ignore_index=True)
+        else:
+            session_state().question_sets = load_question_sets()
+    return len(new_sets), len(new_questions_df), len(referenced_ids) - len(new_questions_df), warnings
+
 def add_question_if_not_exists(question_id: str, testo_domanda: str, risposta_prevista: str, categoria: str = ""):
     """
     Aggiunge una domanda al DataFrame delle domande se un ID specificato non esiste già.
     Restituisce True se la domanda è stata aggiunta, False se esisteva già.
     """
     # Assicurati che 'questions' sia in session_state e sia un DataFrame
-    if 'questions' not in st.session_state or not isinstance(st.session_state.questions, pd.DataFrame):
-        st.session_state.questions = load_questions() # Carica se non presente
+    if 'questions' not in session_state() or not isinstance(session_state().questions, pd.DataFrame):
+        session_state().questions = load_questions() # Carica se non presente
 
-    questions_df = st.session_state.questions.copy()
+    questions_df = session_state().questions.copy()
 
     if str(question_id) in questions_df['id'].astype(str).values:
         return False
@@ -19,6 +19,32 @@ def get_engine():
     return _engine
 
 
+def _ensure_column(conn, table, column, definition):
+    """Aggiunge una colonna a una tabella esistente se non è già presente."""
+    exists = conn.execute(
+        text(
+            """SELECT COUNT(*) FROM information_schema.columns
+               WHERE table_schema = DATABASE() AND table_name = :table AND column_name = :column"""
+        ),
+        {'table': table, 'column': column}
+    ).scalar()
+    if not exists:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+
+
+def _ensure_index(conn, table, index, columns):
+    """Aggiunge un indice a una tabella esistente se non è già presente."""
+    exists = conn.execute(
+        text(
+            """SELECT COUNT(*) FROM information_schema.statistics
+               WHERE table_schema = DATABASE() AND table_name = :table AND index_name = :index"""
+        ),
+        {'table': table, 'index': index}
+    ).scalar()
+    if not exists:
+        conn.execute(text(f"ALTER TABLE {table} ADD INDEX {index} ({columns})"))
+
+
 def init_db():
     """Crea le tabelle necessarie se non esistono."""
     engine = get_engine()
@@ -29,10 +55,16 @@ def init_db():
                     id VARCHAR(36) PRIMARY KEY,
                     domanda TEXT,
                     risposta_attesa TEXT,
-                    categoria TEXT
+                    categoria TEXT,
+                    updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+                    INDEX idx_questions_updated_at (updated_at)
                 )"""
             )
         )
+        # Aggiornata da MySQL a ogni modifica, anche fatta fuori dall'applicazione (vedi ensure_term_index)
+        _ensure_column(conn, 'questions', 'updated_at',
+                       'TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)')
+        _ensure_index(conn, 'questions', 'idx_questions_updated_at', 'updated_at')
         conn.execute(
             text(
                 """CREATE TABLE IF NOT EXISTS question_sets (
@@ -71,7 +103,117 @@ def init_db():
                     api_key TEXT,
                     model TEXT,
                     temperature FLOAT,
-                    max_tokens INT
+                    max_tokens INT,
+                    max_concurrency INT,
+                    requests_per_minute INT,
+                    tokens_per_minute INT
+                )"""
+            )
+        )
+        _ensure_column(conn, 'api_presets', 'max_concurrency', 'INT')
+        _ensure_column(conn, 'api_presets', 'requests_per_minute', 'INT')
+        _ensure_column(conn, 'api_presets', 'tokens_per_minute', 'INT')
+        conn.execute(
+            text(
+                """CREATE TABLE IF NOT EXISTS generation_cache (
+                    cache_key CHAR(64) PRIMARY KEY,
+                    model VARCHAR(255),
+                    value MEDIUMTEXT,
+                    created_at DOUBLE,
+                    last_access DOUBLE,
+                    hits INT DEFAULT 0,
+                    INDEX idx_generation_cache_last_access (last_access)
+                )"""
+            )
+        )
+        conn.execute(
+            text(
+                """CREATE TABLE IF NOT EXISTS evaluation_cache (
+                    cache_key CHAR(64) PRIMARY KEY,
+                    model VARCHAR(255),
+                    value MEDIUMTEXT,
+                    created_at DOUBLE,
+                    last_access DOUBLE,
+                    hits INT DEFAULT 0,
+                    INDEX idx_evaluation_cache_last_access (last_access)
+                )"""
+            )
+        )
+        conn.execute(
+            text(
+                """CREATE TABLE IF NOT EXISTS test_runs (
+                    id VARCHAR(36) PRIMARY KEY,
+                    set_id VARCHAR(36),
+                    status VARCHAR(20),
+                    config JSON,
+                    total INT,
+                    completed INT DEFAULT 0,
+                    result_id VARCHAR(36),
+                    error TEXT,
+                    created_at TEXT,
+                    updated_at TEXT,
+                    INDEX idx_test_runs_set_status (set_id, status)
+                )"""
+            )
+        )
+        conn.execute(
+            text(
+                """CREATE TABLE IF NOT EXISTS test_run_items (
+                    run_id VARCHAR(36),
+                    question_id VARCHAR(36),
+                    result JSON,
+                    PRIMARY KEY (run_id, question_id)
+                )"""
+            )
+        )
+        # Indice invertito dei termini di domande e risposte attese, aggiornato a ogni modifica
+        conn.execute(
+            text(
+                """CREATE TABLE IF NOT EXISTS term_index_postings (
+                    field VARCHAR(32),
+                    term VARCHAR(100) COLLATE utf8mb4_bin,
+                    question_id VARCHAR(36),
+                    tf INT,
+                    PRIMARY KEY (field, term, question_id),
+                    INDEX idx_term_index_postings_question (question_id, field)
+                )"""
+            )
+        )
+        conn.execute(
+            text(
+                """CREATE TABLE IF NOT EXISTS term_index_terms (
+                    field VARCHAR(32),
+                    term VARCHAR(100) COLLATE utf8mb4_bin,
+                    df INT,
+                    PRIMARY KEY (field, term)
+                )"""
+            )
+        )
+        conn.execute(
+            text(
+                """CREATE TABLE IF NOT EXISTS term_index_documents (
+                    question_id VARCHAR(36),
+                    field VARCHAR(32),
+                    length INT,
+                    PRIMARY KEY (question_id, field)
+                )"""
+            )
+        )
+        conn.execute(
+            text(
+                """CREATE TABLE IF NOT EXISTS term_index_corpus (
+                    field VARCHAR(32) PRIMARY KEY,
+                    documents INT,
+                    total_length BIGINT
+                )"""
+            )
+        )
+        # Ultimo allineamento dell'indice: updated_at massimo delle domande già indicizzate
+        conn.execute(
+            text(
+                """CREATE TABLE IF NOT EXISTS term_index_state (
+                    id TINYINT PRIMARY KEY,
+                    synced_until TIMESTAMP(6) NULL
                 )"""
             )
         )
@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from .bm25_utils import match_level
+from .openai_utils import get_openai_client
+from .rate_limit_utils import call_with_rate_limit
+from .telemetry_utils import TimedCall, call_metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: la cache è protetta solo tra i thread dello stesso processo
+    fcntl = None
+
+# Parametri predefiniti della valutazione con embedding (le soglie sono percentuali di similarità coseno)
+EMBEDDING_DEFAULT_PARAMETERS = {
+    "model": "text-embedding-3-small",
+    "batch_size": 256,
+    "high_threshold": 85.0,
+    "medium_threshold": 70.0
+}
+# Cartella dei vettori delle risposte attese, un file per modello ed endpoint
+EMBEDDING_CACHE_DIR = Path(__file__).resolve().parent.parent / "embedding_cache"
+
+_UNSAFE_FILENAME_CHARS = re.compile(r"[^\w.-]+")
+
+
+def _content_hash(text_value: str):
+    return hashlib.sha256(text_value.encode("utf-8")).hexdigest()[:16]
+
+
+def reference_cache_key(question_id, expected_answer: str):
+    """Chiave di cache del vettore di una risposta attesa: cambia se la risposta viene modificata."""
+    return f"{question_id}:{_content_hash(expected_answer)}"
+
+
+class EmbeddingCache:
+    """
+    Vettori float32 salvati in un file mappato in memoria (<nome>.f32), con accanto un indice JSON
+    (<nome>.json) che associa a ogni chiave la propria riga. I nuovi vettori vengono accodati al file;
+    le letture mappano il file e copiano solo le righe richieste.
+    """
+
+    def __init__(self, model: str, endpoint: str = None, directory=None):
+        directory = Path(directory or EMBEDDING_CACHE_DIR)
+        name = f"{_UNSAFE_FILENAME_CHARS.sub('_', model)}-{_content_hash(endpoint or '')[:8]}"
+        self.vectors_path = directory / f"{name}.f32"
+        self.index_path = directory / f"{name}.json"
+        self.lock_path = directory / f"{name}.lock"
+        self._lock = threading.Lock()
+        self._index = None
+        self._index_mtime = None
+
+    def _read_index(self):
+        """Indice {'dim', 'rows', 'keys'}, riletto solo se un altro processo lo ha modificato."""
+        try:
+            mtime = self.index_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return {"dim": None, "rows": 0, "keys": {}}
+        if self._index is None or mtime != self._index_mtime:
+            with open(self.index_path, encoding="utf-8") as f:
+                self._index = json.load(f)
+            self._index_mtime = mtime
+        return self._index
+
+    @contextmanager
+    def _file_lock(self):
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "a") as handle:
+            if fcntl:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def get_many(self, keys: list):
+        """Restituisce un dizionario {chiave: vettore} con le sole chiavi presenti in cache."""
+        with self._lock:
+            index = self._read_index()
+            found = [(key, index["keys"][key]) for key in keys if key in index["keys"]]
+            if not found:
+                return {}
+            matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(index["rows"], index["dim"]))
+            vectors = np.array(matrix[[row for _, row in found]])
+            del matrix
+        return {key: vector for (key, _), vector in zip(found, vectors)}
+
+    def put_many(self, entries: dict):
+        """Accoda al file i vettori {chiave: vettore} non ancora presenti e aggiorna l'indice."""
+        if not entries:
+            return
+        with self._lock, self._file_lock():
+            self._index = None
+            index = dict(self._read_index())
+            keys = dict(index["keys"])
+            new_entries = [(key, vector) for key, vector in entries.items() if key not in keys]
+            if not new_entries:
+                return
+            vectors = np.asarray([vector for _, vector in new_entries], dtype=np.float32)
+            dim = index["dim"] or vectors.shape[1]
+            if vectors.shape[1] != dim:
+                raise ValueError(f"Dimensione degli embedding {vectors.shape[1]} diversa da quella della cache ({dim}).")
+            # Eventuali righe scritte da un processo interrotto prima di aggiornare l'indice vengono sovrascritte
+            offset = index["rows"] * dim * np.dtype(np.float32).itemsize
+            with open(self.vectors_path, "r+b" if self.vectors_path.exists() else "w+b") as f:
+                f.truncate(offset)
+                f.seek(offset)
+                f.write(vectors.tobytes())
+            for row, (key, _) in enumerate(new_entries, start=index["rows"]):
+                keys[key] = row
+            index.update(dim=dim, rows=index["rows"] + len(new_entries), keys=keys)
+            tmp_path = self.index_path.with_suffix(".json.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+
+
+def embed_texts(texts: list, client_config: dict, model: str, batch_size: int = EMBEDDING_DEFAULT_PARAMETERS["batch_size"]):
+    """
+    Calcola gli embedding di una lista di testi con richieste a gruppi di batch_size.
+    Args:
+        texts: Testi non vuoti da convertire.
+        client_config: Preset API con api_key ed endpoint (compatibile OpenAI) e limiti di velocità.
+        model: Modello di embedding.
+        batch_size: Testi inviati con ogni richiesta.
+    Returns:
+        Una tupla (matrice float32 testi x dimensioni, lista delle metriche di ogni chiamata).
+    Raises:
+        RuntimeError se il client non è configurato; le eccezioni dell'API dopo i tentativi ripetuti.
+    """
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32), []
+    client = get_openai_client(api_key=client_config.get("api_key"), base_url=client_config.get("endpoint"))
+    if not client:
+        raise RuntimeError("Client API per gli embedding non configurato.")
+    vectors, calls = [], []
+    for start in range(0, len(texts), max(1, int(batch_size))):
+        batch = texts[start:start + max(1, int(batch_size))]
+        timed_create = TimedCall(client.embeddings.create)
+        response, retries = call_with_rate_limit(timed_create, {"model": model, "input": batch}, client_config)
+        data = sorted(response.data, key=lambda item: item.index)
+        vectors.extend(item.embedding for item in data)
+        metrics = call_metrics(model, response.usage, timed_create.latency, retries)
+        metrics["batch_size"] = len(batch)
+        calls.append(metrics)
+    return np.asarray(vectors, dtype=np.float32), calls
+
+
+def _normalize_rows(matrix: np.ndarray):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def evaluate_results_embedding(results: dict, client_config: dict, parameters: dict = None, cache: EmbeddingCache = None):
+    """
+    Aggiunge ai risultati di un'esecuzione la similarità coseno tra gli embedding della risposta
+    generata e della risposta attesa. I vettori delle risposte attese vengono letti dalla cache e
+    solo quelli mancanti vengono calcolati, nelle stesse richieste a gruppi delle risposte generate.
+    Le domande la cui generazione è fallita (o con risposta vuota) ottengono punteggio 0.
+    Args:
+        results: Dizionario {question_id: risultato} con 'expected_answer' e 'actual_answer'.
+        client_config: Preset API dell'endpoint di embedding.
+        parameters: model, batch_size, high_threshold e medium_threshold (default: EMBEDDING_DEFAULT_PARAMETERS).
+        cache: Cache dei vettori delle risposte attese (default: quella del modello e dell'endpoint).
+    Returns:
+        Una tupla (risultati con similarity_score e match_level, riepilogo con le metriche delle
+        chiamate in 'calls' e il numero di risposte attese lette dalla cache in 'cached_references').
+    """
+    parameters = dict(EMBEDDING_DEFAULT_PARAMETERS, **(parameters or {}))
+    model = parameters["model"]
+    if cache is None:
+        cache = EmbeddingCache(model, client_config.get("endpoint"))
+
+    q_ids = [q_id for q_id, r in results.items()
+             if not r.get('generation_failed') and str(r.get('actual_answer') or "").strip()
+             and str(r.get('expected_answer') or "").strip()]
+    reference_keys = {q_id: reference_cache_key(q_id, results[q_id]['expected_answer']) for q_id in q_ids}
+    cached = cache.get_many(list(set(reference_keys.values())))
+    missing_refs = list(dict.fromkeys(key for key in reference_keys.values() if key not in cached))
+    texts_by_key = {reference_keys[q_id]: results[q_id]['expected_answer'] for q_id in q_ids}
+
+    texts = [texts_by_key[key] for key in missing_refs] + [results[q_id]['actual_answer'] for q_id in q_ids]
+    vectors, calls = embed_texts(texts, client_config, model, parameters["batch_size"])
+    new_refs = dict(zip(missing_refs, vectors[:len(missing_refs)]))
+    cache.put_many(new_refs)
+
+    scores = np.zeros(len(q_ids))
+    if q_ids:
+        all_refs = {**cached, **new_refs}
+        references = _normalize_rows(np.asarray([all_refs[reference_keys[q_id]] for q_id in q_ids], dtype=np.float32))
+        answers = _normalize_rows(vectors[len(missing_refs):])
+        scores = np.clip(np.einsum("ij,ij->i", references, answers), 0.0, 1.0) * 100.0
+    scored = dict(zip(q_ids, scores))
+
+    for q_id, result in results.items():
+        score = float(scored.get(q_id, 0.0))
+        result.update({
+            'similarity_score': round(score, 2),
+            'match_level': match_level(score, parameters["high_threshold"], parameters["medium_threshold"])
+        })
+    summary = {'calls': calls, 'cached_references': sum(1 for q_id in q_ids if reference_keys[q_id] in cached)}
+    return results, summary
@@ -0,0 +1,283 @@
+import asyncio
+
+from .openai_utils import (
+    DEFAULT_MAX_CONCURRENCY, get_async_openai_client, close_async_clients,
+    evaluate_answers_batch_async, generate_example_answer_with_llm_async
+)
+from .fast_path_utils import fast_path_evaluation
+
+# Attesa massima (secondi) per riempire un gruppo di valutazione prima di inviarlo incompleto
+EVAL_BATCH_WAIT_SECONDS = 0.5
+
+
+def get_preset_concurrency(preset_config: dict):
+    """Restituisce il numero massimo di chiamate concorrenti configurato per un preset."""
+    try:
+        value = int(preset_config.get("max_concurrency") or DEFAULT_MAX_CONCURRENCY)
+    except (TypeError, ValueError):
+        value = DEFAULT_MAX_CONCURRENCY
+    return max(1, value)
+
+
+def _generation_failed_result(q_data, generation_api_details):
+    """Risultato registrato per una domanda la cui generazione è fallita."""
+    return {
+        'question': q_data['question'],
+        'expected_answer': q_data['expected_answer'],
+        'actual_answer': "Errore Generazione",
+        'evaluation': {'score': 0, 'explanation': 'Generazione fallita'},
+        'generation_api_details': generation_api_details,
+        'generation_failed': True
+    }
+
+
+async def run_llm_test_async(questions, gen_config: dict, eval_config: dict,
+                             show_api_details: bool = False, progress_callback=None,
+                             gen_concurrency: int = None, eval_concurrency: int = None,
+                             queue_size: int = None, eval_batch_size: int = 1,
+                             use_generation_cache: bool = False, use_evaluation_cache: bool = False,
+                             result_callback=None, stream_generation: bool = False,
+                             use_fast_path: bool = False, stop_callback=None):
+    """
+    Esegue generazione e valutazione LLM di un insieme di domande come una pipeline a due stadi.
+
+    I worker di generazione (preset di generazione) inseriscono le risposte in una coda limitata
+    da cui attingono i worker di valutazione (preset di valutazione), così entrambi gli endpoint
+    lavorano contemporaneamente.
+    Args:
+        questions: Lista di tuple (question_id, {'question': ..., 'expected_answer': ...}).
+        gen_config: Preset API usato per generare le risposte.
+        eval_config: Preset API usato per valutare le risposte; None per generare soltanto
+            (le risposte vengono valutate dopo, es. con BM25) e registrare i risultati senza 'evaluation'.
+        show_api_details: Se True, include i dettagli delle chiamate API nei risultati.
+        progress_callback: Funzione opzionale chiamata come progress_callback(completate, totali).
+        gen_concurrency: Numero di worker di generazione (default: max_concurrency del preset).
+        eval_concurrency: Numero di worker di valutazione (default: max_concurrency del preset).
+        queue_size: Capacità della coda tra i due stadi (default: il doppio dei worker di valutazione).
+        eval_batch_size: Numero di risposte valutate con una singola chiamata al valutatore (1 = nessun raggruppamento).
+        use_generation_cache: Se True, riusa le risposte già generate con lo stesso preset e prompt;
+            ogni risultato riporta allora 'generation_cache_hit'.
+        use_evaluation_cache: Se True, riusa i giudizi già espressi dallo stesso valutatore sulla stessa
+            terna (domanda, risposta attesa, risposta effettiva); le valutazioni riportano allora 'cache_hit'.
+        result_callback: Funzione opzionale chiamata come result_callback(question_id, risultato) appena
+            una domanda è completata, in un thread separato (può quindi scrivere sul database).
+        stream_generation: Se True, le risposte vengono generate in streaming e 'generation_metrics'
+            riporta anche time-to-first-token e token di output al secondo.
+        use_fast_path: Se True, le risposte il cui esito è certo (uguali, numericamente equivalenti o
+            che contengono la risposta attesa, vedi fast_path_evaluation) vengono valutate senza il giudice LLM.
+        stop_callback: Funzione opzionale chiamata come stop_callback(question_id, risultato) dopo
+            result_callback; quando restituisce True non vengono avviate altre generazioni (quelle in
+            corso vengono completate e valutate), es. per le esecuzioni a campione.
+    Returns:
+        Un dizionario {question_id: risultato} nello stesso formato salvato da add_test_result,
+        ordinato come la lista di domande in ingresso (con stop_callback, solo le domande eseguite).
+        I risultati generati con una chiamata API riportano la sua telemetria in 'generation_metrics',
+        le valutazioni in 'evaluation.metrics' (vedi telemetry_utils.call_metrics).
+    """
+    evaluate = eval_config is not None
+    gen_workers = max(1, int(gen_concurrency or get_preset_concurrency(gen_config)))
+    eval_workers = max(1, int(eval_concurrency or get_preset_concurrency(eval_config))) if evaluate else 0
+
+    gen_client = get_async_openai_client(api_key=gen_config.get("api_key"), base_url=gen_config.get("endpoint"))
+    eval_client = get_async_openai_client(api_key=eval_config.get("api_key"), base_url=eval_config.get("endpoint")) if evaluate else None
+
+    pending = asyncio.Queue()
+    for item in questions:
+        pending.put_nowait(item)
+    eval_batch_size = max(1, int(eval_batch_size or 1))
+    to_evaluate = asyncio.Queue(maxsize=queue_size or 2 * max(eval_workers, 1) * eval_batch_size)
+
+    completed = {}
+    total = len(questions)
+    stop_requested = asyncio.Event()
+
+    async def record(q_id, result, generation_output):
+        if use_generation_cache:
+            result['generation_cache_hit'] = bool(generation_output.get("cache_hit"))
+        if generation_output.get("metrics"):
+            result['generation_metrics'] = generation_output["metrics"]
+        if result_callback:
+            await asyncio.to_thread(result_callback, q_id, result)
+        completed[q_id] = result
+        if stop_callback and stop_callback(q_id, result):
+            stop_requested.set()
+        if progress_callback:
+            progress_callback(len(completed), total)
+
+    async def generation_worker():
+        while not stop_requested.is_set():
+            try:
+                q_id, q_data = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            generation_output = await generate_example_answer_with_llm_async(
+                q_data['question'], client_config=gen_config,
+                show_api_details=show_api_details, client=gen_client, use_cache=use_generation_cache,
+                stream=stream_generation
+            )
+            if generation_output["answer"] is None:
+                await record(q_id, _generation_failed_result(q_data, generation_output["api_details"]), generation_output)
+                continue
+            if not evaluate:
+                await record(q_id, {
+                    'question': q_data['question'],
+                    'expected_answer': q_data['expected_answer'],
+                    'actual_answer': generation_output["answer"],
+                    'generation_api_details': generation_output["api_details"]
+                }, generation_output)
+                continue
+            fast_evaluation = use_fast_path and fast_path_evaluation(
+                q_data['question'], q_data['expected_answer'], generation_output["answer"])
+            if fast_evaluation:
+                await record(q_id, {
+                    'question': q_data['question'],
+                    'expected_answer': q_data['expected_answer'],
+                    'actual_answer': generation_output["answer"],
+                    'evaluation': fast_evaluation,
+                    'generation_api_details': generation_output["api_details"]
+                }, generation_output)
+                continue
+            # Si blocca se la coda è piena: la generazione non supera mai la valutazione di troppo
+            await to_evaluate.put((q_id, q_data, generation_output))
+
+    async def next_batch():
+        """Preleva dalla coda fino a eval_batch_size risposte; restituisce (gruppo, coda_terminata)."""
+        item = await to_evaluate.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + EVAL_BATCH_WAIT_SECONDS
+        while len(batch) < eval_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(to_evaluate.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def evaluation_worker():
+        finished = False
+        while not finished:
+            batch, finished = await next_batch()
+            if not batch:
+                return
+            evaluations = await evaluate_answers_batch_async(
+                [
+                    {
+                        'item_id': q_id,
+                        'question': q_data['question'],
+                        'expected_answer': q_data['expected_answer'],
+                        'actual_answer': generation_output["answer"]
+                    }
+                    for q_id, q_data, generation_output in batch
+                ],
+                client_config=eval_config, show_api_details=show_api_details, client=eval_client,
+                use_cache=use_evaluation_cache
+            )
+            for (q_id, q_data, generation_output), evaluation in zip(batch, evaluations):
+                await record(q_id, {
+                    'question': q_data['question'],
+                    'expected_answer': q_data['expected_answer'],
+                    'actual_answer': generation_output["answer"],
+                    'evaluation': evaluation,  # Questo conterrà i dettagli API della VALUTAZIONE
+                    'generation_api_details': generation_output["api_details"]  # Dettagli API della GENERAZIONE
+                }, generation_output)
+
+    producers = [asyncio.ensure_future(generation_worker()) for _ in range(min(gen_workers, max(total, 1)))]
+    consumers = [asyncio.ensure_future(evaluation_worker()) for _ in range(eval_workers)]
+
+    async def close_queue():
+        await asyncio.gather(*producers)
+        for _ in consumers:
+            await to_evaluate.put(None)
+
+    tasks = producers + consumers + [asyncio.ensure_future(close_queue())]
+    try:
+        # Un worker che fallisce interrompe subito la pipeline: altrimenti i generatori resterebbero
+        # bloccati sulla coda piena in attesa di valutatori che non esistono più
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    return {q_id: completed[q_id] for q_id, _ in questions if q_id in completed}
+
+
+def run_llm_job(coroutine):
+    """
+    Esegue in un nuovo event loop una coroutine che usa il motore di esecuzione
+    (una o più chiamate a run_llm_test_async in parallelo) e chiude poi i client asincroni del loop.
+    """
+    async def run_and_close():
+        try:
+            return await coroutine
+        finally:
+            await close_async_clients()
+    return asyncio.run(run_and_close())
+
+
+def run_llm_test(questions, gen_config: dict, eval_config: dict,
+                 show_api_details: bool = False, progress_callback=None,
+                 gen_concurrency: int = None, eval_concurrency: int = None,
+                 eval_batch_size: int = 1, use_generation_cache: bool = False,
+                 use_evaluation_cache: bool = False, result_callback=None, stream_generation: bool = False,
+                 use_fast_path: bool = False):
+    """Esegue run_llm_test_async in un nuovo event loop e ne restituisce i risultati."""
+    return run_llm_job(run_llm_test_async(
+        questions, gen_config, eval_config,
+        show_api_details=show_api_details, progress_callback=progress_callback,
+        gen_concurrency=gen_concurrency, eval_concurrency=eval_concurrency,
+        eval_batch_size=eval_batch_size, use_generation_cache=use_generation_cache,
+        use_evaluation_cache=use_evaluation_cache, result_callback=result_callback,
+        stream_generation=stream_generation, use_fast_path=use_fast_path
+    ))
+
+
+def generation_latency_stats(results: dict):
+    """
+    Medie delle metriche di latenza della generazione sui risultati che le riportano
+    (time_to_first_token e tokens_per_second solo con stream_generation).
+    Returns:
+        Un dizionario {time_to_first_token, latency, tokens_per_second, count}, o None se nessun
+        risultato ha metriche.
+    """
+    metrics = [r['generation_metrics'] for r in results.values() if r.get('generation_metrics')]
+    if not metrics:
+        return None
+
+    def mean(key):
+        values = [m[key] for m in metrics if m.get(key) is not None]
+        return sum(values) / len(values) if values else None
+
+    return {
+        "time_to_first_token": mean("time_to_first_token"),
+        "latency": mean("latency"),
+        "tokens_per_second": mean("tokens_per_second"),
+        "count": len(metrics)
+    }
+
+
+def cache_hit_stats(results: dict):
+    """
+    Conta i risultati di un test serviti dalle cache di generazione e di valutazione.
+    Returns:
+        Un dizionario {"generation": (hit, totale), "evaluation": (hit, totale)}; il totale conta
+        solo i risultati per cui la rispettiva cache era attiva.
+    """
+    generation = [r['generation_cache_hit'] for r in results.values() if 'generation_cache_hit' in r]
+    evaluation = [r['evaluation']['cache_hit'] for r in results.values()
+                  if isinstance(r.get('evaluation'), dict) and 'cache_hit' in r['evaluation']]
+    return {
+        "generation": (sum(1 for hit in generation if hit), len(generation)),
+        "evaluation": (sum(1 for hit in evaluation if hit), len(evaluation))
+    }
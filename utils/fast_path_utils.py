@@ -0,0 +1,182 @@
+import re
+import unicodedata
+
+# Articoli ignorati nel confronto normalizzato ("la Roma" = "Roma")
+ITALIAN_ARTICLES = frozenset("il lo la i gli le l un uno una".split())
+# Parole che rendono ambigua una risposta che contiene quella attesa ("non è Parigi", "Parigi o Lione")
+AMBIGUITY_WORDS = frozenset("non no ne o oppure forse probabilmente circa".split())
+# Congiunzioni e separatori che elencano più risposte ("Roma e Milano", "Roma, Milano"): cercati nel testo
+# prima di togliere gli accenti, così il verbo "è" non viene scambiato per la congiunzione "e"
+CONJUNCTION_WORDS = frozenset("e ed o od oppure sia".split())
+# Oltre questa lunghezza (in parole) una risposta che contiene quella attesa viene lasciata al giudice
+MAX_CONTAINS_ANSWER_WORDS = 30
+
+_UNIT_WORDS = {
+    "zero": 0, "un": 1, "uno": 1, "una": 1, "due": 2, "tre": 3, "quattro": 4, "cinque": 5, "sei": 6,
+    "sette": 7, "otto": 8, "nove": 9, "dieci": 10, "undici": 11, "dodici": 12, "tredici": 13,
+    "quattordici": 14, "quindici": 15, "sedici": 16, "diciassette": 17, "diciotto": 18, "diciannove": 19
+}
+_TENS_WORDS = {
+    "venti": 20, "trenta": 30, "quaranta": 40, "cinquanta": 50, "sessanta": 60, "settanta": 70,
+    "ottanta": 80, "novanta": 90
+}
+_NUMBER_PATTERN = re.compile(r"[-+]?\d+(?:[.,]\d+)*")
+_THOUSANDS_PATTERN = re.compile(r"[-+]?\d{1,3}(?:\.\d{3})+")
+_PUNCTUATION = re.compile(r"[^\w\s.,+-]|(?<!\d)[.,]|[.,](?!\d)", re.UNICODE)
+_COMBINING_MARKS = re.compile(r"[\u0300-\u036f]")
+_INTEGER_PATTERN = re.compile(r"[-+]?\d+")
+_LIST_SEPARATORS = re.compile(r"[,;/&](?!\d)")
+
+
+def normalize_answer(text: str):
+    """Minuscolo, senza accenti, punteggiatura e articoli, con gli spazi compattati."""
+    normalized = _COMBINING_MARKS.sub("", unicodedata.normalize("NFKD", str(text).lower()))
+    words = [word for word in _PUNCTUATION.sub(" ", normalized).split() if word not in ITALIAN_ARTICLES]
+    return " ".join(words)
+
+
+def _word_to_number(word: str):
+    """Converte un numero italiano scritto in lettere (es. "dodici", "ventitre", "duemilaventi")."""
+    if not word:
+        return None
+    if word in _UNIT_WORDS:
+        return _UNIT_WORDS[word]
+    if word.startswith("mille"):
+        rest = word[len("mille"):]
+        tail = _word_to_number(rest) if rest else 0
+        return 1000 + tail if tail is not None else None
+    if "mila" in word:
+        head, _, rest = word.partition("mila")
+        head_value = _word_to_number(head)
+        tail = _word_to_number(rest) if rest else 0
+        return head_value * 1000 + tail if head_value and tail is not None else None
+    if "cent" in word:
+        head, _, rest = word.partition("cent")
+        head_value = _word_to_number(head) if head else 1
+        if head_value is None or not 1 <= head_value <= 9 or not rest.startswith("o"):
+            return None
+        # "cento" + resto, oppure elisione della o davanti a "otto"/"ottanta" ("centotto")
+        tail = 0 if rest == "o" else _word_to_number(rest[1:])
+        if tail is None:
+            tail = _word_to_number(rest)
+        return head_value * 100 + tail if tail is not None else None
+    for tens, value in _TENS_WORDS.items():
+        stem = tens[:-1]
+        if word.startswith(stem):
+            rest = word[len(stem):]
+            if rest == tens[-1]:
+                return value
+            # "ventitre", oppure elisione della vocale davanti a "uno"/"otto" ("ventuno", "ventotto")
+            tail = _word_to_number(rest[1:]) if rest.startswith(tens[-1]) else _word_to_number(rest)
+            return value + tail if tail is not None and 1 <= tail <= 9 else None
+    return None
+
+
+def parse_number(text: str):
+    """
+    Interpreta una risposta composta da un solo numero, in cifre ("12", "12,0", "1.000") o in lettere ("dodici").
+    Returns:
+        Il valore come float, o None se la risposta non è un numero.
+    """
+    normalized = normalize_answer(text)
+    if not normalized:
+        return None
+    if _NUMBER_PATTERN.fullmatch(normalized):
+        if _THOUSANDS_PATTERN.fullmatch(normalized):
+            normalized = normalized.replace(".", "")
+        try:
+            return float(normalized.replace(",", "."))
+        except ValueError:
+            return None
+    value = _word_to_number(normalized.replace(" ", "").replace("-", ""))
+    return float(value) if value is not None else None
+
+
+def _is_plain_integer(text: str):
+    """True se la risposta è un intero senza separatori ("12", "-3") o scritto in lettere ("dodici")."""
+    normalized = normalize_answer(text)
+    return bool(_INTEGER_PATTERN.fullmatch(normalized)) or (
+        _word_to_number(normalized.replace(" ", "").replace("-", "")) is not None)
+
+
+def _list_marks(text: str):
+    words = re.findall(r"\w+", str(text).lower())
+    return sum(1 for word in words if word in CONJUNCTION_WORDS) + len(_LIST_SEPARATORS.findall(str(text)))
+
+
+def _numbers_in(text: str):
+    """Valori numerici (in cifre o in lettere) presenti in un testo."""
+    values = set()
+    for word in normalize_answer(text).split():
+        value = parse_number(word)
+        if value is not None:
+            values.add(value)
+    return values
+
+
+def _fast_evaluation(score: int, rule: str, explanation: str):
+    return {
+        "score": score, "explanation": explanation,
+        "similarity": score, "correctness": score, "completeness": score,
+        "fast_path": rule
+    }
+
+
+def fast_path_evaluation(question: str, expected_answer: str, actual_answer: str):
+    """
+    Valuta senza LLM le risposte il cui esito è certo: corrispondenza esatta, corrispondenza dopo la
+    normalizzazione (maiuscole, accenti, punteggiatura, articoli), equivalenza numerica ("12", "12.0",
+    "dodici") e risposta attesa contenuta in una risposta breve e non ambigua.
+    Args:
+        question: La domanda (i numeri che compaiono nella domanda, es. gli operandi, sono ammessi nella risposta).
+        expected_answer: La risposta attesa.
+        actual_answer: La risposta generata.
+    Returns:
+        Un dizionario nel formato di evaluate_answer con 'fast_path' (la regola applicata),
+        o None se la risposta è ambigua e va valutata dal giudice LLM.
+
+    Esempi (python -m doctest utils/fast_path_utils.py):
+        >>> score = lambda expected, actual: (fast_path_evaluation("", expected, actual) or {}).get("score")
+        >>> score("12", "dodici"), score("12", "13"), score("12", "12.000"), score("3.14", "3,14159")
+        (100, 0, None, None)
+        >>> score("Roma", "La capitale è Roma."), score("Roma", "Roma e Milano"), score("Roma", "Roma, Milano")
+        (100, None, None)
+        >>> score("Roma", "Roma o Milano"), score("Romeo e Giulietta", "Romeo e Giulietta di Shakespeare")
+        (None, 100)
+    """
+    if not isinstance(expected_answer, str) or not isinstance(actual_answer, str):
+        return None
+    if not expected_answer.strip() or not actual_answer.strip():
+        return None
+    if actual_answer.strip() == expected_answer.strip():
+        return _fast_evaluation(100, "exact", "Risposta identica a quella attesa.")
+
+    expected, actual = normalize_answer(expected_answer), normalize_answer(actual_answer)
+    if expected and actual == expected:
+        return _fast_evaluation(100, "normalized", "Risposta uguale a quella attesa a meno di maiuscole, "
+                                                   "accenti, punteggiatura o articoli.")
+
+    expected_number = parse_number(expected_answer)
+    if expected_number is not None:
+        actual_number = parse_number(actual_answer)
+        if actual_number is not None:
+            if actual_number == expected_number:
+                return _fast_evaluation(100, "numeric", "Valore numerico equivalente a quello atteso.")
+            # Un valore diverso è certo solo tra interi senza separatori: "12.000" o "3,14159" possono
+            # essere letture diverse (migliaia, arrotondamenti) della stessa risposta
+            if _is_plain_integer(expected_answer) and _is_plain_integer(actual_answer):
+                return _fast_evaluation(0, "numeric", f"Valore numerico diverso da quello atteso ({expected_answer.strip()}).")
+            return None
+        # Ammessi nella risposta anche i numeri della domanda (es. "7 + 5 = 12")
+        answer_numbers = _numbers_in(actual_answer) - _numbers_in(question or "")
+        if answer_numbers == {expected_number} and not AMBIGUITY_WORDS & set(actual.split()):
+            return _fast_evaluation(100, "contains", "La risposta riporta il valore numerico atteso.")
+        return None
+
+    actual_words = actual.split()
+    if (expected and len(actual_words) <= MAX_CONTAINS_ANSWER_WORDS
+            and re.search(rf"(?:^| ){re.escape(expected)}(?: |$)", actual)
+            and not AMBIGUITY_WORDS & set(actual_words)
+            and _list_marks(actual_answer) <= _list_marks(expected_answer)):
+        return _fast_evaluation(100, "contains", "La risposta contiene quella attesa senza alternative, elenchi o negazioni.")
+    return None
@@ -1,11 +1,25 @@
 import os
 import json
-import streamlit as st
-from openai import OpenAI, APIConnectionError, RateLimitError, APIStatusError
+import time
+import asyncio
+import threading
+import httpx
+from openai import (
+    OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient, Timeout,
+    APIConnectionError, RateLimitError, APIStatusError
+)
 import traceback
 
+from .rate_limit_utils import call_with_rate_limit, call_with_rate_limit_async
+from .cache_utils import generation_cache, generation_cache_key, evaluation_cache, evaluation_cache_key
+from .runtime_utils import logger, notify_error, notify_warning
+from .telemetry_utils import TimedCall, TimedCallAsync, call_metrics, split_call_metrics
+
 DEFAULT_MODEL = "gpt-4o"
 DEFAULT_ENDPOINT = "https://api.openai.com/v1"
+DEFAULT_MAX_CONCURRENCY = 5
+# Token di output riservati a ciascun elemento nelle valutazioni a gruppi
+BATCH_EVALUATION_TOKENS_PER_ITEM = 200
 
 # Modelli disponibili per diversi provider (esempio)
 OPENAI_MODELS = ["gpt-4o", "gpt-4-turbo", "gpt-4", "gpt-3.5-turbo"]
@@ -13,9 +27,75 @@ ANTHROPIC_MODELS = ["claude-3-opus-20240229", "claude-3-sonnet-20240229", "claud
 # Aggiungi altri provider e modelli se necessario
 # XAI_MODELS = ["grok-1"] 
 
+# Parametri dei pool di connessioni condivisi dai client API (modificabili con configure_client_pool)
+CLIENT_POOL_SETTINGS = {
+    "max_connections": 100,          # Connessioni HTTP massime per client
+    "max_keepalive_connections": 20, # Connessioni mantenute aperte tra una chiamata e l'altra
+    "keepalive_expiry": 30.0,        # Secondi dopo cui una connessione keep-alive inutilizzata viene chiusa
+    "timeout": 120.0,                # Timeout complessivo di una richiesta (secondi)
+    "connect_timeout": 10.0,         # Timeout di connessione (secondi)
+    "idle_ttl": 900.0                # Secondi di inutilizzo dopo cui un client viene rimosso dal registro
+}
+# I client condivisi non ritentano da soli (i tentativi sono gestiti da call_with_rate_limit): le chiamate
+# dirette all'SDK (test di connessione, elenco dei modelli, gestione dei batch) riattivano i suoi tentativi
+SDK_MAX_RETRIES = 3
+
+# Registro dei client riutilizzabili: chiave -> {"client", "last_used", "loop"}
+_client_registry = {}
+_client_registry_lock = threading.Lock()
+
+def _effective_base_url(base_url: str = None):
+    """Se base_url è None, "custom", o vuoto, usa il default di OpenAI, altrimenti il base_url fornito."""
+    return base_url if base_url and base_url.strip() and base_url != "custom" else DEFAULT_ENDPOINT
+
+def _client_http_options():
+    """Limiti del pool di connessioni e timeout da passare al client HTTP sottostante."""
+    limits = httpx.Limits(
+        max_connections=CLIENT_POOL_SETTINGS["max_connections"],
+        max_keepalive_connections=CLIENT_POOL_SETTINGS["max_keepalive_connections"],
+        keepalive_expiry=CLIENT_POOL_SETTINGS["keepalive_expiry"]
+    )
+    # Timeout esportato dall'SDK: le versioni recenti usano un client HTTP diverso da httpx
+    timeout = Timeout(CLIENT_POOL_SETTINGS["timeout"], connect=CLIENT_POOL_SETTINGS["connect_timeout"])
+    return {"limits": limits, "timeout": timeout}
+
+def _evict_idle_clients(now: float):
+    """Rimuove dal registro i client inutilizzati da troppo tempo o legati a un event loop chiuso."""
+    idle_ttl = CLIENT_POOL_SETTINGS["idle_ttl"]
+    stale_keys = [
+        key for key, entry in _client_registry.items()
+        if now - entry["last_used"] > idle_ttl or (entry["loop"] is not None and entry["loop"].is_closed())
+    ]
+    for key in stale_keys:
+        entry = _client_registry.pop(key)
+        if entry["loop"] is None:
+            try:
+                entry["client"].close()
+            except Exception:
+                pass
+
+def configure_client_pool(**settings):
+    """
+    Aggiorna i parametri dei pool di connessioni (vedi CLIENT_POOL_SETTINGS).
+    I client già creati vengono chiusi, così le chiamate successive usano i nuovi parametri.
+    """
+    unknown = set(settings) - set(CLIENT_POOL_SETTINGS)
+    if unknown:
+        raise ValueError(f"Parametri del pool non riconosciuti: {', '.join(sorted(unknown))}")
+    with _client_registry_lock:
+        CLIENT_POOL_SETTINGS.update(settings)
+        for entry in _client_registry.values():
+            if entry["loop"] is None:
+                try:
+                    entry["client"].close()
+                except Exception:
+                    pass
+        _client_registry.clear()
+
 def get_openai_client(api_key: str, base_url: str = None):
     """
-    Crea e restituisce un client OpenAI configurato.
+    Restituisce un client OpenAI configurato, riutilizzando quello già creato per la stessa
+    coppia (api_key, endpoint) insieme al suo pool di connessioni.
     Args:
         api_key: La chiave API.
         base_url: L'URL base dell'endpoint API (opzionale, default a OpenAI).
@@ -23,35 +103,84 @@ def get_openai_client(api_key: str, base_url: str = None):
         Un'istanza del client OpenAI o None se la chiave API non è fornita.
     """
     if not api_key:
-        # st.error("Tentativo di creare un client OpenAI senza una chiave API.") # Commentato per ridurre output UI
-        print("DEBUG: Tentativo di creare client OpenAI senza chiave API.")
+        logger.warning("Tentativo di creare client OpenAI senza chiave API.")
         return None
+    effective_base_url = _effective_base_url(base_url)
+    key = ("sync", api_key, effective_base_url)
     try:
-        # Se base_url è None, "custom", o vuoto, usa il default di OpenAI.
-        # Altrimenti, usa il base_url fornito.
-        effective_base_url = base_url if base_url and base_url.strip() and base_url != "custom" else DEFAULT_ENDPOINT
-        return OpenAI(api_key=api_key, base_url=effective_base_url)
+        with _client_registry_lock:
+            now = time.monotonic()
+            _evict_idle_clients(now)
+            entry = _client_registry.get(key)
+            if entry is None:
+                client = OpenAI(
+                    api_key=api_key, base_url=effective_base_url, max_retries=0,
+                    http_client=DefaultHttpxClient(**_client_http_options())
+                )
+                entry = {"client": client, "last_used": now, "loop": None}
+                _client_registry[key] = entry
+            entry["last_used"] = now
+            return entry["client"]
     except Exception as e:
-        st.error(f"Errore durante la creazione del client OpenAI: {e}")
+        notify_error(f"Errore durante la creazione del client OpenAI: {e}")
         return None
 
-def evaluate_answer(question: str, expected_answer: str, actual_answer: str, 
-                    client_config: dict, show_api_details: bool = False):
+def get_async_openai_client(api_key: str, base_url: str = None):
     """
-    Valuta una risposta utilizzando un LLM specificato tramite client_config.
+    Restituisce un client AsyncOpenAI configurato, da usare nelle esecuzioni concorrenti.
+    Il client (e il suo pool di connessioni) è condiviso da tutte le chiamate dello stesso
+    event loop verso la stessa coppia (api_key, endpoint); va chiuso con close_async_clients().
     Args:
-        question: La domanda.
-        expected_answer: La risposta attesa.
-        actual_answer: La risposta effettiva da valutare.
-        client_config: Dizionario contenente {api_key, endpoint, model, temperature, max_tokens}.
-        show_api_details: Se True, include i dettagli della richiesta/risposta API.
+        api_key: La chiave API.
+        base_url: L'URL base dell'endpoint API (opzionale, default a OpenAI).
     Returns:
-        Un dizionario con il punteggio e la spiegazione, o un risultato di errore.
+        Un'istanza del client AsyncOpenAI o None se la chiave API non è fornita.
     """
-    client = get_openai_client(api_key=client_config.get("api_key"), base_url=client_config.get("endpoint"))
-    if not client:
-        return {"score": 0, "explanation": "Errore: Client API per la valutazione non configurato.", "similarity": 0, "correctness": 0, "completeness": 0}
+    if not api_key:
+        logger.warning("Tentativo di creare client AsyncOpenAI senza chiave API.")
+        return None
+    effective_base_url = _effective_base_url(base_url)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    try:
+        if loop is None:
+            # Fuori da un event loop il client non può essere condiviso in sicurezza
+            return AsyncOpenAI(api_key=api_key, base_url=effective_base_url, max_retries=0,
+                               http_client=DefaultAsyncHttpxClient(**_client_http_options()))
+        key = ("async", api_key, effective_base_url, id(loop))
+        with _client_registry_lock:
+            now = time.monotonic()
+            _evict_idle_clients(now)
+            entry = _client_registry.get(key)
+            if entry is None:
+                client = AsyncOpenAI(
+                    api_key=api_key, base_url=effective_base_url, max_retries=0,
+                    http_client=DefaultAsyncHttpxClient(**_client_http_options())
+                )
+                entry = {"client": client, "last_used": now, "loop": loop}
+                _client_registry[key] = entry
+            entry["last_used"] = now
+            return entry["client"]
+    except Exception as e:
+        notify_error(f"Errore durante la creazione del client AsyncOpenAI: {e}")
+        return None
 
+async def close_async_clients():
+    """Chiude e rimuove dal registro i client asincroni legati all'event loop corrente."""
+    loop = asyncio.get_running_loop()
+    with _client_registry_lock:
+        keys = [key for key, entry in _client_registry.items() if entry["loop"] is loop]
+        entries = [_client_registry.pop(key) for key in keys]
+    for entry in entries:
+        try:
+            await entry["client"].close()
+        except Exception:
+            pass
+
+def _build_evaluation_request(question: str, expected_answer: str, actual_answer: str, client_config: dict):
+    """Costruisce i parametri della chiamata chat completion usata per valutare una risposta."""
     prompt = f"""
         Sei un valutatore esperto che valuta la qualità delle risposte alle domande.
         Domanda: {question}
@@ -71,15 +200,121 @@ def evaluate_answer(question: str, expected_answer: str, actual_answer: str,
         - correctness: punteggio di correttezza (numero)
         - completeness: punteggio di completezza (numero)
     """
-    
-    api_request_details = {
+
+    return {
         "model": client_config.get("model", DEFAULT_MODEL),
         "messages": [{"role": "user", "content": prompt}],
         "temperature": client_config.get("temperature", 0.0),
         "max_tokens": client_config.get("max_tokens", 250), # Aumentato leggermente per JSON più complesso
         "response_format": {"type": "json_object"}
     }
-    
+
+def _parse_evaluation_content(content: str, api_details_for_log: dict):
+    """Converte il contenuto JSON restituito dal valutatore nel dizionario di valutazione."""
+    try:
+        evaluation = json.loads(content)
+        required_keys = ['score', 'explanation', 'similarity', 'correctness', 'completeness']
+        if not all(key in evaluation for key in required_keys):
+            notify_warning(f"Risposta JSON dalla valutazione LLM incompleta: {content}. Verranno usati valori di default.")
+            for key in required_keys:
+                if key not in evaluation:
+                    evaluation[key] = 0 if key != 'explanation' else "Valutazione incompleta o formato JSON non corretto."
+
+        evaluation['api_details'] = api_details_for_log
+        return evaluation
+    except json.JSONDecodeError:
+        notify_error(f"Errore: Impossibile decodificare la risposta JSON dalla valutazione LLM: {content}")
+        return {
+            "score": 0, "explanation": f"Errore di decodifica JSON: {content[:100]}...",
+            "similarity": 0, "correctness": 0, "completeness": 0,
+            "api_details": api_details_for_log, "failed": True
+        }
+
+def _evaluation_error_result(e: Exception, api_details_for_log: dict):
+    """Restituisce il risultato di valutazione a punteggio zero per un errore della chiamata API."""
+    api_details_for_log["error"] = str(e)
+    if isinstance(e, (APIConnectionError, RateLimitError, APIStatusError)):
+        notify_error(f"Errore API durante la valutazione: {type(e).__name__} - {e}")
+        explanation = f"Errore API: {type(e).__name__}"
+    else:
+        notify_error(f"Errore imprevisto durante la valutazione: {type(e).__name__} - {e}")
+        explanation = f"Errore imprevisto: {type(e).__name__}"
+    return {
+        "score": 0, "explanation": explanation,
+        "similarity": 0, "correctness": 0, "completeness": 0,
+        "api_details": api_details_for_log, "failed": True
+    }
+
+EVALUATION_RESULT_KEYS = ['score', 'explanation', 'similarity', 'correctness', 'completeness']
+
+def _evaluation_key_for(question: str, expected_answer: str, actual_answer: str, client_config: dict):
+    """Chiave della cache dei giudizi, indipendente dal raggruppamento delle valutazioni."""
+    request = _build_evaluation_request(question, expected_answer, actual_answer, client_config)
+    return evaluation_cache_key(question, expected_answer, actual_answer, request,
+                                _effective_base_url(client_config.get("endpoint")))
+
+def _is_complete_evaluation_content(content: str):
+    """True se il contenuto restituito dal valutatore è un JSON con tutti i campi della valutazione."""
+    try:
+        evaluation = json.loads(content)
+    except json.JSONDecodeError:
+        return False
+    return isinstance(evaluation, dict) and all(key in evaluation for key in EVALUATION_RESULT_KEYS)
+
+def _cached_evaluations(cache_keys: list, show_api_details: bool):
+    """Restituisce le valutazioni in cache per ciascuna chiave (None dove assenti)."""
+    evaluations = []
+    for cache_key in cache_keys:
+        cached = evaluation_cache.get(cache_key)
+        evaluation = None
+        if cached is not None:
+            try:
+                evaluation = json.loads(cached)
+            except json.JSONDecodeError:
+                evaluation = None
+        if evaluation is not None:
+            evaluation['api_details'] = {"cache_hit": True} if show_api_details else {}
+            evaluation['cache_hit'] = True
+        evaluations.append(evaluation)
+    return evaluations
+
+def _store_evaluations(entries: list, model: str):
+    """Salva in cache le valutazioni valide, date come lista di tuple (chiave, valutazione)."""
+    for cache_key, evaluation in entries:
+        evaluation_cache.put(cache_key, json.dumps({key: evaluation[key] for key in EVALUATION_RESULT_KEYS},
+                                                   ensure_ascii=False), model=model)
+        evaluation['cache_hit'] = False
+
+def evaluate_answer(question: str, expected_answer: str, actual_answer: str, 
+                    client_config: dict, show_api_details: bool = False, use_cache: bool = False):
+    """
+    Valuta una risposta utilizzando un LLM specificato tramite client_config.
+    Args:
+        question: La domanda.
+        expected_answer: La risposta attesa.
+        actual_answer: La risposta effettiva da valutare.
+        client_config: Dizionario contenente {api_key, endpoint, model, temperature, max_tokens}.
+        show_api_details: Se True, include i dettagli della richiesta/risposta API.
+        use_cache: Se True, riusa il giudizio già espresso sulla stessa terna dallo stesso
+            valutatore (modello, endpoint, temperatura, max_tokens) e salva in cache i nuovi giudizi.
+    Returns:
+        Un dizionario con il punteggio e la spiegazione, o un risultato di errore;
+        se use_cache è attivo include anche "cache_hit": True | False. Le valutazioni ottenute
+        da una chiamata riportano in "metrics" token, latenza, tentativi e costo stimato (vedi call_metrics).
+    """
+    cache_key = None
+    if use_cache:
+        cache_key = _evaluation_key_for(question, expected_answer, actual_answer, client_config)
+        cached_evaluation = _cached_evaluations([cache_key], show_api_details)[0]
+        if cached_evaluation:
+            return cached_evaluation
+
+    client = get_openai_client(api_key=client_config.get("api_key"), base_url=client_config.get("endpoint"))
+    if not client:
+        return {"score": 0, "explanation": "Errore: Client API per la valutazione non configurato.", "similarity": 0, "correctness": 0, "completeness": 0, "failed": True}
+
+    api_request_details = _build_evaluation_request(question, expected_answer, actual_answer, client_config)
+
     api_details_for_log = {}
     if show_api_details:
         # Copia i dettagli della richiesta per loggarli, escludendo dati sensibili se necessario
@@ -87,98 +322,545 @@ def evaluate_answer(question: str, expected_answer: str, actual_answer: str,
         api_details_for_log["request"] = api_request_details.copy()
 
     try:
-        response = client.chat.completions.create(**api_request_details)
+        timed_create = TimedCall(client.chat.completions.create)
+        response, retries = call_with_rate_limit(timed_create, api_request_details, client_config)
         content = response.choices[0].message.content or "{}"
         if show_api_details:
             api_details_for_log["response_content"] = content
+            api_details_for_log["retries"] = retries
+        evaluation = _parse_evaluation_content(content, api_details_for_log)
+        evaluation['metrics'] = call_metrics(api_request_details["model"], response.usage, timed_create.latency, retries)
+    except Exception as e:
+        evaluation = _evaluation_error_result(e, api_details_for_log)
+        content = None
+    if use_cache:
+        evaluation['cache_hit'] = False
+        # Solo i giudizi completi finiscono in cache: errori e JSON incompleti vengono ritentati
+        if content and _is_complete_evaluation_content(content):
+            _store_evaluations([(cache_key, evaluation)], api_request_details["model"])
+    return evaluation
 
-        try:
-            evaluation = json.loads(content)
-            required_keys = ['score', 'explanation', 'similarity', 'correctness', 'completeness']
-            if not all(key in evaluation for key in required_keys):
-                st.warning(f"Risposta JSON dalla valutazione LLM incompleta: {content}. Verranno usati valori di default.")
-                for key in required_keys:
-                    if key not in evaluation:
-                        evaluation[key] = 0 if key != 'explanation' else "Valutazione incompleta o formato JSON non corretto."
-            
-            evaluation['api_details'] = api_details_for_log
-            return evaluation
-        except json.JSONDecodeError:
-            st.error(f"Errore: Impossibile decodificare la risposta JSON dalla valutazione LLM: {content}")
-            return {
-                "score": 0, "explanation": f"Errore di decodifica JSON: {content[:100]}...", 
-                "similarity": 0, "correctness": 0, "completeness": 0,
-                "api_details": api_details_for_log
-            }
-
-    except (APIConnectionError, RateLimitError, APIStatusError) as e:
-        st.error(f"Errore API durante la valutazione: {type(e).__name__} - {e}")
-        api_details_for_log["error"] = str(e)
-        return {
-            "score": 0, "explanation": f"Errore API: {type(e).__name__}", 
-            "similarity": 0, "correctness": 0, "completeness": 0,
-            "api_details": api_details_for_log
-        }
+async def evaluate_answer_async(question: str, expected_answer: str, actual_answer: str,
+                                client_config: dict, show_api_details: bool = False, client=None,
+                                use_cache: bool = False):
+    """
+    Versione asincrona di evaluate_answer, usata dal motore di esecuzione concorrente.
+    Args:
+        question: La domanda.
+        expected_answer: La risposta attesa.
+        actual_answer: La risposta effettiva da valutare.
+        client_config: Dizionario contenente {api_key, endpoint, model, temperature, max_tokens}.
+        show_api_details: Se True, include i dettagli della richiesta/risposta API.
+        client: Client AsyncOpenAI da riutilizzare (opzionale, altrimenti ne viene creato uno).
+        use_cache: Se True, usa la cache dei giudizi (vedi evaluate_answer).
+    Returns:
+        Un dizionario con il punteggio e la spiegazione, o un risultato di errore;
+        se use_cache è attivo include anche "cache_hit": True | False.
+    """
+    cache_key = None
+    if use_cache:
+        cache_key = _evaluation_key_for(question, expected_answer, actual_answer, client_config)
+        # Le letture dal database avvengono in un thread per non bloccare l'event loop
+        cached_evaluation = (await asyncio.to_thread(_cached_evaluations, [cache_key], show_api_details))[0]
+        if cached_evaluation:
+            return cached_evaluation
+
+    if client is None:
+        client = get_async_openai_client(api_key=client_config.get("api_key"), base_url=client_config.get("endpoint"))
+    if not client:
+        return {"score": 0, "explanation": "Errore: Client API per la valutazione non configurato.", "similarity": 0, "correctness": 0, "completeness": 0, "failed": True}
+
+    api_request_details = _build_evaluation_request(question, expected_answer, actual_answer, client_config)
+
+    api_details_for_log = {}
+    if show_api_details:
+        api_details_for_log["request"] = api_request_details.copy()
+
+    try:
+        timed_create = TimedCallAsync(client.chat.completions.create)
+        response, retries = await call_with_rate_limit_async(timed_create, api_request_details, client_config)
+        content = response.choices[0].message.content or "{}"
+        if show_api_details:
+            api_details_for_log["response_content"] = content
+            api_details_for_log["retries"] = retries
+        evaluation = _parse_evaluation_content(content, api_details_for_log)
+        evaluation['metrics'] = call_metrics(api_request_details["model"], response.usage, timed_create.latency, retries)
     except Exception as e:
-        st.error(f"Errore imprevisto durante la valutazione: {type(e).__name__} - {e}")
-        # print(f"DEBUG: Unexpected Error in evaluate_answer: {traceback.format_exc()}")
+        evaluation = _evaluation_error_result(e, api_details_for_log)
+        content = None
+    if use_cache:
+        evaluation['cache_hit'] = False
+        if content and _is_complete_evaluation_content(content):
+            await asyncio.to_thread(_store_evaluations, [(cache_key, evaluation)], api_request_details["model"])
+    return evaluation
+
+def _build_batch_evaluation_request(items: list, client_config: dict):
+    """
+    Costruisce una singola chiamata chat completion che valuta più risposte insieme.
+    Le istruzioni di valutazione vengono inviate una sola volta per tutto il gruppo.
+    """
+    items_payload = json.dumps([
+        {
+            "item_id": str(item["item_id"]),
+            "domanda": item["question"],
+            "risposta_attesa": item["expected_answer"],
+            "risposta_effettiva": item["actual_answer"]
+        }
+        for item in items
+    ], ensure_ascii=False, indent=1)
+
+    prompt = f"""
+        Sei un valutatore esperto che valuta la qualità delle risposte alle domande.
+        Di seguito trovi un array JSON di elementi, ognuno con item_id, domanda, risposta attesa e risposta effettiva.
+
+        Per OGNI elemento valuta la risposta effettiva rispetto alla risposta attesa in base a:
+        1. Somiglianza (0-100): Quanto è semanticamente simile la risposta effettiva a quella attesa?
+        2. Correttezza (0-100): Le informazioni nella risposta effettiva sono fattualmente corrette?
+        3. Completezza (0-100): La risposta effettiva contiene tutti i punti chiave della risposta attesa?
+        Calcola un punteggio complessivo (0-100) basato su queste metriche.
+        Fornisci una breve spiegazione della tua valutazione (max 100 parole).
+        Valuta ogni elemento in modo indipendente dagli altri.
+        Formatta la tua risposta come un oggetto JSON con un unico campo "evaluations": un array con un oggetto
+        per ogni elemento, nello stesso ordine, con questi campi:
+        - item_id: l'item_id dell'elemento valutato (stringa)
+        - score: il punteggio complessivo (numero)
+        - explanation: la tua spiegazione (stringa)
+        - similarity: punteggio di somiglianza (numero)
+        - correctness: punteggio di correttezza (numero)
+        - completeness: punteggio di completezza (numero)
+
+        Elementi da valutare:
+        {items_payload}
+    """
+
+    return {
+        "model": client_config.get("model", DEFAULT_MODEL),
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": client_config.get("temperature", 0.0),
+        "max_tokens": max(int(client_config.get("max_tokens", 250)), BATCH_EVALUATION_TOKENS_PER_ITEM * len(items)),
+        "response_format": {"type": "json_object"}
+    }
+
+def _parse_batch_evaluation_content(content: str, item_ids: list):
+    """
+    Divide la risposta di una valutazione a gruppi nei dizionari di valutazione dei singoli elementi.
+    Returns:
+        Un dizionario {item_id: valutazione} con i soli elementi presenti e completi nella risposta.
+    """
+    try:
+        parsed = json.loads(content)
+    except json.JSONDecodeError:
+        return {}
+    if isinstance(parsed, dict):
+        parsed = parsed.get("evaluations", [])
+    if not isinstance(parsed, list):
+        return {}
+
+    required_keys = ['score', 'explanation', 'similarity', 'correctness', 'completeness']
+    expected_ids = {str(item_id) for item_id in item_ids}
+    evaluations = {}
+    for entry in parsed:
+        if not isinstance(entry, dict):
+            continue
+        item_id = str(entry.get("item_id", ""))
+        if item_id not in expected_ids or item_id in evaluations:
+            continue
+        if not all(key in entry for key in required_keys):
+            continue
+        evaluations[item_id] = {key: entry[key] for key in required_keys}
+    return evaluations
+
+def _merge_batch_evaluations(items: list, batch_evaluations: dict, api_details_for_log: dict, metrics: dict = None):
+    """
+    Associa a ogni elemento la sua valutazione a gruppi; gli elementi mancanti restano None.
+    Token e costo della chiamata (metrics) vengono ripartiti tra tutti gli elementi del gruppo.
+    """
+    merged = []
+    for item in items:
+        evaluation = batch_evaluations.get(str(item["item_id"]))
+        if evaluation is not None:
+            evaluation['api_details'] = dict(api_details_for_log, batch_size=len(items)) if api_details_for_log else {}
+            if metrics:
+                evaluation['metrics'] = split_call_metrics(metrics, len(items))
+        merged.append(evaluation)
+    return merged
+
+def evaluate_answers_batch(items: list, client_config: dict, show_api_details: bool = False,
+                           use_cache: bool = False):
+    """
+    Valuta più risposte con un'unica chiamata al LLM valutatore.
+    Args:
+        items: Lista di dizionari {item_id, question, expected_answer, actual_answer}.
+        client_config: Dizionario contenente {api_key, endpoint, model, temperature, max_tokens}.
+        show_api_details: Se True, include i dettagli della richiesta/risposta API.
+        use_cache: Se True, gli elementi già giudicati vengono presi dalla cache dei giudizi
+            e solo i restanti vengono inviati al valutatore (vedi evaluate_answer).
+    Returns:
+        Una lista di valutazioni (stesso formato di evaluate_answer) nello stesso ordine di items.
+        Gli elementi assenti o non validi nella risposta a gruppi vengono rivalutati singolarmente.
+    """
+    if len(items) == 1:
+        item = items[0]
+        return [evaluate_answer(item["question"], item["expected_answer"], item["actual_answer"],
+                                client_config=client_config, show_api_details=show_api_details,
+                                use_cache=use_cache)]
+
+    evaluations = [None] * len(items)
+    cache_keys = []
+    if use_cache:
+        cache_keys = [_evaluation_key_for(item["question"], item["expected_answer"], item["actual_answer"], client_config)
+                      for item in items]
+        evaluations = _cached_evaluations(cache_keys, show_api_details)
+    pending = [i for i, evaluation in enumerate(evaluations) if evaluation is None]
+
+    if len(pending) > 1:
+        pending_items = [items[i] for i in pending]
+        client = get_openai_client(api_key=client_config.get("api_key"), base_url=client_config.get("endpoint"))
+        api_request_details = _build_batch_evaluation_request(pending_items, client_config)
+        api_details_for_log = {"request": api_request_details.copy()} if show_api_details else {}
+
+        batch_evaluations = {}
+        batch_metrics = None
+        if client:
+            try:
+                timed_create = TimedCall(client.chat.completions.create)
+                response, retries = call_with_rate_limit(timed_create, api_request_details, client_config)
+                content = response.choices[0].message.content or "{}"
+                if show_api_details:
+                    api_details_for_log["response_content"] = content
+                    api_details_for_log["retries"] = retries
+                batch_metrics = call_metrics(api_request_details["model"], response.usage, timed_create.latency, retries)
+                batch_evaluations = _parse_batch_evaluation_content(content, [item["item_id"] for item in pending_items])
+            except Exception as e:
+                logger.warning(f"Valutazione a gruppi fallita, si procede con valutazioni singole: {type(e).__name__} - {e}")
+
+        merged = _merge_batch_evaluations(pending_items, batch_evaluations, api_details_for_log, batch_metrics)
+        for i, evaluation in zip(pending, merged):
+            evaluations[i] = evaluation
+        if use_cache:
+            _store_evaluations([(cache_keys[i], evaluations[i]) for i in pending if evaluations[i] is not None],
+                               api_request_details["model"])
+
+    for i in pending:
+        if evaluations[i] is None:
+            item = items[i]
+            evaluations[i] = evaluate_answer(item["question"], item["expected_answer"], item["actual_answer"],
+                                             client_config=client_config, show_api_details=show_api_details,
+                                             use_cache=use_cache)
+    return evaluations
+
+async def evaluate_answers_batch_async(items: list, client_config: dict, show_api_details: bool = False, client=None,
+                                       use_cache: bool = False):
+    """
+    Versione asincrona di evaluate_answers_batch, usata dal motore di esecuzione concorrente.
+    Gli elementi mancanti nella risposta a gruppi vengono rivalutati singolarmente in parallelo.
+    """
+    if client is None:
+        client = get_async_openai_client(api_key=client_config.get("api_key"), base_url=client_config.get("endpoint"))
+
+    if len(items) == 1:
+        item = items[0]
+        return [await evaluate_answer_async(item["question"], item["expected_answer"], item["actual_answer"],
+                                            client_config=client_config, show_api_details=show_api_details,
+                                            client=client, use_cache=use_cache)]
+
+    evaluations = [None] * len(items)
+    cache_keys = []
+    if use_cache:
+        cache_keys = [_evaluation_key_for(item["question"], item["expected_answer"], item["actual_answer"], client_config)
+                      for item in items]
+        evaluations = await asyncio.to_thread(_cached_evaluations, cache_keys, show_api_details)
+    pending = [i for i, evaluation in enumerate(evaluations) if evaluation is None]
+
+    if len(pending) > 1:
+        pending_items = [items[i] for i in pending]
+        api_request_details = _build_batch_evaluation_request(pending_items, client_config)
+        api_details_for_log = {"request": api_request_details.copy()} if show_api_details else {}
+
+        batch_evaluations = {}
+        batch_metrics = None
+        if client:
+            try:
+                timed_create = TimedCallAsync(client.chat.completions.create)
+                response, retries = await call_with_rate_limit_async(timed_create, api_request_details, client_config)
+                content = response.choices[0].message.content or "{}"
+                if show_api_details:
+                    api_details_for_log["response_content"] = content
+                    api_details_for_log["retries"] = retries
+                batch_metrics = call_metrics(api_request_details["model"], response.usage, timed_create.latency, retries)
+                batch_evaluations = _parse_batch_evaluation_content(content, [item["item_id"] for item in pending_items])
+            except Exception as e:
+                logger.warning(f"Valutazione a gruppi fallita, si procede con valutazioni singole: {type(e).__name__} - {e}")
+
+        merged = _merge_batch_evaluations(pending_items, batch_evaluations, api_details_for_log, batch_metrics)
+        for i, evaluation in zip(pending, merged):
+            evaluations[i] = evaluation
+        if use_cache:
+            await asyncio.to_thread(
+                _store_evaluations,
+                [(cache_keys[i], evaluations[i]) for i in pending if evaluations[i] is not None],
+                api_request_details["model"]
+            )
+
+    missing = [i for i in pending if evaluations[i] is None]
+    if missing:
+        fallbacks = await asyncio.gather(*[
+            evaluate_answer_async(items[i]["question"], items[i]["expected_answer"], items[i]["actual_answer"],
+                                  client_config=client_config, show_api_details=show_api_details, client=client,
+                                  use_cache=use_cache)
+            for i in missing
+        ])
+        for i, evaluation in zip(missing, fallbacks):
+            evaluations[i] = evaluation
+    return evaluations
+
+def _build_generation_request(question: str, client_config: dict):
+    """Costruisce i parametri della chiamata chat completion usata per generare una risposta."""
+    prompt = f"Rispondi alla seguente domanda in modo conciso e accurato: {question}"
+
+    return {
+        "model": client_config.get("model", DEFAULT_MODEL),
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": client_config.get("temperature", 0.7),
+        "max_tokens": client_config.get("max_tokens", 500)
+    }
+
+def _parse_generation_response(response, show_api_details: bool, api_details_for_log: dict, metrics: dict = None):
+    """Estrae la risposta generata da una chat completion, con la telemetria della chiamata."""
+    answer = response.choices[0].message.content.strip() if response.choices and response.choices[0].message.content else None
+    if show_api_details:
+        api_details_for_log["response_content"] = response.choices[0].message.content if response.choices else "Nessun contenuto"
+    return {"answer": answer, "api_details": api_details_for_log if show_api_details else None, "metrics": metrics}
+
+def _generation_error_result(e: Exception, show_api_details: bool, api_details_for_log: dict):
+    """Restituisce il risultato di generazione vuoto per un errore della chiamata API."""
+    if isinstance(e, (APIConnectionError, RateLimitError, APIStatusError)):
+        notify_error(f"Errore API durante la generazione della risposta di esempio: {type(e).__name__} - {e}")
+    else:
+        notify_error(f"Errore imprevisto durante la generazione della risposta: {type(e).__name__} - {e}")
+    if show_api_details:
         api_details_for_log["error"] = str(e)
+    return {"answer": None, "api_details": api_details_for_log if show_api_details else None}
+
+def _validate_generation_input(question, show_api_details: bool):
+    """Restituisce un risultato di errore se la domanda è vuota o non valida, altrimenti None."""
+    if question is None or not isinstance(question, str) or question.strip() == "":
+        notify_error("La domanda fornita è vuota o non valida.")
+        return {"answer": None, "api_details": {"error": "Domanda vuota o non valida"} if show_api_details else None}
+    return None
+
+def _cached_generation_result(cache_key: str, show_api_details: bool, api_details_for_log: dict):
+    """Restituisce il risultato di generazione memorizzato in cache per cache_key, o None."""
+    cached_answer = generation_cache.get(cache_key)
+    if cached_answer is None:
+        return None
+    if show_api_details:
+        api_details_for_log["response_content"] = cached_answer
+        api_details_for_log["cache_hit"] = True
+    return {"answer": cached_answer, "api_details": api_details_for_log if show_api_details else None, "cache_hit": True}
+
+def _store_generation_result(cache_key: str, result: dict, model: str):
+    """Salva in cache una risposta generata con successo e la marca come non proveniente dalla cache."""
+    if result["answer"] is not None:
+        generation_cache.put(cache_key, result["answer"], model=model)
+    result["cache_hit"] = False
+    return result
+
+class _StreamedCompletion:
+    """Risposta ricostruita da una chat completion in streaming, con i tempi misurati durante la ricezione."""
+
+    def __init__(self, started: float):
+        self.started = started
+        self.parts = []
+        self.usage = None
+        self.time_to_first_token = None
+        self.latency = None
+
+    def add_chunk(self, chunk):
+        if getattr(chunk, "usage", None):
+            self.usage = chunk.usage
+        if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+            if self.time_to_first_token is None:
+                self.time_to_first_token = time.perf_counter() - self.started
+            self.parts.append(chunk.choices[0].delta.content)
+
+    def finish(self):
+        self.latency = time.perf_counter() - self.started
+        return self
+
+    @property
+    def content(self):
+        return "".join(self.parts)
+
+    def metrics(self):
+        """
+        Tempi della generazione: time_to_first_token e latency in secondi, output_tokens dall'uso
+        riportato dall'API e tokens_per_second calcolato sul tempo successivo al primo token.
+        """
+        output_tokens = getattr(self.usage, "completion_tokens", None) if self.usage else None
+        decode_time = self.latency - (self.time_to_first_token or 0.0)
+        tokens_per_second = output_tokens / decode_time if output_tokens and decode_time > 0 else None
         return {
-            "score": 0, "explanation": f"Errore imprevisto: {type(e).__name__}",
-            "similarity": 0, "correctness": 0, "completeness": 0,
-            "api_details": api_details_for_log
+            "time_to_first_token": round(self.time_to_first_token, 4) if self.time_to_first_token is not None else None,
+            "latency": round(self.latency, 4),
+            "output_tokens": output_tokens,
+            "tokens_per_second": round(tokens_per_second, 2) if tokens_per_second is not None else None
         }
 
-def generate_example_answer_with_llm(question: str, client_config: dict, show_api_details: bool = False):
+def _streaming_request(api_request_details: dict):
+    """Parametri della chiamata di generazione in streaming, con l'uso dei token nell'ultimo chunk."""
+    return dict(api_request_details, stream=True, stream_options={"include_usage": True})
+
+def _streaming_create(client):
+    """Funzione create che consuma lo stream: lo slot di concorrenza resta occupato fino all'ultimo chunk."""
+    def create(**request):
+        streamed = _StreamedCompletion(time.perf_counter())
+        for chunk in client.chat.completions.create(**request):
+            streamed.add_chunk(chunk)
+        return streamed.finish()
+    return create
+
+def _streaming_create_async(client):
+    """Versione asincrona di _streaming_create."""
+    async def create(**request):
+        streamed = _StreamedCompletion(time.perf_counter())
+        async for chunk in await client.chat.completions.create(**request):
+            streamed.add_chunk(chunk)
+        return streamed.finish()
+    return create
+
+def _streamed_generation_result(streamed: _StreamedCompletion, show_api_details: bool, api_details_for_log: dict,
+                                model: str, retries: int):
+    """Converte una risposta in streaming nel risultato di generazione, con telemetria e metriche di latenza."""
+    content = streamed.content
+    if show_api_details:
+        api_details_for_log["response_content"] = content or "Nessun contenuto"
+    return {
+        "answer": content.strip() if content and content.strip() else None,
+        "api_details": api_details_for_log if show_api_details else None,
+        "metrics": dict(call_metrics(model, streamed.usage, streamed.latency, retries), **streamed.metrics())
+    }
+
+def generate_example_answer_with_llm(question: str, client_config: dict, show_api_details: bool = False,
+                                     use_cache: bool = False, stream: bool = False):
     """
     Genera una risposta di esempio per una domanda utilizzando un LLM.
     Args:
         question: La domanda per cui generare una risposta.
         client_config: Dizionario contenente {api_key, endpoint, model, temperature, max_tokens}.
         show_api_details: Se True, include i dettagli della chiamata API nel risultato.
+        use_cache: Se True, riusa una risposta già generata con gli stessi modello, endpoint,
+            prompt, temperatura e max_tokens, e salva in cache le nuove risposte.
+        stream: Se True, riceve la risposta in streaming e misura time-to-first-token,
+            latenza totale e token di output al secondo.
     Returns:
-        Un dizionario con { "answer": "risposta generata" | None, "api_details": {...} | None }.
+        Un dizionario con { "answer": "risposta generata" | None, "api_details": {...} | None },
+        "cache_hit": True | False se use_cache è attivo e, se la risposta viene da una chiamata,
+        "metrics": {...} con token, latenza, tentativi e costo stimato (vedi call_metrics),
+        più time_to_first_token e tokens_per_second se stream è attivo.
     """
     client = get_openai_client(api_key=client_config.get("api_key"), base_url=client_config.get("endpoint"))
     if not client:
-        st.error("Client API per la generazione risposte non configurato.")
+        notify_error("Client API per la generazione risposte non configurato.")
         return {"answer": None, "api_details": {"error": "Client API non configurato"} if show_api_details else None}
 
     # Controllo se la domanda è None o una stringa vuota
-    if question is None or not isinstance(question, str) or question.strip() == "":
-        st.error("La domanda fornita è vuota o non valida.")
-        return {"answer": None, "api_details": {"error": "Domanda vuota o non valida"} if show_api_details else None}
+    invalid_result = _validate_generation_input(question, show_api_details)
+    if invalid_result:
+        return invalid_result
+
+    api_request_details = _build_generation_request(question, client_config)
 
-    prompt = f"Rispondi alla seguente domanda in modo conciso e accurato: {question}"
-    
-    api_request_details = {
-        "model": client_config.get("model", DEFAULT_MODEL),
-        "messages": [{"role": "user", "content": prompt}],
-        "temperature": client_config.get("temperature", 0.7),
-        "max_tokens": client_config.get("max_tokens", 500) 
-    }
-    
     api_details_for_log = {}
     if show_api_details:
         api_details_for_log["request"] = api_request_details.copy()
 
+    cache_key = None
+    if use_cache:
+        cache_key = generation_cache_key(api_request_details, _effective_base_url(client_config.get("endpoint")))
+        cached_result = _cached_generation_result(cache_key, show_api_details, api_details_for_log)
+        if cached_result:
+            return cached_result
+
     try:
-        response = client.chat.completions.create(**api_request_details)
-        answer = response.choices[0].message.content.strip() if response.choices and response.choices[0].message.content else None
-        if show_api_details:
-            api_details_for_log["response_content"] = response.choices[0].message.content if response.choices else "Nessun contenuto"
-        return {"answer": answer, "api_details": api_details_for_log if show_api_details else None}
-    
-    except (APIConnectionError, RateLimitError, APIStatusError) as e:
-        st.error(f"Errore API durante la generazione della risposta di esempio: {type(e).__name__} - {e}")
+        if stream:
+            streamed, retries = call_with_rate_limit(_streaming_create(client), _streaming_request(api_request_details), client_config)
+        else:
+            timed_create = TimedCall(client.chat.completions.create)
+            response, retries = call_with_rate_limit(timed_create, api_request_details, client_config)
         if show_api_details:
-            api_details_for_log["error"] = str(e)
-        return {"answer": None, "api_details": api_details_for_log if show_api_details else None}
+            api_details_for_log["retries"] = retries
+        if stream:
+            result = _streamed_generation_result(streamed, show_api_details, api_details_for_log,
+                                                 api_request_details["model"], retries)
+        else:
+            metrics = call_metrics(api_request_details["model"], response.usage, timed_create.latency, retries)
+            result = _parse_generation_response(response, show_api_details, api_details_for_log, metrics)
     except Exception as e:
-        st.error(f"Errore imprevisto durante la generazione della risposta: {type(e).__name__} - {e}")
+        result = _generation_error_result(e, show_api_details, api_details_for_log)
+    if use_cache:
+        _store_generation_result(cache_key, result, api_request_details["model"])
+    return result
+
+async def generate_example_answer_with_llm_async(question: str, client_config: dict,
+                                                 show_api_details: bool = False, client=None,
+                                                 use_cache: bool = False, stream: bool = False):
+    """
+    Versione asincrona di generate_example_answer_with_llm, usata dal motore di esecuzione concorrente.
+    Args:
+        question: La domanda per cui generare una risposta.
+        client_config: Dizionario contenente {api_key, endpoint, model, temperature, max_tokens}.
+        show_api_details: Se True, include i dettagli della chiamata API nel risultato.
+        client: Client AsyncOpenAI da riutilizzare (opzionale, altrimenti ne viene creato uno).
+        use_cache: Se True, usa la cache delle risposte generate (vedi generate_example_answer_with_llm).
+        stream: Se True, riceve la risposta in streaming e ne misura i tempi (vedi generate_example_answer_with_llm).
+    Returns:
+        Un dizionario con { "answer": "risposta generata" | None, "api_details": {...} | None },
+        "cache_hit": True | False se use_cache è attivo e "metrics": {...} (vedi generate_example_answer_with_llm).
+    """
+    if client is None:
+        client = get_async_openai_client(api_key=client_config.get("api_key"), base_url=client_config.get("endpoint"))
+    if not client:
+        notify_error("Client API per la generazione risposte non configurato.")
+        return {"answer": None, "api_details": {"error": "Client API non configurato"} if show_api_details else None}
+
+    invalid_result = _validate_generation_input(question, show_api_details)
+    if invalid_result:
+        return invalid_result
+
+    api_request_details = _build_generation_request(question, client_config)
+
+    api_details_for_log = {}
+    if show_api_details:
+        api_details_for_log["request"] = api_request_details.copy()
+
+    cache_key = None
+    if use_cache:
+        cache_key = generation_cache_key(api_request_details, _effective_base_url(client_config.get("endpoint")))
+        # Le letture dal database avvengono in un thread per non bloccare l'event loop
+        cached_result = await asyncio.to_thread(_cached_generation_result, cache_key, show_api_details, api_details_for_log)
+        if cached_result:
+            return cached_result
+
+    try:
+        if stream:
+            streamed, retries = await call_with_rate_limit_async(_streaming_create_async(client), _streaming_request(api_request_details), client_config)
+        else:
+            timed_create = TimedCallAsync(client.chat.completions.create)
+            response, retries = await call_with_rate_limit_async(timed_create, api_request_details, client_config)
         if show_api_details:
-            api_details_for_log["error"] = str(e)
-        return {"answer": None, "api_details": api_details_for_log if show_api_details else None}
+            api_details_for_log["retries"] = retries
+        if stream:
+            result = _streamed_generation_result(streamed, show_api_details, api_details_for_log,
+                                                 api_request_details["model"], retries)
+        else:
+            metrics = call_metrics(api_request_details["model"], response.usage, timed_create.latency, retries)
+            result = _parse_generation_response(response, show_api_details, api_details_for_log, metrics)
+    except Exception as e:
+        result = _generation_error_result(e, show_api_details, api_details_for_log)
+    if use_cache:
+        await asyncio.to_thread(_store_generation_result, cache_key, result, api_request_details["model"])
+    return result
 
 def test_api_connection(api_key: str, endpoint: str, model: str, temperature: float, max_tokens: int):
     """Testa la connessione all'API LLM con i parametri forniti."""
@@ -187,7 +869,7 @@ def test_api_connection(api_key: str, endpoint: str, model: str, temperature: fl
         return False, "Client API non inizializzato. Controlla chiave API e endpoint."
 
     try:
-        response = client.chat.completions.create(
+        response = client.with_options(max_retries=SDK_MAX_RETRIES).chat.completions.create(
             model=model,
             messages=[{"role": "user", "content": "Test connessione. Rispondi solo con: 'Connessione riuscita.'"}],
             temperature=temperature,
@@ -234,7 +916,7 @@ def get_available_models_for_endpoint(provider_name: str, endpoint_url: str = No
         if not client:
             return ["(Errore creazione client API)", DEFAULT_MODEL]
         try:
-            models = client.models.list()
+            models = client.with_options(max_retries=SDK_MAX_RETRIES).models.list()
             # Filtra per modelli che non sono di embedding
             filtered_models = sorted([
                 model.id for model in models 
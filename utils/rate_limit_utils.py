@@ -0,0 +1,336 @@
+import asyncio
+import multiprocessing
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from multiprocessing.managers import BaseManager
+
+from openai import APIConnectionError, APIStatusError, RateLimitError
+
+# Tentativi massimi per una chiamata che riceve 429/5xx o un errore di connessione
+MAX_RETRIES = 6
+# Attesa base e massima (secondi) del backoff esponenziale con jitter
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+# Intervallo (secondi) con cui un worker asincrono ricontrolla uno slot di concorrenza occupato
+CONCURRENCY_POLL_INTERVAL = 0.05
+
+
+class TokenBucket:
+    """
+    Token bucket thread-safe: si ricarica di rate_per_minute token al minuto fino a capacity.
+    Le prenotazioni possono portare il saldo in negativo: chi arriva dopo attende di più,
+    così le richieste vengono servite in ordine senza superare il ritmo configurato.
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.capacity = float(rate_per_minute)
+        self.rate = float(rate_per_minute) / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float):
+        """Prenota amount token e restituisce i secondi da attendere prima di poterli usare."""
+        amount = min(float(amount), self.capacity)
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self, amount: float):
+        """Restituisce (o addebita, se negativo) token dopo aver conosciuto il consumo effettivo."""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + float(amount))
+
+
+class PresetRateLimiter:
+    """
+    Stato dei limiti di un preset API: richieste al minuto, token al minuto e chiamate concorrenti.
+    Le attese vengono calcolate qui ma eseguite da chi chiama (vedi PresetLimiterHandle).
+    """
+
+    def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0, max_concurrency: int = 0):
+        self.limits = None
+        self.blocked_until = 0.0
+        self.active = 0
+        self.lock = threading.Lock()
+        self.configure(requests_per_minute, tokens_per_minute, max_concurrency)
+
+    def configure(self, requests_per_minute: int = 0, tokens_per_minute: int = 0, max_concurrency: int = 0):
+        """Aggiorna i limiti; i bucket vengono ricreati solo se i valori sono cambiati."""
+        limits = (int(requests_per_minute or 0), int(tokens_per_minute or 0), int(max_concurrency or 0))
+        if limits == self.limits:
+            return
+        self.limits = limits
+        self.request_bucket = TokenBucket(limits[0]) if limits[0] > 0 else None
+        self.token_bucket = TokenBucket(limits[1]) if limits[1] > 0 else None
+        self.max_concurrency = limits[2]
+
+    def reserve(self, estimated_tokens: int):
+        """Prenota richiesta e token; restituisce l'attesa necessaria in secondi."""
+        wait = max(0.0, self.blocked_until - time.monotonic())
+        if self.request_bucket:
+            wait = max(wait, self.request_bucket.reserve(1))
+        if self.token_bucket and estimated_tokens:
+            wait = max(wait, self.token_bucket.reserve(estimated_tokens))
+        return wait
+
+    def try_enter(self):
+        with self.lock:
+            if self.max_concurrency and self.active >= self.max_concurrency:
+                return False
+            self.active += 1
+            return True
+
+    def release(self, estimated_tokens: int = 0, used_tokens: int = None):
+        """Libera lo slot di concorrenza e corregge il bucket dei token con il consumo effettivo."""
+        with self.lock:
+            self.active = max(0, self.active - 1)
+        if self.token_bucket and used_tokens is not None:
+            self.token_bucket.refund(estimated_tokens - used_tokens)
+
+    def block_for(self, seconds: float):
+        """Sospende tutte le chiamate del preset (es. dopo un 429 con Retry-After)."""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class RateLimitRegistry:
+    """
+    Limitatori dei preset API per chiave di preset. Un processo usa il proprio registro, a meno che
+    non ne sia installato uno condiviso tra processi (vedi start_shared_rate_limits): in quel caso
+    ogni metodo è una chiamata al processo che lo ospita.
+    """
+
+    def __init__(self):
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+    def _limiter(self, key, limits=None):
+        with self.lock:
+            limiter = self.limiters.get(key)
+            if limiter is None:
+                limiter = PresetRateLimiter(*(limits or ()))
+                self.limiters[key] = limiter
+            elif limits is not None:
+                limiter.configure(*limits)
+            return limiter
+
+    def reserve(self, key, limits, estimated_tokens: int):
+        return self._limiter(key, limits).reserve(estimated_tokens)
+
+    def try_enter(self, key):
+        return self._limiter(key).try_enter()
+
+    def release(self, key, estimated_tokens: int = 0, used_tokens: int = None):
+        self._limiter(key).release(estimated_tokens, used_tokens)
+
+    def block_for(self, key, seconds: float):
+        self._limiter(key).block_for(seconds)
+
+
+class RateLimitManager(BaseManager):
+    pass
+
+
+RateLimitManager.register("RateLimitRegistry", RateLimitRegistry)
+
+
+class PresetLimiterHandle:
+    """Limiti di un preset visti da un processo: prenota nel registro e attende localmente."""
+
+    def __init__(self, registry, key, limits):
+        self.registry = registry
+        self.key = key
+        self.limits = limits
+
+    def acquire(self, estimated_tokens: int = 0):
+        """Attende (bloccando il thread) finché la chiamata non rientra nei limiti del preset."""
+        wait = self.registry.reserve(self.key, self.limits, estimated_tokens)
+        if wait > 0:
+            time.sleep(wait)
+        while not self.registry.try_enter(self.key):
+            time.sleep(CONCURRENCY_POLL_INTERVAL)
+
+    async def acquire_async(self, estimated_tokens: int = 0):
+        """
+        Come acquire, ma attende senza bloccare l'event loop: le chiamate al registro condiviso
+        passano dal processo che lo ospita e vengono eseguite in un thread.
+        """
+        wait = await asyncio.to_thread(self.registry.reserve, self.key, self.limits, estimated_tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        while not await asyncio.to_thread(self.registry.try_enter, self.key):
+            await asyncio.sleep(CONCURRENCY_POLL_INTERVAL)
+
+    def release(self, estimated_tokens: int = 0, used_tokens: int = None):
+        self.registry.release(self.key, estimated_tokens, used_tokens)
+
+    async def release_async(self, estimated_tokens: int = 0, used_tokens: int = None):
+        await asyncio.to_thread(self.release, estimated_tokens, used_tokens)
+
+    def block_for(self, seconds: float):
+        self.registry.block_for(self.key, seconds)
+
+    async def block_for_async(self, seconds: float):
+        await asyncio.to_thread(self.block_for, seconds)
+
+
+_registry = RateLimitRegistry()
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def use_shared_rate_limits(registry):
+    """
+    Installa nel processo corrente un registro dei limiti condiviso (proxy restituito da
+    start_shared_rate_limits); usato anche come initializer dei processi del pool in background.
+    """
+    global _registry
+    _registry = registry
+
+
+def start_shared_rate_limits():
+    """
+    Avvia (una sola volta) il processo che ospita il registro dei limiti condiviso e lo installa
+    nel processo corrente, così le esecuzioni in primo piano e quelle nei processi del pool
+    rispettano insieme le richieste e i token al minuto di ogni preset.
+    Returns:
+        Il proxy del registro, da passare a use_shared_rate_limits negli altri processi.
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            # "spawn" evita di duplicare con fork i thread del server Streamlit
+            _manager = RateLimitManager(ctx=multiprocessing.get_context("spawn"))
+            _manager.start()
+            use_shared_rate_limits(_manager.RateLimitRegistry())
+        return _registry
+
+
+def get_rate_limiter(client_config: dict):
+    """Restituisce il limitatore del preset descritto da client_config, condiviso da tutte le sue esecuzioni."""
+    key = client_config.get("id") or (client_config.get("api_key"), client_config.get("endpoint"), client_config.get("model"))
+    limits = (
+        int(client_config.get("requests_per_minute") or 0),
+        int(client_config.get("tokens_per_minute") or 0),
+        int(client_config.get("max_concurrency") or 0)
+    )
+    return PresetLimiterHandle(_registry, key, limits)
+
+
+def estimate_request_tokens(request: dict):
+    """
+    Stima approssimativa (circa 4 caratteri per token) dei token consumati da una chat completion
+    o da una richiesta di embedding.
+    """
+    prompt_chars = sum(len(str(message.get("content", ""))) for message in request.get("messages", []))
+    inputs = request.get("input", [])
+    prompt_chars += sum(len(str(item)) for item in ([inputs] if isinstance(inputs, str) else inputs))
+    return prompt_chars // 4 + int(request.get("max_tokens") or 0)
+
+
+def _usage_tokens(response):
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage else None
+
+
+def _is_retryable(e: Exception):
+    if isinstance(e, (RateLimitError, APIConnectionError)):
+        return True
+    return isinstance(e, APIStatusError) and (e.status_code == 429 or e.status_code >= 500)
+
+
+def _retry_after_seconds(e: Exception):
+    """Legge l'attesa suggerita dal server (retry-after-ms o Retry-After in secondi o come data HTTP)."""
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def _retry_delay(e: Exception, attempt: int):
+    """Backoff esponenziale con jitter completo, che rispetta Retry-After se presente."""
+    backoff = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+    retry_after = _retry_after_seconds(e)
+    if retry_after is not None:
+        return min(RETRY_MAX_DELAY, retry_after) + random.uniform(0, RETRY_BASE_DELAY)
+    return backoff
+
+
+def call_with_rate_limit(create_fn, request: dict, client_config: dict):
+    """
+    Esegue create_fn(**request) rispettando i limiti del preset e ritentando 429/5xx.
+    Returns:
+        Una tupla (risposta, numero di tentativi ripetuti).
+    Raises:
+        L'ultima eccezione se la chiamata fallisce anche dopo MAX_RETRIES tentativi.
+    """
+    limiter = get_rate_limiter(client_config)
+    estimated_tokens = estimate_request_tokens(request)
+    attempt = 0
+    while True:
+        limiter.acquire(estimated_tokens)
+        used_tokens = None
+        try:
+            response = create_fn(**request)
+            used_tokens = _usage_tokens(response)
+            return response, attempt
+        except Exception as e:
+            if not _is_retryable(e) or attempt >= MAX_RETRIES:
+                raise
+            delay = _retry_delay(e, attempt)
+            if isinstance(e, RateLimitError) or getattr(e, "status_code", None) == 429:
+                limiter.block_for(delay)
+        finally:
+            limiter.release(estimated_tokens, used_tokens)
+        attempt += 1
+        time.sleep(delay)
+
+
+async def call_with_rate_limit_async(create_fn, request: dict, client_config: dict):
+    """Versione asincrona di call_with_rate_limit, per i client AsyncOpenAI."""
+    limiter = get_rate_limiter(client_config)
+    estimated_tokens = estimate_request_tokens(request)
+    attempt = 0
+    while True:
+        await limiter.acquire_async(estimated_tokens)
+        used_tokens = None
+        try:
+            response = await create_fn(**request)
+            used_tokens = _usage_tokens(response)
+            return response, attempt
+        except Exception as e:
+            if not _is_retryable(e) or attempt >= MAX_RETRIES:
+                raise
+            delay = _retry_delay(e, attempt)
+            if isinstance(e, RateLimitError) or getattr(e, "status_code", None) == 429:
+                await limiter.block_for_async(delay)
+        finally:
+            await limiter.release_async(estimated_tokens, used_tokens)
+        attempt += 1
+        await asyncio.sleep(delay)
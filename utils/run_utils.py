@@ -0,0 +1,604 @@
+import asyncio
+import json
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import bindparam, text
+
+from .db_utils import get_engine
+from .runtime_utils import logger, notify_error
+from .data_utils import insert_test_result, load_api_presets
+from .execution_utils import run_llm_job, run_llm_test_async
+from .batch_utils import run_llm_test_batch
+from .telemetry_utils import aggregate_run_metrics
+from .bm25_utils import BM25_DEFAULT_PARAMETERS, evaluate_results_bm25
+from .term_index_utils import load_corpus_statistics
+from .embedding_utils import EMBEDDING_DEFAULT_PARAMETERS, evaluate_results_embedding
+from .sampling_utils import SAMPLING_DEFAULT_PARAMETERS, SampledScore, new_sampling_seed, stratified_order
+
+# Stati di un'esecuzione registrata in test_runs
+RUN_STATUS_QUEUED = "queued"
+RUN_STATUS_RUNNING = "running"
+RUN_STATUS_INTERRUPTED = "interrupted"
+RUN_STATUS_FAILED = "failed"
+RUN_STATUS_COMPLETED = "completed"
+RUN_STATUS_DISCARDED = "discarded"
+# Esecuzioni che possono essere riprese saltando le domande già completate
+RESUMABLE_STATUSES = (RUN_STATUS_QUEUED, RUN_STATUS_RUNNING, RUN_STATUS_INTERRUPTED, RUN_STATUS_FAILED)
+# Esecuzioni che un processo potrebbe star ancora eseguendo
+ACTIVE_STATUSES = (RUN_STATUS_QUEUED, RUN_STATUS_RUNNING)
+# Modalità di esecuzione salvate nella configurazione di un'esecuzione
+EXECUTION_MODE_REALTIME = "realtime"
+EXECUTION_MODE_BATCH = "batch"
+# Metodi di valutazione: giudice LLM, BM25 locale o similarità tra embedding (solo generazione tramite chat)
+EVALUATION_METHOD_LLM = "LLM"
+EVALUATION_METHOD_BM25 = "BM25"
+EVALUATION_METHOD_EMBEDDING = "Embedding"
+# Risposta attesa usata quando quella salvata è vuota
+MISSING_EXPECTED_ANSWER = "Risposta non disponibile"
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _load_json(value):
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode("utf-8")
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            return {}
+    return value if isinstance(value, dict) else {}
+
+
+def _run_from_row(row):
+    run = dict(row._mapping)
+    run['id'] = str(run['id'])
+    run['set_id'] = str(run['set_id'])
+    run['config'] = _load_json(run.get('config'))
+    return run
+
+
+def build_run_config(set_id, set_name: str, gen_preset: dict, eval_preset: dict, question_ids,
+                     execution_mode: str = EXECUTION_MODE_REALTIME, evaluation_method: str = EVALUATION_METHOD_LLM,
+                     evaluation_parameters: dict = None, sampling: dict = None, **run_options):
+    """
+    Costruisce la configurazione salvata con un'esecuzione: contiene tutto il necessario
+    per eseguirla o riprenderla in un altro processo, ma non le chiavi API.
+    Args:
+        set_id: ID del set di domande.
+        set_name: Nome del set di domande.
+        gen_preset: Preset API di generazione.
+        eval_preset: Preset API di valutazione (None con EVALUATION_METHOD_BM25; con
+            EVALUATION_METHOD_EMBEDDING è il preset dell'endpoint di embedding).
+        question_ids: ID delle domande da eseguire, nell'ordine desiderato.
+        execution_mode: EXECUTION_MODE_REALTIME o EXECUTION_MODE_BATCH.
+        evaluation_method: EVALUATION_METHOD_LLM, EVALUATION_METHOD_BM25 o EVALUATION_METHOD_EMBEDDING.
+        evaluation_parameters: Parametri dei metodi senza giudice (es. k1, b e soglie di BM25,
+            modello di embedding).
+        sampling: Se indicato, esecuzione a campione (solo con EVALUATION_METHOD_LLM): le domande
+            vengono riordinate a caso, stratificate per categoria, e l'esecuzione si ferma quando
+            l'intervallo di confidenza del punteggio medio è abbastanza stretto o il budget è esaurito
+            (parametri in SAMPLING_DEFAULT_PARAMETERS; senza seed ne viene scelto uno).
+        run_options: Opzioni passate a run_llm_test (concorrenza, raggruppamento, cache, ...).
+    """
+    question_ids = [str(q_id) for q_id in question_ids]
+    if evaluation_method != EVALUATION_METHOD_LLM:
+        sampling = None
+    if sampling is not None:
+        sampling = dict(SAMPLING_DEFAULT_PARAMETERS, **sampling)
+        if sampling["seed"] is None:
+            sampling["seed"] = new_sampling_seed()
+        question_ids = stratified_order(question_ids, load_question_categories(question_ids), sampling["seed"])
+    return {
+        'set_id': str(set_id),
+        'set_name': set_name,
+        'generation_preset_id': gen_preset['id'],
+        'generation_preset': gen_preset['name'],
+        'evaluation_preset_id': eval_preset['id'] if eval_preset else None,
+        'evaluation_preset': eval_preset['name'] if eval_preset else None,
+        'question_ids': question_ids,
+        'execution_mode': execution_mode,
+        'evaluation_method': evaluation_method,
+        'evaluation_parameters': evaluation_parameters or {},
+        'sampling': sampling,
+        'options': run_options
+    }
+
+
+def create_run(set_id, config: dict, total: int, status: str = RUN_STATUS_QUEUED):
+    """
+    Registra una nuova esecuzione prima di iniziare a inviare richieste.
+    Args:
+        set_id: ID del set di domande.
+        config: Configurazione necessaria per riprendere l'esecuzione (preset, domande, opzioni);
+            non deve contenere chiavi API.
+        total: Numero di domande da eseguire.
+        status: Stato iniziale dell'esecuzione.
+    Returns:
+        L'ID dell'esecuzione.
+    """
+    run_id = str(uuid.uuid4())
+    now = _now()
+    with get_engine().begin() as conn:
+        conn.execute(
+            text('''INSERT INTO test_runs (id, set_id, status, config, total, completed, created_at, updated_at)
+                    VALUES (:id, :set_id, :status, :config, :total, 0, :now, :now)'''),
+            {'id': run_id, 'set_id': str(set_id), 'status': status,
+             'config': json.dumps(config), 'total': int(total), 'now': now}
+        )
+    return run_id
+
+
+def create_matrix_runs(set_id, set_name: str, gen_presets: list, eval_preset: dict, question_ids,
+                       execution_mode: str = EXECUTION_MODE_REALTIME, status: str = RUN_STATUS_QUEUED,
+                       **run_options):
+    """
+    Registra un'esecuzione per ciascun preset di generazione sullo stesso set e con lo stesso
+    preset di valutazione, collegate da un matrix_id comune (vedi process_matrix).
+    Il numero di worker di generazione, se non indicato, segue il limite di ciascun preset.
+    Le esecuzioni a campione della matrice condividono il seme, quindi partono dalle stesse domande.
+    Returns:
+        La lista degli ID delle esecuzioni, nell'ordine di gen_presets.
+    """
+    matrix_id = str(uuid.uuid4())
+    if run_options.get('sampling') is not None and run_options['sampling'].get('seed') is None:
+        run_options['sampling'] = dict(run_options['sampling'], seed=new_sampling_seed())
+    run_ids = []
+    for gen_preset in gen_presets:
+        config = build_run_config(set_id, set_name, gen_preset, eval_preset, question_ids,
+                                  execution_mode=execution_mode, **run_options)
+        config['matrix_id'] = matrix_id
+        run_ids.append(create_run(set_id, config, len(config['question_ids']), status=status))
+    return run_ids
+
+
+def load_run(run_id):
+    """Restituisce l'esecuzione come dizionario, o None se non esiste."""
+    with get_engine().begin() as conn:
+        row = conn.execute(text("SELECT * FROM test_runs WHERE id = :id"), {'id': str(run_id)}).fetchone()
+    return _run_from_row(row) if row is not None else None
+
+
+def load_runs(set_id=None, statuses=RESUMABLE_STATUSES):
+    """
+    Restituisce le esecuzioni con uno degli stati indicati (più recenti per prime),
+    opzionalmente di un solo set. In caso di errore del database restituisce una lista vuota.
+    """
+    query = "SELECT * FROM test_runs WHERE status IN :statuses"
+    params = {'statuses': list(statuses)}
+    if set_id is not None:
+        query += " AND set_id = :set_id"
+        params['set_id'] = str(set_id)
+    query += " ORDER BY updated_at DESC"
+    try:
+        with get_engine().begin() as conn:
+            rows = conn.execute(text(query).bindparams(bindparam('statuses', expanding=True)), params).fetchall()
+    except Exception as e:
+        notify_error(f"Lettura delle esecuzioni fallita: {e}")
+        return []
+    return [_run_from_row(row) for row in rows]
+
+
+def set_run_status(run_id, status: str, error: str = None, result_id=None):
+    """Aggiorna lo stato di un'esecuzione (e l'eventuale errore o risultato finale)."""
+    with get_engine().begin() as conn:
+        conn.execute(
+            text('''UPDATE test_runs SET status = :status, error = :error,
+                        result_id = COALESCE(:result_id, result_id), updated_at = :now
+                    WHERE id = :id'''),
+            {'id': str(run_id), 'status': status, 'error': error,
+             'result_id': str(result_id) if result_id is not None else None, 'now': _now()}
+        )
+
+
+def save_run_config(run_id, config: dict):
+    """Aggiorna la configurazione salvata di un'esecuzione (es. gli ID dei batch già creati)."""
+    with get_engine().begin() as conn:
+        conn.execute(
+            text('UPDATE test_runs SET config = :config, updated_at = :now WHERE id = :id'),
+            {'id': str(run_id), 'config': json.dumps(config), 'now': _now()}
+        )
+
+
+def save_run_item(run_id, question_id, result: dict):
+    """Salva il risultato di una domanda completata e aggiorna l'avanzamento dell'esecuzione."""
+    with get_engine().begin() as conn:
+        conn.execute(
+            text('''INSERT INTO test_run_items (run_id, question_id, result) VALUES (:run_id, :question_id, :result)
+                    ON DUPLICATE KEY UPDATE result = VALUES(result)'''),
+            {'run_id': str(run_id), 'question_id': str(question_id), 'result': json.dumps(result)}
+        )
+        conn.execute(
+            text('''UPDATE test_runs
+                    SET completed = (SELECT COUNT(*) FROM test_run_items WHERE run_id = :id), updated_at = :now
+                    WHERE id = :id'''),
+            {'id': str(run_id), 'now': _now()}
+        )
+
+
+def load_run_items(run_id):
+    """Restituisce i risultati già salvati di un'esecuzione come dizionario {question_id: risultato}."""
+    with get_engine().begin() as conn:
+        rows = conn.execute(
+            text("SELECT question_id, result FROM test_run_items WHERE run_id = :run_id"),
+            {'run_id': str(run_id)}
+        ).fetchall()
+    return {str(row[0]): _load_json(row[1]) for row in rows}
+
+
+async def execute_run_async(run_id, questions, gen_config: dict, eval_config: dict, progress_callback=None,
+                            sampler: SampledScore = None, **run_options):
+    """
+    Esegue (o riprende) un'esecuzione registrata, salvando ogni domanda appena completata.
+    Le domande già presenti in test_run_items vengono saltate.
+    Args:
+        run_id: ID dell'esecuzione creata con create_run.
+        questions: Lista di tuple (question_id, {'question': ..., 'expected_answer': ...}).
+        gen_config: Preset API usato per generare le risposte.
+        eval_config: Preset API usato per valutare le risposte.
+        progress_callback: Funzione opzionale chiamata come progress_callback(completate, totali),
+            contando anche le domande completate in precedenza.
+        sampler: Stima del punteggio di un'esecuzione a campione; le domande vengono eseguite
+            nell'ordine di questions finché sampler.stop_reason() non indica di fermarsi.
+        run_options: Opzioni passate a run_llm_test_async (concorrenza, raggruppamento, cache, ...).
+    Returns:
+        Un dizionario {question_id: risultato} con tutte le domande eseguite, nell'ordine di questions.
+    """
+    questions = [(str(q_id), q_data) for q_id, q_data in questions]
+    stored = await asyncio.to_thread(load_run_items, run_id)
+    remaining = [(q_id, q_data) for q_id, q_data in questions if q_id not in stored]
+    already_done = len(questions) - len(remaining)
+    stop_callback = None
+    if sampler is not None:
+        for q_id, _ in questions:
+            if q_id in stored:
+                sampler.add(q_id, stored[q_id].get('evaluation', {}).get('score', 0))
+        if sampler.stop_reason():
+            # Esecuzione a campione interrotta dopo aver raggiunto la precisione richiesta
+            remaining = []
+
+        def stop_callback(q_id, result):
+            sampler.add(q_id, result.get('evaluation', {}).get('score', 0))
+            return sampler.stop_reason() is not None
+    await asyncio.to_thread(set_run_status, run_id, RUN_STATUS_RUNNING)
+
+    def checkpoint(q_id, result):
+        try:
+            save_run_item(run_id, q_id, result)
+        except Exception as e:
+            # Il risultato resta comunque in memoria e viene incluso nel risultato finale
+            logger.error(f"Salvataggio del risultato della domanda {q_id} dell'esecuzione {run_id} fallito: {e}")
+
+    def progress(completed, _total):
+        if progress_callback:
+            progress_callback(already_done + completed, len(questions))
+
+    if progress_callback:
+        progress_callback(already_done, len(questions))
+    try:
+        new_results = await run_llm_test_async(
+            remaining, gen_config, eval_config,
+            progress_callback=progress, result_callback=checkpoint, stop_callback=stop_callback, **run_options
+        ) if remaining else {}
+    except Exception as e:
+        await asyncio.to_thread(set_run_status, run_id, RUN_STATUS_FAILED, error=f"{type(e).__name__}: {e}")
+        raise
+    except BaseException:
+        # Rerun/stop di Streamlit o interruzione del processo: l'esecuzione potrà essere ripresa
+        await asyncio.to_thread(set_run_status, run_id, RUN_STATUS_INTERRUPTED)
+        raise
+
+    stored = await asyncio.to_thread(load_run_items, run_id)
+    stored.update(new_results)
+    return {q_id: stored[q_id] for q_id, _ in questions if q_id in stored}
+
+
+def execute_run(run_id, questions, gen_config: dict, eval_config: dict, progress_callback=None, sampler=None,
+                **run_options):
+    """Versione sincrona di execute_run_async, eseguita in un nuovo event loop."""
+    return run_llm_job(execute_run_async(run_id, questions, gen_config, eval_config,
+                                         progress_callback=progress_callback, sampler=sampler, **run_options))
+
+
+def assemble_result_data(set_name: str, gen_preset_name: str, eval_preset_name: str, results: dict,
+                         elapsed_seconds: float = None, executed_questions: int = None, sampling: dict = None):
+    """
+    Costruisce il record di un test LLM nel formato salvato da add_test_result, con la telemetria
+    aggregata dell'esecuzione in 'metrics' (vedi aggregate_run_metrics). Con sampling (riepilogo di
+    SampledScore.summary) il record è marcato 'sampled', avg_score è la media stratificata per
+    categoria e 'confidence_interval' ne riporta l'intervallo di confidenza.
+    """
+    avg_score = sum(r['evaluation']['score'] for r in results.values()) / len(results) if results else 0
+    if sampling:
+        avg_score = sampling['estimate']
+    result_data = {
+        'set_name': set_name,
+        'timestamp': _now(),
+        'avg_score': avg_score,
+        'sample_type': 'Generata da LLM',
+        'method': 'LLM',
+        'generation_preset': gen_preset_name,
+        'evaluation_preset': eval_preset_name,
+        'metrics': aggregate_run_metrics(results, elapsed_seconds, executed_questions),
+        'questions': results
+    }
+    if sampling:
+        result_data.update(sampled=True, sampling=sampling, confidence_interval=sampling['confidence_interval'])
+    return result_data
+
+
+def assemble_bm25_result_data(set_name: str, gen_preset_name: str, results: dict, parameters: dict = None,
+                              elapsed_seconds: float = None, executed_questions: int = None):
+    """
+    Valuta con BM25, in un'unica passata, le risposte generate di un'esecuzione e costruisce
+    il record del test nel formato mostrato da visualizza_risultati (metodo "BM25").
+    Con use_question_bank IDF e lunghezza media vengono letti dall'indice dei termini della banca domande.
+    """
+    parameters = dict(BM25_DEFAULT_PARAMETERS, **(parameters or {}))
+    corpus = None
+    if parameters["use_question_bank"]:
+        try:
+            corpus = load_corpus_statistics("risposta_attesa", [r.get('expected_answer', "") for r in results.values()])
+        except Exception as e:
+            logger.warning(f"Statistiche dell'indice dei termini non disponibili, uso le sole risposte del set: {e}")
+    results = evaluate_results_bm25(results, parameters, corpus)
+    avg_score = sum(r['similarity_score'] for r in results.values()) / len(results) if results else 0
+    return {
+        'set_name': set_name,
+        'timestamp': _now(),
+        'avg_score': avg_score,
+        'sample_type': 'Generata da LLM',
+        'method': 'BM25',
+        'generation_preset': gen_preset_name,
+        'parameters': parameters,
+        'metrics': aggregate_run_metrics(results, elapsed_seconds, executed_questions),
+        'questions': results
+    }
+
+
+def assemble_embedding_result_data(set_name: str, gen_preset_name: str, eval_config: dict, results: dict,
+                                   parameters: dict = None, elapsed_seconds: float = None,
+                                   executed_questions: int = None):
+    """
+    Valuta le risposte generate di un'esecuzione con la similarità coseno degli embedding
+    (vedi evaluate_results_embedding) e costruisce il record del test (metodo "Embedding").
+    Le chiamate di embedding, comuni a tutto il test, entrano nella telemetria di valutazione.
+    """
+    parameters = dict(EMBEDDING_DEFAULT_PARAMETERS, **(parameters or {}))
+    results, summary = evaluate_results_embedding(results, eval_config, parameters)
+    avg_score = sum(r['similarity_score'] for r in results.values()) / len(results) if results else 0
+    return {
+        'set_name': set_name,
+        'timestamp': _now(),
+        'avg_score': avg_score,
+        'sample_type': 'Generata da LLM',
+        'method': EVALUATION_METHOD_EMBEDDING,
+        'generation_preset': gen_preset_name,
+        'evaluation_preset': eval_config['name'],
+        'parameters': parameters,
+        'cached_references': summary['cached_references'],
+        'metrics': aggregate_run_metrics(results, elapsed_seconds, executed_questions,
+                                         evaluation_calls=summary['calls']),
+        'questions': results
+    }
+
+
+def load_run_questions(question_ids):
+    """
+    Legge dal database domanda e risposta attesa delle domande di un'esecuzione.
+    Returns:
+        Lista di tuple (question_id, {'question': ..., 'expected_answer': ...}) nell'ordine di question_ids;
+        le domande vuote o non più presenti vengono omesse.
+    """
+    question_ids = [str(q_id) for q_id in question_ids]
+    if not question_ids:
+        return []
+    with get_engine().begin() as conn:
+        rows = conn.execute(
+            text("SELECT id, domanda, risposta_attesa FROM questions WHERE id IN :ids")
+            .bindparams(bindparam('ids', expanding=True)),
+            {'ids': question_ids}
+        ).fetchall()
+    by_id = {str(row[0]): (row[1], row[2]) for row in rows}
+    questions = []
+    for q_id in question_ids:
+        question, expected_answer = by_id.get(q_id, (None, None))
+        if not isinstance(question, str) or not question.strip():
+            logger.warning(f"La domanda con ID {q_id} è vuota, non valida o non esiste più.")
+            continue
+        if not isinstance(expected_answer, str) or not expected_answer.strip():
+            expected_answer = MISSING_EXPECTED_ANSWER
+        questions.append((q_id, {'question': question, 'expected_answer': expected_answer}))
+    return questions
+
+
+def load_question_categories(question_ids):
+    """Restituisce un dizionario {question_id: categoria} delle domande indicate ancora presenti."""
+    question_ids = [str(q_id) for q_id in question_ids]
+    if not question_ids:
+        return {}
+    with get_engine().begin() as conn:
+        rows = conn.execute(
+            text("SELECT id, categoria FROM questions WHERE id IN :ids")
+            .bindparams(bindparam('ids', expanding=True)),
+            {'ids': question_ids}
+        ).fetchall()
+    return {str(row[0]): row[1] or "" for row in rows}
+
+
+def run_sampler(run_config: dict, question_ids):
+    """
+    Stima del punteggio di un'esecuzione a campione (vedi build_run_config), o None se l'esecuzione
+    non è a campione. I pesi delle categorie sono calcolati su question_ids.
+    """
+    if not run_config.get('sampling') or run_config.get('evaluation_method', EVALUATION_METHOD_LLM) != EVALUATION_METHOD_LLM:
+        return None
+    return SampledScore(run_config['sampling'], load_question_categories(question_ids))
+
+
+def load_preset_config(preset_id, preset_name=None):
+    """Restituisce il preset API con l'ID indicato (o con il nome, se l'ID non esiste più), o None."""
+    presets = load_api_presets()
+    match = presets[presets['id'] == str(preset_id)]
+    if match.empty and preset_name:
+        match = presets[presets['name'] == preset_name]
+    return match.iloc[0].to_dict() if not match.empty else None
+
+
+def finalize_run(run_id, run_config: dict, results: dict, gen_preset_name: str, eval_preset_name: str,
+                 elapsed_seconds: float = None, executed_questions: int = None, eval_config: dict = None):
+    """
+    Salva in test_results il record finale di un'esecuzione e la marca come completata.
+    elapsed_seconds ed executed_questions (durata e domande eseguite dall'ultima ripresa)
+    servono a calcolare le domande al minuto; eval_config è il preset dell'endpoint di embedding
+    con EVALUATION_METHOD_EMBEDDING.
+    Returns:
+        Il record inserito (vedi insert_test_result).
+    """
+    method = run_config.get('evaluation_method')
+    if method == EVALUATION_METHOD_BM25:
+        result_data = assemble_bm25_result_data(run_config['set_name'], gen_preset_name, results,
+                                                run_config.get('evaluation_parameters'),
+                                                elapsed_seconds, executed_questions)
+    elif method == EVALUATION_METHOD_EMBEDDING:
+        result_data = assemble_embedding_result_data(run_config['set_name'], gen_preset_name, eval_config, results,
+                                                     run_config.get('evaluation_parameters'),
+                                                     elapsed_seconds, executed_questions)
+    else:
+        sampling = None
+        sampler = run_sampler(run_config, run_config['question_ids'])
+        if sampler is not None:
+            for q_id, result in results.items():
+                sampler.add(q_id, result['evaluation']['score'])
+            sampling = sampler.summary(len(run_config['question_ids']))
+        result_data = assemble_result_data(run_config['set_name'], gen_preset_name, eval_preset_name, results,
+                                           elapsed_seconds, executed_questions, sampling)
+    if run_config.get('matrix_id'):
+        result_data['matrix_id'] = run_config['matrix_id']
+    record = insert_test_result(run_config['set_id'], result_data)
+    set_run_status(run_id, RUN_STATUS_COMPLETED, result_id=record['id'])
+    return record
+
+
+async def process_run_async(run_id, progress_callback=None):
+    """
+    Esegue (o riprende) un'esecuzione registrata leggendo dal database preset e domande,
+    e ne salva il risultato finale. Non dipende da Streamlit: è usata dai processi in background
+    e dalla riga di comando.
+    Args:
+        run_id: ID dell'esecuzione creata con create_run.
+        progress_callback: Funzione opzionale chiamata come progress_callback(completate, totali).
+    Returns:
+        Il record salvato in test_results (vedi insert_test_result), o None se l'esecuzione non è stata completata.
+    """
+    run = await asyncio.to_thread(load_run, run_id)
+    if not run:
+        return None
+    if run['status'] == RUN_STATUS_COMPLETED:
+        return None
+    config = run['config']
+
+    gen_config = await asyncio.to_thread(load_preset_config, config.get('generation_preset_id'), config.get('generation_preset'))
+    eval_config = None
+    # Con BM25 e con gli embedding le risposte vengono solo generate e poi valutate in finalize_run
+    method = config.get('evaluation_method', EVALUATION_METHOD_LLM)
+    uses_judge = method == EVALUATION_METHOD_LLM
+    needs_eval_preset = method in (EVALUATION_METHOD_LLM, EVALUATION_METHOD_EMBEDDING)
+    if needs_eval_preset:
+        eval_config = await asyncio.to_thread(load_preset_config, config.get('evaluation_preset_id'), config.get('evaluation_preset'))
+    if not gen_config or (needs_eval_preset and not eval_config):
+        await asyncio.to_thread(set_run_status, run_id, RUN_STATUS_FAILED,
+                                "I preset usati da questa esecuzione non esistono più.")
+        return None
+
+    questions = await asyncio.to_thread(load_run_questions, config['question_ids'])
+    options = config.get('options', {})
+    sampler = await asyncio.to_thread(run_sampler, config, [q_id for q_id, _ in questions])
+    started = time.perf_counter()
+    already_done = 0
+    if config.get('execution_mode') == EXECUTION_MODE_BATCH:
+        if sampler is not None and sampler.parameters.get('max_questions'):
+            # Con il Batch API le domande vengono inviate tutte insieme: del campionamento vale solo il budget
+            questions = questions[:int(sampler.parameters['max_questions'])]
+        await asyncio.to_thread(set_run_status, run_id, RUN_STATUS_RUNNING)
+
+        def remember_batches(batch_ids):
+            # Salvati appena creati: un riavvio riprende gli stessi batch invece di pagarne di nuovi
+            config['batch_ids'] = batch_ids
+            save_run_config(run_id, config)
+
+        try:
+            results = await asyncio.to_thread(run_llm_test_batch, questions, gen_config,
+                                              eval_config if uses_judge else None,
+                                              show_api_details=options.get('show_api_details', False),
+                                              use_fast_path=options.get('use_fast_path', False),
+                                              batch_ids=config.get('batch_ids'),
+                                              batch_ids_callback=remember_batches)
+            for q_id, result in results.items():
+                await asyncio.to_thread(save_run_item, run_id, q_id, result)
+        except Exception as e:
+            await asyncio.to_thread(set_run_status, run_id, RUN_STATUS_FAILED, error=f"{type(e).__name__}: {e}")
+            raise
+        if progress_callback:
+            progress_callback(len(results), len(questions))
+    else:
+        # Le domande già salvate non contano nelle domande al minuto di questa ripresa
+        already_done = min(run['completed'] or 0, len(questions))
+        results = await execute_run_async(run_id, questions, gen_config, eval_config if uses_judge else None,
+                                          progress_callback=progress_callback, sampler=sampler, **options)
+
+    if not results:
+        await asyncio.to_thread(set_run_status, run_id, RUN_STATUS_FAILED, "Nessun risultato prodotto.")
+        return None
+    try:
+        return await asyncio.to_thread(finalize_run, run_id, config, results, gen_config['name'],
+                                       eval_config['name'] if eval_config else None,
+                                       time.perf_counter() - started, max(0, len(results) - already_done),
+                                       eval_config)
+    except Exception as e:
+        # Le risposte restano salvate: riprendendo l'esecuzione viene ripetuta solo la valutazione finale
+        await asyncio.to_thread(set_run_status, run_id, RUN_STATUS_FAILED, f"{type(e).__name__}: {e}")
+        return None
+
+
+def process_run(run_id, progress_callback=None):
+    """Versione sincrona di process_run_async, eseguita in un nuovo event loop."""
+    return run_llm_job(process_run_async(run_id, progress_callback=progress_callback))
+
+
+def process_matrix(run_ids, progress_callback=None):
+    """
+    Esegue contemporaneamente, nello stesso event loop, più esecuzioni registrate (es. lo stesso set
+    con più preset di generazione). Ogni preset rispetta i propri limiti e il preset di valutazione
+    comune è condiviso, quindi il tempo totale è circa quello dell'esecuzione più lenta.
+    Args:
+        run_ids: ID delle esecuzioni create con create_run.
+        progress_callback: Funzione opzionale chiamata come progress_callback(run_id, completate, totali).
+    Returns:
+        Un dizionario {run_id: record salvato in test_results | None}; un'esecuzione fallita
+        non interrompe le altre.
+    """
+    run_ids = [str(run_id) for run_id in run_ids]
+
+    def run_progress(run_id):
+        if not progress_callback:
+            return None
+        return lambda completed, total: progress_callback(run_id, completed, total)
+
+    async def process_all():
+        return await asyncio.gather(
+            *[process_run_async(run_id, progress_callback=run_progress(run_id)) for run_id in run_ids],
+            return_exceptions=True
+        )
+
+    records = {}
+    for run_id, outcome in zip(run_ids, run_llm_job(process_all())):
+        if isinstance(outcome, BaseException):
+            logger.error(f"Esecuzione {run_id} della matrice terminata con errore: {type(outcome).__name__} - {outcome}")
+            outcome = None
+        records[run_id] = outcome
+    return records
@@ -0,0 +1,54 @@
+import logging
+
+logger = logging.getLogger("llm_test")
+
+
+class _HeadlessState(dict):
+    """Sostituto di st.session_state per l'esecuzione senza Streamlit (CLI, processi in background)."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+
+_headless_state = _HeadlessState()
+
+
+def has_script_context():
+    """True se il codice è eseguito da uno script Streamlit (pagina aperta in un browser)."""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        return False
+    return get_script_run_ctx(suppress_warning=True) is not None
+
+
+def session_state():
+    """Restituisce st.session_state dentro uno script Streamlit, altrimenti uno stato locale al processo."""
+    if has_script_context():
+        import streamlit as st
+        return st.session_state
+    return _headless_state
+
+
+def notify_error(message: str):
+    """Mostra un errore nella pagina Streamlit o, senza interfaccia, lo scrive nel log."""
+    if has_script_context():
+        import streamlit as st
+        st.error(message)
+    else:
+        logger.error(message)
+
+
+def notify_warning(message: str):
+    """Mostra un avviso nella pagina Streamlit o, senza interfaccia, lo scrive nel log."""
+    if has_script_context():
+        import streamlit as st
+        st.warning(message)
+    else:
+        logger.warning(message)
@@ -0,0 +1,179 @@
+import math
+import random
+from statistics import NormalDist
+
+import numpy as np
+
+# Parametri predefiniti di un'esecuzione a campione: ci_width è l'ampiezza totale dell'intervallo
+# di confidenza in punti percentuali (4 = media stimata ±2%), max_questions il budget di domande
+SAMPLING_DEFAULT_PARAMETERS = {
+    "ci_width": 4.0,
+    "confidence": 0.95,
+    "method": "wilson",
+    "min_questions": 30,
+    "max_questions": None,
+    "seed": None
+}
+SAMPLING_METHODS = ("wilson", "bootstrap")
+# Ricampionamenti del bootstrap e ogni quante nuove domande l'intervallo bootstrap viene ricalcolato
+BOOTSTRAP_RESAMPLES = 1000
+BOOTSTRAP_CHECK_INTERVAL = 10
+# Categoria assegnata alle domande senza categoria
+UNCATEGORIZED = ""
+
+
+def new_sampling_seed():
+    return random.randrange(2 ** 31)
+
+
+def stratified_order(question_ids: list, categories: dict, seed: int):
+    """
+    Ordina casualmente le domande mantenendo in ogni prefisso le proporzioni delle categorie:
+    ogni categoria viene mescolata e le sue domande distribuite a intervalli regolari (con uno
+    sfasamento casuale) lungo l'ordine complessivo.
+    Args:
+        question_ids: ID delle domande del set.
+        categories: Dizionario {question_id: categoria}.
+        seed: Seme del generatore casuale, per riprodurre lo stesso ordine.
+    Returns:
+        La lista degli ID nel nuovo ordine.
+    """
+    rng = random.Random(seed)
+    strata = {}
+    for q_id in question_ids:
+        strata.setdefault(categories.get(q_id, UNCATEGORIZED), []).append(q_id)
+    keyed = []
+    for category in sorted(strata):
+        members = strata[category]
+        rng.shuffle(members)
+        offset = rng.random()
+        keyed.extend(((position + offset) / len(members), rng.random(), q_id)
+                     for position, q_id in enumerate(members))
+    return [q_id for _, _, q_id in sorted(keyed)]
+
+
+def _z_value(confidence: float):
+    return NormalDist().inv_cdf((1 + confidence) / 2)
+
+
+def wilson_interval(mean: float, n: int, confidence: float):
+    """
+    Intervallo di Wilson per una media di punteggi in [0, 1]. Per punteggi non binari la varianza
+    p(1-p) è un limite superiore di quella reale, quindi l'intervallo è conservativo.
+    Returns:
+        Una tupla (estremo inferiore, estremo superiore) in [0, 1].
+    """
+    if n <= 0:
+        return 0.0, 1.0
+    z = _z_value(confidence)
+    denominator = 1 + z ** 2 / n
+    center = (mean + z ** 2 / (2 * n)) / denominator
+    half_width = z * math.sqrt(max(0.0, mean * (1 - mean)) / n + z ** 2 / (4 * n ** 2)) / denominator
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+def bootstrap_interval(scores_by_stratum: dict, weights: dict, confidence: float,
+                       resamples: int = BOOTSTRAP_RESAMPLES, seed: int = None):
+    """
+    Intervallo bootstrap percentile della media stratificata, ricampionando all'interno di ogni categoria.
+    Args:
+        scores_by_stratum: Dizionario {categoria: lista di punteggi}.
+        weights: Peso di ogni categoria (somma 1 sulle categorie presenti in scores_by_stratum).
+        confidence: Livello di confidenza (es. 0.95).
+        resamples: Numero di ricampionamenti.
+        seed: Seme del generatore casuale.
+    Returns:
+        Una tupla (estremo inferiore, estremo superiore) nella scala dei punteggi.
+    """
+    rng = np.random.default_rng(seed)
+    means = np.zeros(resamples)
+    for category, scores in scores_by_stratum.items():
+        values = np.asarray(scores, dtype=np.float64)
+        indices = rng.integers(0, len(values), size=(resamples, len(values)))
+        means += weights[category] * values[indices].mean(axis=1)
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(means, [alpha, 1 - alpha])
+    return float(low), float(high)
+
+
+class SampledScore:
+    """
+    Stima progressiva del punteggio medio di un set da un campione di domande: media stratificata
+    per categoria (pesi proporzionali alle domande del set) con intervallo di confidenza di Wilson
+    o bootstrap, e regola di arresto sull'ampiezza dell'intervallo o sul budget di domande.
+    """
+
+    def __init__(self, parameters: dict, question_categories: dict):
+        self.parameters = dict(SAMPLING_DEFAULT_PARAMETERS, **(parameters or {}))
+        counts = {}
+        for category in question_categories.values():
+            counts[category or UNCATEGORIZED] = counts.get(category or UNCATEGORIZED, 0) + 1
+        total = sum(counts.values()) or 1
+        self.population_weights = {category: count / total for category, count in counts.items()}
+        self.question_categories = question_categories
+        self.scores = {}
+        self.n = 0
+        self._interval = None
+        self._interval_n = 0
+
+    def add(self, question_id, score: float):
+        category = self.question_categories.get(question_id) or UNCATEGORIZED
+        self.scores.setdefault(category, []).append(float(score))
+        self.n += 1
+
+    def _weights(self):
+        """Pesi delle categorie già campionate, rinormalizzati a somma 1."""
+        total = sum(self.population_weights.get(category, 0) for category in self.scores) or 1
+        return {category: self.population_weights.get(category, 0) / total for category in self.scores}
+
+    def estimate(self):
+        """Punteggio medio stimato (media stratificata), in percentuale."""
+        if not self.n:
+            return 0.0
+        weights = self._weights()
+        return float(sum(weights[category] * np.mean(scores) for category, scores in self.scores.items()))
+
+    def interval(self):
+        """Intervallo di confidenza (estremo inferiore, estremo superiore) del punteggio medio, in percentuale."""
+        if not self.n:
+            return 0.0, 100.0
+        if self.parameters["method"] == "bootstrap":
+            # Il bootstrap è costoso: viene ricalcolato solo ogni BOOTSTRAP_CHECK_INTERVAL nuove domande
+            if self._interval is None or self.n - self._interval_n >= BOOTSTRAP_CHECK_INTERVAL:
+                self._interval = bootstrap_interval(self.scores, self._weights(), self.parameters["confidence"],
+                                                    seed=self.parameters.get("seed"))
+                self._interval_n = self.n
+            return self._interval
+        low, high = wilson_interval(self.estimate() / 100.0, self.n, self.parameters["confidence"])
+        return low * 100.0, high * 100.0
+
+    def stop_reason(self):
+        """Motivo per cui il campionamento può fermarsi ("precision" o "budget"), o None."""
+        max_questions = self.parameters.get("max_questions")
+        if max_questions and self.n >= max_questions:
+            return "budget"
+        if self.n >= self.parameters["min_questions"]:
+            low, high = self.interval()
+            if high - low <= self.parameters["ci_width"]:
+                return "precision"
+        return None
+
+    def summary(self, total_questions: int):
+        """Riepilogo salvato con il risultato di un'esecuzione a campione."""
+        if self.parameters["method"] == "bootstrap":
+            self._interval = None
+        low, high = self.interval()
+        return {
+            'parameters': self.parameters,
+            'questions_evaluated': self.n,
+            'questions_total': total_questions,
+            'estimate': round(self.estimate(), 2),
+            'stop_reason': self.stop_reason() or "exhausted",
+            'confidence_interval': {
+                'method': self.parameters["method"],
+                'confidence': self.parameters["confidence"],
+                'low': round(low, 2),
+                'high': round(high, 2),
+                'width': round(high - low, 2)
+            }
+        }
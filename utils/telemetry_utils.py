@@ -0,0 +1,274 @@
+import time
+
+import pandas as pd
+
+# Prezzi stimati in USD per milione di token: (input, input in cache, output).
+# I modelli vengono riconosciuti anche per prefisso (es. "gpt-4o-2024-08-06" usa "gpt-4o");
+# aggiornare la tabella quando i listini cambiano o si aggiungono modelli.
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+    "gpt-4-turbo": (10.00, 10.00, 30.00),
+    "gpt-4": (30.00, 30.00, 60.00),
+    "gpt-3.5-turbo": (0.50, 0.50, 1.50),
+    "o3-mini": (1.10, 0.55, 4.40),
+    "claude-3-opus": (15.00, 1.50, 75.00),
+    "claude-3-5-sonnet": (3.00, 0.30, 15.00),
+    "claude-3-sonnet": (3.00, 0.30, 15.00),
+    "claude-3-haiku": (0.25, 0.03, 1.25),
+    "text-embedding-3-small": (0.02, 0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.13, 0.0),
+    "text-embedding-ada-002": (0.10, 0.10, 0.0),
+}
+# Sconto applicato dal Batch API rispetto ai prezzi in tempo reale
+BATCH_API_DISCOUNT = 0.5
+# Percentili di latenza riportati nel riepilogo di un'esecuzione
+LATENCY_PERCENTILES = (50, 95, 99)
+
+
+class TimedCall:
+    """
+    Avvolge la funzione create di una chiamata API e misura la durata dell'ultimo tentativo,
+    cioè la latenza della chiamata riuscita escluse le attese dei limiti e dei tentativi ripetuti.
+    """
+
+    def __init__(self, create_fn):
+        self.create_fn = create_fn
+        self.latency = None
+
+    def __call__(self, **request):
+        started = time.perf_counter()
+        try:
+            return self.create_fn(**request)
+        finally:
+            self.latency = time.perf_counter() - started
+
+
+class TimedCallAsync(TimedCall):
+    """Versione di TimedCall per le funzioni create dei client AsyncOpenAI."""
+
+    async def __call__(self, **request):
+        started = time.perf_counter()
+        try:
+            return await self.create_fn(**request)
+        finally:
+            self.latency = time.perf_counter() - started
+
+
+def model_prices(model: str):
+    """Restituisce i prezzi (input, input in cache, output) del modello, o None se non è in tabella."""
+    if not model:
+        return None
+    model = model.lower()
+    if model in MODEL_PRICES:
+        return MODEL_PRICES[model]
+    # Il prefisso più lungo evita che "gpt-4o-mini-..." venga prezzato come "gpt-4o"
+    matches = [name for name in MODEL_PRICES if model.startswith(name)]
+    return MODEL_PRICES[max(matches, key=len)] if matches else None
+
+
+def _usage_value(usage, key: str):
+    if usage is None:
+        return None
+    return usage.get(key) if isinstance(usage, dict) else getattr(usage, key, None)
+
+
+def usage_tokens(usage):
+    """
+    Legge l'uso dei token da una risposta dell'API (oggetto dell'SDK o dizionario del Batch API).
+    Returns:
+        Una tupla (prompt_tokens, completion_tokens, cached_tokens) con 0 per i valori assenti.
+    """
+    prompt_tokens = _usage_value(usage, "prompt_tokens") or 0
+    completion_tokens = _usage_value(usage, "completion_tokens") or 0
+    cached_tokens = _usage_value(_usage_value(usage, "prompt_tokens_details"), "cached_tokens") or 0
+    return int(prompt_tokens), int(completion_tokens), int(cached_tokens)
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0,
+                  discount: float = 1.0):
+    """
+    Stima il costo in USD di una chiamata in base a MODEL_PRICES.
+    Args:
+        model: Nome del modello usato.
+        prompt_tokens: Token di input, compresi quelli serviti dalla cache del provider.
+        completion_tokens: Token di output.
+        cached_tokens: Token di input serviti dalla cache del provider (prezzo ridotto).
+        discount: Moltiplicatore del prezzo (es. BATCH_API_DISCOUNT).
+    Returns:
+        Il costo stimato, o None se il modello non ha un prezzo in tabella.
+    """
+    prices = model_prices(model)
+    if prices is None:
+        return None
+    input_price, cached_price, output_price = prices
+    cached_tokens = min(cached_tokens, prompt_tokens)
+    cost = ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+            + completion_tokens * output_price) / 1_000_000
+    return cost * discount
+
+
+def call_metrics(model: str, usage, latency: float = None, retries: int = 0, discount: float = 1.0):
+    """
+    Telemetria di una singola chiamata API, salvata insieme al risultato di ogni domanda.
+    Returns:
+        Un dizionario {model, prompt_tokens, completion_tokens, cached_tokens, latency, retries, cost}.
+    """
+    prompt_tokens, completion_tokens, cached_tokens = usage_tokens(usage)
+    cost = estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens, discount)
+    return {
+        "model": model,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cached_tokens": cached_tokens,
+        "latency": round(latency, 4) if latency is not None else None,
+        "retries": retries,
+        "cost": cost
+    }
+
+
+def split_call_metrics(metrics: dict, parts: int):
+    """
+    Ripartisce token e costo di una chiamata che ha servito più domande (valutazione a gruppi);
+    latenza e tentativi restano quelli della chiamata.
+    """
+    share = dict(metrics, batch_size=parts)
+    for key in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+        share[key] = metrics[key] / parts
+    if metrics.get("cost") is not None:
+        share["cost"] = metrics["cost"] / parts
+    return share
+
+
+def _percentiles(values: list):
+    if not values:
+        return {f"p{p}": None for p in LATENCY_PERCENTILES}
+    quantiles = pd.Series(values, dtype=float).quantile([p / 100 for p in LATENCY_PERCENTILES])
+    return {f"p{p}": round(float(q), 4) for p, q in zip(LATENCY_PERCENTILES, quantiles)}
+
+
+def _most_common_model(metrics: list):
+    models = pd.Series([m.get("model") for m in metrics], dtype=object).dropna()
+    return models.mode().iloc[0] if not models.empty else None
+
+
+def aggregate_run_metrics(results: dict, elapsed_seconds: float = None, executed_questions: int = None,
+                          evaluation_calls: list = None):
+    """
+    Aggrega la telemetria delle chiamate di un test ('generation_metrics' e 'evaluation.metrics'
+    di ogni risultato). Le risposte e i giudizi presi dalle cache non hanno telemetria e non costano.
+    Args:
+        results: Dizionario {question_id: risultato}.
+        elapsed_seconds: Durata dell'esecuzione, per calcolare le domande al minuto.
+        executed_questions: Domande eseguite in quella durata (default: tutte; meno se l'esecuzione è stata ripresa).
+        evaluation_calls: Metriche di chiamate di valutazione comuni a tutto il test (es. gli embedding).
+    Returns:
+        Un dizionario con token totali (prompt, completion, cached, total), costo stimato totale
+        e per fase, chiamate, tentativi ripetuti, errori per fase, valutazioni assegnate senza
+        chiamare il giudice (judge_calls_saved, vedi fast_path_utils), modello più usato per fase,
+        percentili di latenza per fase, durata e domande al minuto.
+    """
+    stages = {"generation": [], "evaluation": list(evaluation_calls or [])}
+    generation_errors = evaluation_errors = judge_calls_saved = 0
+    for result in results.values():
+        if result.get('generation_metrics'):
+            stages["generation"].append(result['generation_metrics'])
+        if result.get('generation_failed'):
+            generation_errors += 1
+        evaluation = result.get('evaluation')
+        if isinstance(evaluation, dict):
+            if evaluation.get('metrics'):
+                stages["evaluation"].append(evaluation['metrics'])
+            if evaluation.get('failed'):
+                evaluation_errors += 1
+            if evaluation.get('fast_path'):
+                judge_calls_saved += 1
+
+    calls = stages["generation"] + stages["evaluation"]
+    totals = {key: round(sum(m.get(key) or 0 for m in calls))
+              for key in ("prompt_tokens", "completion_tokens", "cached_tokens")}
+    totals["total_tokens"] = totals["prompt_tokens"] + totals["completion_tokens"]
+
+    def stage_cost(metrics):
+        costs = [m["cost"] for m in metrics if m.get("cost") is not None]
+        return sum(costs) if costs else None
+
+    generation_cost = stage_cost(stages["generation"])
+    evaluation_cost = stage_cost(stages["evaluation"])
+    known_costs = [c for c in (generation_cost, evaluation_cost) if c is not None]
+
+    executed = executed_questions if executed_questions is not None else len(results)
+    questions_per_minute = executed / elapsed_seconds * 60 if elapsed_seconds and executed else None
+    return {
+        "questions": len(results),
+        **totals,
+        "cost": sum(known_costs) if known_costs else None,
+        "generation_cost": generation_cost,
+        "evaluation_cost": evaluation_cost,
+        "unpriced_calls": sum(1 for m in calls if m.get("cost") is None),
+        "calls": len(calls),
+        "retries": sum(m.get("retries") or 0 for m in calls),
+        "generation_errors": generation_errors,
+        "evaluation_errors": evaluation_errors,
+        "judge_calls_saved": judge_calls_saved,
+        "generation_model": _most_common_model(stages["generation"]),
+        "evaluation_model": _most_common_model(stages["evaluation"]),
+        "latency": {
+            stage: _percentiles([m["latency"] for m in metrics if m.get("latency") is not None])
+            for stage, metrics in stages.items()
+        },
+        "elapsed_seconds": round(elapsed_seconds, 2) if elapsed_seconds is not None else None,
+        "questions_per_minute": round(questions_per_minute, 2) if questions_per_minute is not None else None
+    }
+
+
+def telemetry_timeseries(runs: pd.DataFrame, group_by: str = "generation_preset", freq: str = "D"):
+    """
+    Aggrega per periodo e per preset/modello la telemetria delle esecuzioni (vedi load_run_telemetry),
+    con operazioni vettoriali di pandas.
+    Args:
+        runs: Una riga per esecuzione, con timestamp (datetime) e le colonne di 'metrics'.
+        group_by: Colonna per cui raggruppare (es. "generation_preset" o "generation_model").
+        freq: Ampiezza dei periodi come frequenza pandas ("h", "D", "W", "M"); None aggrega l'intero intervallo.
+    Returns:
+        Un DataFrame con period (se freq è indicata), group, runs, questions, questions_per_minute, latency_p50/p95/p99
+        (media dei percentili delle esecuzioni pesata sulle domande), error_rate, retry_rate e
+        cost_per_100_questions.
+    """
+    if runs.empty:
+        return pd.DataFrame()
+    df = runs.assign(
+        group=runs[group_by].fillna("n/d"),
+        errors=runs['generation_errors'].fillna(0) + runs['evaluation_errors'].fillna(0),
+        # Domande eseguite nella durata misurata (meno delle totali se l'esecuzione è stata ripresa)
+        executed=runs['questions_per_minute'] * runs['elapsed_seconds'] / 60,
+        priced_questions=runs['questions'].where(runs['cost'].notna(), 0),
+        latency_weight=runs['questions'].where(runs['latency_p50'].notna(), 0)
+    )
+    for p in LATENCY_PERCENTILES:
+        df[f'weighted_p{p}'] = df[f'latency_p{p}'].fillna(0) * df['latency_weight']
+    keys = ['group']
+    if freq:
+        df['period'] = df['timestamp'].dt.to_period(freq).dt.start_time
+        keys = ['period', 'group']
+
+    grouped = df.groupby(keys).agg(
+        runs=('id', 'size'), questions=('questions', 'sum'), errors=('errors', 'sum'),
+        calls=('calls', 'sum'), retries=('retries', 'sum'), cost=('cost', 'sum'),
+        priced_questions=('priced_questions', 'sum'), executed=('executed', 'sum'),
+        elapsed_seconds=('elapsed_seconds', 'sum'), latency_weight=('latency_weight', 'sum'),
+        **{f'weighted_p{p}': (f'weighted_p{p}', 'sum') for p in LATENCY_PERCENTILES}
+    ).reset_index()
+
+    nan_if_zero = lambda column: grouped[column].where(grouped[column] > 0)
+    grouped['questions_per_minute'] = grouped['executed'] / nan_if_zero('elapsed_seconds') * 60
+    for p in LATENCY_PERCENTILES:
+        grouped[f'latency_p{p}'] = grouped[f'weighted_p{p}'] / nan_if_zero('latency_weight')
+    grouped['error_rate'] = grouped['errors'] / nan_if_zero('questions')
+    grouped['retry_rate'] = grouped['retries'] / nan_if_zero('calls')
+    grouped['cost_per_100_questions'] = grouped['cost'] / nan_if_zero('priced_questions') * 100
+    return grouped.drop(columns=['executed', 'latency_weight', 'priced_questions']
+                        + [f'weighted_p{p}' for p in LATENCY_PERCENTILES])
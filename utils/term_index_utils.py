@@ -0,0 +1,289 @@
+from collections import Counter
+
+from sqlalchemy import bindparam, text
+
+from .db_utils import get_engine
+from .bm25_utils import tokenize
+from .runtime_utils import logger
+
+# Campi delle domande inclusi nell'indice dei termini
+INDEXED_FIELDS = ("domanda", "risposta_attesa")
+# Lunghezza massima di un termine indicizzato (colonna term VARCHAR(100))
+MAX_TERM_LENGTH = 100
+# Domande lette e indicizzate per volta durante la ricostruzione completa dell'indice
+REBUILD_CHUNK_SIZE = 1000
+# Nome del lock MySQL (GET_LOCK) che serializza l'allineamento dell'indice tra sessioni e processi
+TERM_INDEX_LOCK = "llm_test_term_index"
+# Valori massimi per ogni clausola IN
+_IN_CHUNK_SIZE = 1000
+
+
+def document_terms(text_value: str):
+    """Frequenza dei termini di un testo, con i termini troncati alla lunghezza della colonna."""
+    return Counter(token[:MAX_TERM_LENGTH] for token in tokenize(text_value))
+
+
+def _chunks(values: list, size: int = _IN_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _reindex_field(conn, field: str, question_ids: list, new_terms: dict):
+    """
+    Sostituisce nell'indice i documenti di un campo per le domande indicate, aggiornando
+    frequenze documentali e statistiche del corpus con le sole differenze.
+    Args:
+        conn: Connessione con la transazione in corso.
+        field: Campo indicizzato (vedi INDEXED_FIELDS).
+        question_ids: Domande modificate o eliminate.
+        new_terms: Dizionario {question_id: Counter dei termini} delle domande ancora presenti;
+            le domande di question_ids assenti dal dizionario vengono rimosse dall'indice.
+    """
+    old_terms, old_lengths = {}, {}
+    for ids in _chunks(question_ids):
+        params = {'field': field, 'ids': ids}
+        postings = conn.execute(
+            text("SELECT question_id, term FROM term_index_postings WHERE field = :field AND question_id IN :ids")
+            .bindparams(bindparam('ids', expanding=True)),
+            params
+        ).fetchall()
+        for question_id, term in postings:
+            old_terms.setdefault(question_id, set()).add(term)
+        lengths = conn.execute(
+            text("SELECT question_id, length FROM term_index_documents WHERE field = :field AND question_id IN :ids")
+            .bindparams(bindparam('ids', expanding=True)),
+            params
+        ).fetchall()
+        old_lengths.update({question_id: length for question_id, length in lengths})
+        conn.execute(
+            text("DELETE FROM term_index_postings WHERE field = :field AND question_id IN :ids")
+            .bindparams(bindparam('ids', expanding=True)),
+            params
+        )
+        conn.execute(
+            text("DELETE FROM term_index_documents WHERE field = :field AND question_id IN :ids")
+            .bindparams(bindparam('ids', expanding=True)),
+            params
+        )
+
+    df_delta = Counter()
+    for terms in old_terms.values():
+        df_delta.subtract(terms)
+    for counts in new_terms.values():
+        df_delta.update(counts.keys())
+
+    postings = [
+        {'field': field, 'term': term, 'question_id': question_id, 'tf': tf}
+        for question_id, counts in new_terms.items() for term, tf in counts.items()
+    ]
+    if postings:
+        conn.execute(
+            text('''INSERT INTO term_index_postings (field, term, question_id, tf)
+                    VALUES (:field, :term, :question_id, :tf)'''),
+            postings
+        )
+    if new_terms:
+        conn.execute(
+            text("INSERT INTO term_index_documents (question_id, field, length) VALUES (:question_id, :field, :length)"),
+            [{'question_id': question_id, 'field': field, 'length': sum(counts.values())}
+             for question_id, counts in new_terms.items()]
+        )
+
+    changed = [{'field': field, 'term': term, 'df': delta} for term, delta in df_delta.items() if delta]
+    if changed:
+        conn.execute(
+            text('''INSERT INTO term_index_terms (field, term, df) VALUES (:field, :term, :df)
+                    ON DUPLICATE KEY UPDATE df = df + VALUES(df)'''),
+            changed
+        )
+        # I termini non più presenti in alcun documento escono dal vocabolario
+        removed = [row['term'] for row in changed if row['df'] < 0]
+        for terms in _chunks(removed):
+            conn.execute(
+                text("DELETE FROM term_index_terms WHERE field = :field AND term IN :terms AND df <= 0")
+                .bindparams(bindparam('terms', expanding=True)),
+                {'field': field, 'terms': terms}
+            )
+
+    documents_delta = len(new_terms) - len(old_lengths)
+    length_delta = sum(sum(counts.values()) for counts in new_terms.values()) - sum(old_lengths.values())
+    if documents_delta or length_delta:
+        conn.execute(
+            text('''INSERT INTO term_index_corpus (field, documents, total_length)
+                    VALUES (:field, :documents, :total_length)
+                    ON DUPLICATE KEY UPDATE documents = documents + VALUES(documents),
+                                            total_length = total_length + VALUES(total_length)'''),
+            {'field': field, 'documents': documents_delta, 'total_length': length_delta}
+        )
+
+
+def index_questions(conn, questions: list):
+    """
+    Aggiorna l'indice dei termini per domande nuove o modificate, nella transazione di conn.
+    Il costo dipende solo dal numero di domande modificate, non dalla dimensione della banca domande.
+    Args:
+        conn: Connessione con la transazione in cui le domande vengono scritte.
+        questions: Lista di dizionari con 'id' e i campi di INDEXED_FIELDS modificati;
+            i campi assenti non vengono reindicizzati.
+    """
+    for field in INDEXED_FIELDS:
+        changed = {str(q['id']): document_terms(q[field]) for q in questions if field in q}
+        if changed:
+            _reindex_field(conn, field, list(changed), changed)
+
+
+def remove_questions(conn, question_ids: list):
+    """Rimuove dall'indice dei termini le domande eliminate, nella transazione di conn."""
+    question_ids = [str(q_id) for q_id in question_ids]
+    if not question_ids:
+        return
+    for field in INDEXED_FIELDS:
+        _reindex_field(conn, field, question_ids, {})
+
+
+def _index_rows(conn, rows):
+    index_questions(conn, [
+        {'id': row[0], 'domanda': row[1] or "", 'risposta_attesa': row[2] or ""} for row in rows
+    ])
+
+
+def _rebuild(conn):
+    for table in ("term_index_postings", "term_index_terms", "term_index_documents", "term_index_corpus"):
+        conn.execute(text(f"DELETE FROM {table}"))
+    last_id = ""
+    while True:
+        rows = conn.execute(
+            text('''SELECT id, domanda, risposta_attesa FROM questions
+                    WHERE id > :last_id ORDER BY id LIMIT :limit'''),
+            {'last_id': last_id, 'limit': REBUILD_CHUNK_SIZE}
+        ).fetchall()
+        if not rows:
+            break
+        _index_rows(conn, rows)
+        last_id = rows[-1][0]
+
+
+def _catch_up(conn, synced_until):
+    """
+    Reindicizza le domande modificate dall'ultimo allineamento (reindicizzare una domanda già
+    aggiornata dall'applicazione non cambia l'indice) e allinea quelle aggiunte o eliminate
+    senza passare dall'applicazione.
+    """
+    last_id = ""
+    while True:
+        rows = conn.execute(
+            text('''SELECT id, domanda, risposta_attesa FROM questions
+                    WHERE (:synced_until IS NULL OR updated_at >= :synced_until) AND id > :last_id
+                    ORDER BY id LIMIT :limit'''),
+            {'synced_until': synced_until, 'last_id': last_id, 'limit': REBUILD_CHUNK_SIZE}
+        ).fetchall()
+        if not rows:
+            break
+        _index_rows(conn, rows)
+        last_id = rows[-1][0]
+
+    field = INDEXED_FIELDS[-1]
+    questions = conn.execute(text("SELECT COUNT(*) FROM questions")).scalar() or 0
+    indexed = conn.execute(
+        text("SELECT documents FROM term_index_corpus WHERE field = :field"), {'field': field}
+    ).scalar() or 0
+    if questions == indexed:
+        return
+    orphans = conn.execute(
+        text('''SELECT d.question_id FROM term_index_documents d
+                LEFT JOIN questions q ON q.id = d.question_id
+                WHERE d.field = :field AND q.id IS NULL'''),
+        {'field': field}
+    ).fetchall()
+    remove_questions(conn, [row[0] for row in orphans])
+    missing = conn.execute(
+        text('''SELECT q.id, q.domanda, q.risposta_attesa FROM questions q
+                LEFT JOIN term_index_documents d ON d.question_id = q.id AND d.field = :field
+                WHERE d.question_id IS NULL'''),
+        {'field': field}
+    ).fetchall()
+    for rows in _chunks(missing, REBUILD_CHUNK_SIZE):
+        _index_rows(conn, rows)
+
+
+def _sync_term_index(full_rebuild: bool = False):
+    """
+    Allinea l'indice alla tabella questions sotto un lock MySQL (GET_LOCK), così più sessioni
+    non lo ricostruiscono contemporaneamente; se il lock è occupato l'allineamento viene lasciato
+    alla sessione che lo detiene.
+    Returns:
+        True se l'allineamento è stato eseguito.
+    """
+    with get_engine().connect() as conn:
+        locked = conn.execute(text("SELECT GET_LOCK(:name, 0)"), {'name': TERM_INDEX_LOCK}).scalar()
+        conn.commit()
+        if not locked:
+            return False
+        try:
+            # La transazione (e il suo snapshot) inizia dopo aver ottenuto il lock e viene confermata
+            # prima di rilasciarlo: chi lo ottiene dopo vede già l'indice e il marcatore aggiornati
+            with conn.begin():
+                state = conn.execute(text("SELECT synced_until FROM term_index_state WHERE id = 1")).fetchone()
+                latest = conn.execute(text("SELECT MAX(updated_at) FROM questions")).scalar()
+                if full_rebuild or state is None:
+                    logger.info("Ricostruzione completa dell'indice dei termini in corso")
+                    _rebuild(conn)
+                else:
+                    _catch_up(conn, state[0])
+                conn.execute(
+                    text('''INSERT INTO term_index_state (id, synced_until) VALUES (1, :latest)
+                            ON DUPLICATE KEY UPDATE synced_until = VALUES(synced_until)'''),
+                    {'latest': latest if latest is not None else (state[0] if state else None)}
+                )
+        finally:
+            conn.execute(text("SELECT RELEASE_LOCK(:name)"), {'name': TERM_INDEX_LOCK})
+            conn.commit()
+    return True
+
+
+def rebuild_term_index():
+    """Ricostruisce da zero l'indice dei termini leggendo la tabella questions a blocchi."""
+    return _sync_term_index(full_rebuild=True)
+
+
+def ensure_term_index():
+    """
+    Allinea l'indice dei termini alle domande, anche se modificate fuori dall'applicazione:
+    al primo avvio lo ricostruisce da zero, poi reindicizza solo le domande con updated_at
+    successivo all'ultimo allineamento e quelle aggiunte o eliminate (vedi _catch_up).
+    """
+    return _sync_term_index()
+
+
+def load_corpus_statistics(field: str = "risposta_attesa", texts: list = None):
+    """
+    Statistiche del corpus di un campo indicizzato, lette dall'indice senza scorrere le domande.
+    Args:
+        field: Campo indicizzato (vedi INDEXED_FIELDS).
+        texts: Testi di cui servono le frequenze documentali; se None non vengono lette.
+    Returns:
+        Dizionario con 'documents', 'avgdl' e 'document_frequencies' ({termine: df}),
+        o None se l'indice è vuoto.
+    """
+    terms = sorted({term for text_value in texts or [] for term in document_terms(text_value)})
+    with get_engine().begin() as conn:
+        row = conn.execute(
+            text("SELECT documents, total_length FROM term_index_corpus WHERE field = :field"),
+            {'field': field}
+        ).fetchone()
+        if not row or not row[0]:
+            return None
+        document_frequencies = {}
+        for chunk in _chunks(terms):
+            rows = conn.execute(
+                text("SELECT term, df FROM term_index_terms WHERE field = :field AND term IN :terms")
+                .bindparams(bindparam('terms', expanding=True)),
+                {'field': field, 'terms': chunk}
+            ).fetchall()
+            document_frequencies.update({term: df for term, df in rows})
+    documents, total_length = int(row[0]), int(row[1] or 0)
+    return {
+        'documents': documents,
+        'avgdl': total_length / documents,
+        'document_frequencies': document_frequencies
+    }
@@ -366,3 +366,91 @@ def create_metrics_container(metrics_data):
     
     # Renderizza l'HTML
     st.markdown(metrics_html, unsafe_allow_html=True)
+
+def format_cost(cost):
+    """Formatta un costo stimato in USD ("n/d" se il modello non ha un prezzo in tabella)."""
+    if cost is None:
+        return "n/d"
+    return f"${cost:.4f}" if cost < 1 else f"${cost:.2f}"
+
+def format_call_metrics(metrics):
+    """
+    Riassume in una riga la telemetria di una chiamata API (vedi telemetry_utils.call_metrics).
+    
+    Parametri:
+    - metrics: Dizionario con token, latenza, tentativi e costo della chiamata
+    """
+    latency = metrics.get('latency')
+    text = (f"Token: {metrics.get('prompt_tokens', 0):.0f} in ({metrics.get('cached_tokens', 0):.0f} in cache) / "
+            f"{metrics.get('completion_tokens', 0):.0f} out · "
+            f"Latenza: {f'{latency:.2f} s' if latency is not None else 'n/d'} · "
+            f"Tentativi ripetuti: {metrics.get('retries', 0)} · "
+            f"Costo: {format_cost(metrics.get('cost'))}")
+    if metrics.get('batch_size'):
+        text += f" (quota di una chiamata per {metrics['batch_size']} risposte)"
+    return text
+
+def show_run_telemetry(run_metrics):
+    """
+    Mostra la telemetria aggregata di un'esecuzione: token, costo stimato, percentili di latenza e velocità.
+    
+    Parametri:
+    - run_metrics: Dizionario prodotto da telemetry_utils.aggregate_run_metrics
+    """
+    if not run_metrics:
+        return
+    cols = st.columns(4)
+    cols[0].metric("Token Totali", f"{run_metrics['total_tokens']:,}".replace(",", "."),
+                   help=f"Input: {run_metrics['prompt_tokens']} (in cache: {run_metrics['cached_tokens']}) · "
+                        f"Output: {run_metrics['completion_tokens']}")
+    cols[1].metric("Costo Stimato", format_cost(run_metrics.get('cost')),
+                   help=f"Generazione: {format_cost(run_metrics.get('generation_cost'))} · "
+                        f"Valutazione: {format_cost(run_metrics.get('evaluation_cost'))}")
+    qpm = run_metrics.get('questions_per_minute')
+    cols[2].metric("Domande al Minuto", f"{qpm:.1f}" if qpm is not None else "n/d")
+    cols[3].metric("Tentativi Ripetuti", run_metrics.get('retries', 0))
+
+    latency_rows = []
+    for stage, label in (("generation", "Generazione"), ("evaluation", "Valutazione")):
+        percentiles = run_metrics.get('latency', {}).get(stage, {})
+        if any(value is not None for value in percentiles.values()):
+            latency_rows.append({'Fase': label, **{p.upper(): f"{v:.2f} s" if v is not None else "n/d"
+                                                   for p, v in percentiles.items()}})
+    if latency_rows:
+        st.caption("Latenza delle chiamate API")
+        st.table(latency_rows)
+    if run_metrics.get('judge_calls_saved'):
+        st.info(f"Chiamate al giudice LLM risparmiate dalla valutazione rapida: {run_metrics['judge_calls_saved']}"
+                f"/{run_metrics['questions']} risposte valutate con regole deterministiche.")
+    if run_metrics.get('unpriced_calls'):
+        st.caption(f"{run_metrics['unpriced_calls']} chiamate usano modelli senza prezzo in tabella "
+                   f"(MODEL_PRICES) e sono escluse dal costo stimato.")
+
+
+# Descrizione del motivo di arresto di un'esecuzione a campione (vedi sampling_utils.SampledScore)
+SAMPLING_STOP_REASONS = {
+    "precision": "intervallo di confidenza entro l'ampiezza richiesta",
+    "budget": "budget di domande esaurito",
+    "exhausted": "domande del set esaurite"
+}
+
+
+def show_sampling_summary(result_data):
+    """
+    Mostra, per un risultato ottenuto da un'esecuzione a campione, l'intervallo di confidenza
+    del punteggio medio stimato e le domande effettivamente eseguite.
+    
+    Parametri:
+    - result_data: Record del test salvato da finalize_run
+    """
+    if not result_data.get('sampled'):
+        return
+    sampling = result_data.get('sampling', {})
+    interval = result_data.get('confidence_interval', {})
+    st.info(
+        f"Esecuzione a campione: {sampling.get('questions_evaluated', 0)}/{sampling.get('questions_total', 0)} "
+        f"domande eseguite ({SAMPLING_STOP_REASONS.get(sampling.get('stop_reason'), 'n/d')}). "
+        f"Punteggio medio stimato {result_data.get('avg_score', 0):.2f}%, intervallo di confidenza "
+        f"al {interval.get('confidence', 0):.0%} ({interval.get('method', 'n/d')}): "
+        f"{interval.get('low', 0):.2f}% – {interval.get('high', 0):.2f}%"
+    )